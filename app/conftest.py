@@ -0,0 +1,48 @@
+import httpx
+import pytest
+
+from internal import stripe_module
+
+import cache_module
+import store_module
+import client_module
+
+class FakeStripe:
+	"""
+	Serves canned Stripe lists, objects and error statuses and records the requests made
+	"""
+
+	def __init__(self):
+		self.lists = {}
+		self.objects = {}
+		self.errors = {}
+		self.requests = []
+
+	def __call__(self, request: httpx.Request) -> httpx.Response:
+		self.requests.append(request)
+
+		if (request.url.path in self.errors):
+			return httpx.Response(self.errors[request.url.path], json=dict(error=dict(type='api_error', message='Stripe is unavailable')))
+		elif (request.url.path in self.objects):
+			return httpx.Response(200, json=self.objects[request.url.path])
+		elif (request.url.path in self.lists or request.method == 'GET'):
+			return httpx.Response(200, json=dict(object='list', data=self.lists.get(request.url.path, []), has_more=False))
+
+		return httpx.Response(404, json=dict(error=dict(type='invalid_request_error', message='Unrecognized request URL')))
+
+	def paths(self) -> list[str]:
+		return [request.url.path for request in self.requests]
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+	monkeypatch.setenv('REVENUT_STORE_PATH', str(tmp_path / 'revenut.db'))
+	store_module.default_store.cache_clear()
+	yield store_module.default_store()
+	store_module.default_store.cache_clear()
+
+@pytest.fixture
+def fake_stripe(store, monkeypatch):
+	fake = FakeStripe()
+	cache_module.default_cache.cache_clear()
+	monkeypatch.setattr(stripe_module, 'default_client', lambda: client_module.RevenutStripeClient(api_key='sk_test', transport=httpx.MockTransport(fake)))
+	return fake
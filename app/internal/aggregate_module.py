@@ -0,0 +1,200 @@
+from typing import Iterable
+
+import numpy
+
+class RevenutArrayBuilder:
+	"""
+	Growable preallocated array filled page by page so columns can be built without retaining the fetched records
+	"""
+
+	__slots__ = ('dtype', '_array', '_size')
+
+	def __init__(self, dtype: numpy.dtype, capacity: int = 1024):
+		self.dtype = numpy.dtype(dtype)
+		self._array = numpy.empty(capacity, dtype=self.dtype)
+		self._size = 0
+
+	def extend(self, rows: Iterable) -> None:
+		"""
+		Appends rows, doubling the capacity when full
+
+		:param rows: iterable of values (or tuples for structured types)
+		"""
+
+		rows = numpy.fromiter(rows, dtype=self.dtype)
+		size = self._size + len(rows)
+
+		if (size > len(self._array)):
+			array = numpy.empty(max(size, 2 * len(self._array)), dtype=self.dtype)
+			array[:self._size] = self._array[:self._size]
+			self._array = array
+
+		self._array[self._size:size] = rows
+		self._size = size
+
+	def array(self) -> numpy.ndarray:
+		"""
+		Returns the filled part of the array
+		"""
+		return self._array[:self._size]
+
+	def __len__(self) -> int:
+		return self._size
+
+class RevenutChargeColumns:
+	"""
+	Columnar projection of charges sorted by creation time
+	Window totals are answered with binary searches over cumulative sums instead of filtering every record
+	"""
+
+	__slots__ = ('created', 'amount', 'paid', '_amount_total', '_count_total')
+
+	DTYPE = numpy.dtype([('created', numpy.int64), ('amount', numpy.int64), ('paid', numpy.bool_)])
+
+	def __init__(self, created: numpy.ndarray, amount: numpy.ndarray, paid: numpy.ndarray):
+		order = numpy.argsort(created, kind='stable')
+		self.created = created[order]
+		self.amount = amount[order]
+		self.paid = paid[order]
+
+		# prefix sums of successful charges so any window total is the difference of two entries
+		self._amount_total = numpy.concatenate(([0], numpy.cumsum(numpy.where(self.paid, self.amount, 0))))
+		self._count_total = numpy.concatenate(([0], numpy.cumsum(self.paid, dtype=numpy.int64)))
+
+	@classmethod
+	def from_rows(cls, rows: Iterable[tuple]) -> 'RevenutChargeColumns':
+		"""
+		Returns columns built from `(created, amount, paid)` tuples
+
+		:param rows: iterable of tuples such as a SQLite cursor
+		"""
+
+		records = numpy.fromiter(rows, dtype=cls.DTYPE)
+
+		return cls(records['created'], records['amount'], records['paid'])
+
+	def __len__(self) -> int:
+		return len(self.created)
+
+	def windows(self, windows: list[tuple[float, float]]) -> list[dict]:
+		"""
+		Returns the dollar amount and count of successful charges for every window in one vectorized pass
+
+		:param windows: collection of `(epochStart, epochEnd)` tuples, both inclusive
+		"""
+
+		bounds = numpy.asarray(windows, dtype=numpy.float64).reshape(-1, 2)
+		start = numpy.searchsorted(self.created, bounds[:, 0], side='left')
+		end = numpy.searchsorted(self.created, bounds[:, 1], side='right')
+		end = numpy.maximum(start, end)
+
+		amounts = (self._amount_total[end] - self._amount_total[start]) / 100
+		counts = self._count_total[end] - self._count_total[start]
+
+		return [dict(amount=float(amount), count=int(count)) for amount, count in zip(amounts, counts)]
+
+class RevenutSubscriptionColumns:
+	"""
+	Columnar projection of subscriptions with only the fields used for forecasts
+	"""
+
+	__slots__ = ('created', 'current_period_end', 'amount', 'status')
+
+	STATUSES = ['active', 'trialing', 'canceled', 'incomplete', 'incomplete_expired', 'past_due', 'unpaid', 'paused']
+	DTYPE = numpy.dtype([('created', numpy.float64), ('current_period_end', numpy.float64), ('amount', numpy.int64), ('status', numpy.int8)])
+
+	def __init__(self, created: numpy.ndarray, current_period_end: numpy.ndarray, amount: numpy.ndarray, status: numpy.ndarray):
+		self.created = created
+		self.current_period_end = current_period_end
+		self.amount = amount
+		self.status = status
+
+	@classmethod
+	def status_code(cls, status: str) -> int:
+		"""
+		Returns the compact code of a subscription status
+		"""
+		return cls.STATUSES.index(status) if status in cls.STATUSES else -1
+
+	@classmethod
+	def row(cls, created: float, current_period_end: float, amount: int | None, status: str) -> tuple:
+		"""
+		Returns the row of a subscription in the columnar type
+		"""
+		return (created, current_period_end, amount or 0, cls.status_code(status))
+
+	@classmethod
+	def builder(cls) -> RevenutArrayBuilder:
+		"""
+		Returns a builder receiving subscription rows page by page
+		"""
+		return RevenutArrayBuilder(cls.DTYPE)
+
+	@classmethod
+	def from_array(cls, records: numpy.ndarray) -> 'RevenutSubscriptionColumns':
+		"""
+		Returns columns of a structured array of subscription rows
+		"""
+		return cls(records['created'], records['current_period_end'], records['amount'], records['status'])
+
+	@classmethod
+	def from_rows(cls, rows: Iterable[tuple]) -> 'RevenutSubscriptionColumns':
+		"""
+		Returns columns built from `(created, current_period_end, amount, status)` tuples
+		"""
+		return cls.from_array(numpy.fromiter((cls.row(*row) for row in rows), dtype=cls.DTYPE))
+
+	@classmethod
+	def from_subscriptions(cls, subscriptions: Iterable) -> 'RevenutSubscriptionColumns':
+		"""
+		Returns columns projected from subscription records
+		"""
+		return cls.from_rows((s.created, s.current_period_end, s.amount, s.status) for s in subscriptions)
+
+	def __len__(self) -> int:
+		return len(self.created)
+
+	def where(self, *statuses: str) -> numpy.ndarray:
+		"""
+		Returns a mask of subscriptions in any of the requested statuses
+		"""
+		return numpy.isin(self.status, [self.status_code(status) for status in statuses])
+
+	def total(self, mask: numpy.ndarray) -> dict:
+		"""
+		Returns the dollar amount and count of masked subscriptions
+		"""
+		return dict(amount=float(self.amount[mask].sum() / 100), count=int(numpy.count_nonzero(mask)))
+
+class RevenutCustomerColumns:
+	"""
+	Columnar projection of customers sorted by creation time
+	"""
+
+	__slots__ = ('created',)
+
+	def __init__(self, created: numpy.ndarray):
+		self.created = numpy.sort(created)
+
+	@classmethod
+	def builder(cls) -> RevenutArrayBuilder:
+		"""
+		Returns a builder receiving customer creation times page by page
+		"""
+		return RevenutArrayBuilder(numpy.float64)
+
+	@classmethod
+	def from_customers(cls, customers: Iterable) -> 'RevenutCustomerColumns':
+		"""
+		Returns columns projected from customer records
+		"""
+		return cls(numpy.fromiter((c.created for c in customers), dtype=numpy.float64))
+
+	def __len__(self) -> int:
+		return len(self.created)
+
+	def count(self, epochStart: float, epochEnd: float) -> int:
+		"""
+		Returns the number of customers created within a timeframe, both bounds inclusive
+		"""
+		return int(max(0, numpy.searchsorted(self.created, epochEnd, side='right') - numpy.searchsorted(self.created, epochStart, side='left')))
@@ -0,0 +1,243 @@
+from aggregate_module import RevenutChargeColumns
+from store_module import RevenutAnalyticsMonth, RevenutStore, RevenutSubscription
+from timezone_module import RevenutTimezone
+from pydantic import BaseModel
+
+import datetime
+import dateutil.relativedelta
+import time
+
+import numpy
+
+# subscriptions in these statuses never started paying
+ANALYTICS_UNPAID_STATUSES = ['incomplete', 'incomplete_expired']
+# billing periods per month of every plan interval
+ANALYTICS_INTERVAL_MONTHLY = {'day': 365 / 12, 'week': 52 / 12, 'month': 1, 'year': 1 / 12}
+
+class RevenutMRRPeriod(BaseModel):
+	"""
+	Monthly recurring revenue of an account at the end of a month along with its movements during the month
+	"""
+
+	DateStart:datetime.date
+	VolumeMRR:float = 0
+	VolumeMRRNew:float = 0
+	VolumeMRRChurned:float = 0
+	VolumeMRRNetNew:float = 0
+	VolumeGross:float = 0
+	CountSubscribers:int = 0
+
+class RevenutChurnPeriod(BaseModel):
+	"""
+	Subscribers and recurring revenue of an account lost during a month relative to the start of the month
+	"""
+
+	DateStart:datetime.date
+	CountSubscribersStart:int = 0
+	CountSubscribersNew:int = 0
+	CountChurned:int = 0
+	CountChurnedPercent:float = 0
+	VolumeMRRStart:float = 0
+	VolumeMRRChurned:float = 0
+	VolumeMRRChurnedPercent:float = 0
+
+class RevenutCohortPeriod(BaseModel):
+	"""
+	Trials of the subscriptions created during a month and how many of them converted to paid subscriptions
+	"""
+
+	DateStart:datetime.date
+	CountTrials:int = 0
+	CountTrialsConverted:int = 0
+	CountTrialsPending:int = 0
+	CountTrialsConvertedPercent:float = 0
+
+class RevenutAnalytics(BaseModel):
+	"""
+	Monthly analytics of an account answered from months computed out of the local store
+	"""
+
+	AccountID:str
+	TimezonePreference:str
+	DateFrom:datetime.date
+	DateTo:datetime.date
+
+class RevenutAnalyticsMRR(RevenutAnalytics):
+	Periods:list[RevenutMRRPeriod] = []
+
+	@classmethod
+	def from_months(cls, account_id: str, timezone: str, months: list[RevenutAnalyticsMonth]) -> 'RevenutAnalyticsMRR':
+		"""
+		:param months: computed months, the first one only giving the MRR the range starts with
+		"""
+
+		periods = [
+			RevenutMRRPeriod(
+				DateStart=month.month
+				, VolumeMRR=month.mrr / 100
+				, VolumeMRRNew=month.mrr_new / 100
+				, VolumeMRRChurned=month.mrr_churned / 100
+				, VolumeMRRNetNew=(month.mrr - previous.mrr) / 100
+				, VolumeGross=month.gross / 100
+				, CountSubscribers=month.subscribers
+			)
+			for previous, month in zip(months, months[1:])
+		]
+
+		return cls(AccountID=account_id, TimezonePreference=timezone, DateFrom=months[1].month, DateTo=months[-1].month, Periods=periods)
+
+class RevenutAnalyticsChurn(RevenutAnalytics):
+	Periods:list[RevenutChurnPeriod] = []
+
+	@classmethod
+	def from_months(cls, account_id: str, timezone: str, months: list[RevenutAnalyticsMonth]) -> 'RevenutAnalyticsChurn':
+		"""
+		:param months: computed months, the first one only giving the subscribers the range starts with
+		"""
+
+		periods = [
+			RevenutChurnPeriod(
+				DateStart=month.month
+				, CountSubscribersStart=previous.subscribers
+				, CountSubscribersNew=month.subscribers_new
+				, CountChurned=month.churned
+				, CountChurnedPercent=previous.subscribers and month.churned / previous.subscribers * 100.0
+				, VolumeMRRStart=previous.mrr / 100
+				, VolumeMRRChurned=month.mrr_churned / 100
+				, VolumeMRRChurnedPercent=previous.mrr and month.mrr_churned / previous.mrr * 100.0
+			)
+			for previous, month in zip(months, months[1:])
+		]
+
+		return cls(AccountID=account_id, TimezonePreference=timezone, DateFrom=months[1].month, DateTo=months[-1].month, Periods=periods)
+
+class RevenutAnalyticsCohorts(RevenutAnalytics):
+	Periods:list[RevenutCohortPeriod] = []
+
+	@classmethod
+	def from_months(cls, account_id: str, timezone: str, months: list[RevenutAnalyticsMonth]) -> 'RevenutAnalyticsCohorts':
+		"""
+		:param months: computed months, the first one being outside of the range
+		"""
+
+		periods = [
+			RevenutCohortPeriod(
+				DateStart=month.month
+				, CountTrials=month.trials
+				, CountTrialsConverted=month.converted
+				, CountTrialsPending=month.pending
+				# trials still running have not converted nor failed yet
+				, CountTrialsConvertedPercent=(month.trials - month.pending) and month.converted / (month.trials - month.pending) * 100.0
+			)
+			for month in months[1:]
+		]
+
+		return cls(AccountID=account_id, TimezonePreference=timezone, DateFrom=months[1].month, DateTo=months[-1].month, Periods=periods)
+
+def analytics_months(subscriptions: 'pandas.DataFrame', charges: RevenutChargeColumns, months: list[tuple[datetime.date, int, int]], now: float) -> list[RevenutAnalyticsMonth]:
+	"""
+	Returns the analytics of months computed in one vectorized pass over the subscriptions and charges of an account
+	Subscriptions are valued at their current plan amount over their whole life as the store keeps no plan history
+
+	:param subscriptions: frame of stored subscriptions with the fields of `RevenutSubscription`
+	:param charges: columns of the charges created since the first month
+	:param months: collection of `(firstDay, epochStart, epochNextStart)` tuples in ascending order
+	:param now: current Epoch timestamp, the end of the current month
+	"""
+
+	import pandas
+
+	starts = numpy.array([start for _, start, _ in months], dtype=numpy.float64)
+	ends = numpy.array([end for _, _, end in months], dtype=numpy.float64)
+	s = subscriptions
+
+	# subscriptions pay from the end of their trial until they end, canceled ones without an end date ended when canceled
+	paidFrom = numpy.fmax(s['created'].to_numpy(dtype=numpy.float64), s['trial_end'].to_numpy(dtype=numpy.float64, na_value=numpy.nan))
+	endedAt = s['ended_at'].fillna(s['canceled_at'].where(s['status'] == 'canceled')).to_numpy(dtype=numpy.float64, na_value=numpy.inf)
+	paying = ~s['status'].isin(ANALYTICS_UNPAID_STATUSES).to_numpy() & (paidFrom < endedAt)
+	mrr = (s['amount'] * s['interval'].map(ANALYTICS_INTERVAL_MONTHLY).fillna(0) / s['interval_count'].clip(lower=1)).to_numpy(dtype=numpy.float64)
+
+	# one column per month of the subscriptions paying at its last instant
+	instants = numpy.minimum(ends, now) - 1
+	active = paying[:, None] & (paidFrom[:, None] <= instants) & (endedAt[:, None] > instants)
+
+	def month_of(epochs: numpy.ndarray) -> numpy.ndarray:
+		index = numpy.searchsorted(starts, epochs, side='right') - 1
+		return numpy.where((index >= 0) & (epochs < ends[-1]), index, -1)
+
+	frame = pandas.DataFrame(dict(
+		mrr=mrr
+		, started=numpy.where(paying & (paidFrom <= now), month_of(paidFrom), -1)
+		, ended=numpy.where(paying & numpy.isfinite(endedAt), month_of(endedAt), -1)
+		, cohort=numpy.where(s['trial_start'].notna().to_numpy(), month_of(s['created'].to_numpy(dtype=numpy.float64)), -1)
+		, converted=paying & (s['trial_end'].to_numpy(dtype=numpy.float64, na_value=numpy.inf) <= now)
+		, pending=(s['trial_end'].to_numpy(dtype=numpy.float64, na_value=-numpy.inf) > now) & (endedAt > now)
+	))
+
+	index = pandas.RangeIndex(len(months))
+	started = frame[frame['started'] >= 0].groupby('started')['mrr'].agg(['sum', 'count']).reindex(index, fill_value=0)
+	ended = frame[frame['ended'] >= 0].groupby('ended')['mrr'].agg(['sum', 'count']).reindex(index, fill_value=0)
+	cohorts = frame[frame['cohort'] >= 0].groupby('cohort').agg(trials=('cohort', 'size'), converted=('converted', 'sum'), pending=('pending', 'sum')).reindex(index, fill_value=0)
+	gross = charges.windows([(start, end - 1) for _, start, end in months])
+
+	return [
+		RevenutAnalyticsMonth(
+			day.isoformat()
+			, int(round(mrr @ active[:, i]))
+			, int(round(started['sum'].iat[i]))
+			, int(round(ended['sum'].iat[i]))
+			, int(active[:, i].sum())
+			, int(started['count'].iat[i])
+			, int(ended['count'].iat[i])
+			, int(round(gross[i]['amount'] * 100))
+			, int(cohorts['trials'].iat[i])
+			, int(cohorts['converted'].iat[i])
+			, int(cohorts['pending'].iat[i])
+		)
+		for i, (day, _, _) in enumerate(months)
+	]
+
+def refresh_analytics(store: RevenutStore, account_id: str, timezone: str, dateFrom: datetime.date) -> list[RevenutAnalyticsMonth]:
+	"""
+	Returns the analytics of an account from a month to the current one, only recomputing the months from the first one affected by records saved since the last call,
+	never computed or with trials still running, the current month always being recomputed
+	Runs in a thread off the event loop, the analytics being written through the writer queue of the store like its other writes
+
+	:param store: local record store
+	:param account_id: stripe account identifier
+	:param timezone: timezone identifier the months are local to
+	:param dateFrom: first day of the first month
+	"""
+
+	# pandas is only imported by the workers answering analytics
+	import pandas
+
+	local = RevenutTimezone(timezone)
+	hours, version = store.changes(account_id, store.cursor(account_id, f'analytics:{timezone}') or 0)
+
+	# a record changed in a month changes the subscriptions of every later month
+	if (hours):
+		store.queued(store.delete_analytics, account_id, timezone, datetime.datetime.fromtimestamp(min(hours) * 3600, local.zone).date().replace(day=1).isoformat())
+
+	months = []
+	day = dateFrom
+
+	while (day <= local.month_start()):
+		following = day + dateutil.relativedelta.relativedelta(months=1)
+		months.append((day, local.day(day)[0], local.day(following)[0]))
+		day = following
+
+	saved = {month.month: month for month in store.analytics(account_id, timezone, dateFrom.isoformat(), local.month_start().isoformat())}
+	stale = [i for i, (day, _, _) in enumerate(months) if day.isoformat() not in saved or saved[day.isoformat()].pending or day == local.month_start()]
+
+	# the current month is always stale so months are recomputed from the first stale one on
+	computed = analytics_months(
+		pandas.DataFrame.from_records(store.subscriptions(account_id), columns=list(RevenutSubscription._fields))
+		, store.charge_columns(account_id, months[stale[0]][1])
+		, months[stale[0]:]
+		, time.time()
+	)
+	saved.update((month.month, month) for month in computed)
+	store.queued(store.set_analytics, account_id, timezone, computed, version)
+
+	return [saved[day.isoformat()] for day, _, _ in months]
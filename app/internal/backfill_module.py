@@ -0,0 +1,36 @@
+from stripe_module import RevenutStripe
+from client_module import close_client
+
+import argparse
+import asyncio
+import time
+
+async def backfill(accounts: list[str], epochStart: int) -> None:
+	"""
+	Syncs the history of accounts one after another, each with concurrent time shards
+	"""
+
+	rStripe = RevenutStripe()
+
+	try:
+		for account_id in accounts:
+			start = time.perf_counter()
+			await rStripe.backfill(account_id, epochStart)
+			print(f'{account_id}: {time.perf_counter() - start:.1f}s')
+	finally:
+		await close_client()
+
+def main() -> None:
+	"""
+	Backfill the history of connected accounts into the local store
+	"""
+
+	parser = argparse.ArgumentParser(description='Backfill the history of connected accounts into the local store')
+	parser.add_argument('accounts', nargs='+', help='stripe account identifiers')
+	parser.add_argument('--days', type=int, default=365, help='number of days of history to sync')
+	args = parser.parse_args()
+
+	asyncio.run(backfill(args.accounts, int(time.time()) - args.days * 24 * 60 * 60))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,360 @@
+import argparse
+import asyncio
+import collections
+import datetime
+import json
+import os
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+
+import httpx
+import numpy
+
+from hypercorn.config import Config
+from hypercorn.asyncio import serve
+
+APP_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_PATH = os.path.join(os.path.dirname(APP_PATH), '.benchmarks', 'results.jsonl')
+
+class RevenutFakeStripe:
+	"""
+	ASGI stand-in for the Stripe API serving synthetic connected accounts with a configurable latency and page size
+	Account `acct_<n>` holds `n` charges and `n // 10` customers and subscriptions created over the last `days` days
+	"""
+
+	PREFIXES = {'/v1/charges': 'ch', '/v1/customers': 'cus', '/v1/subscriptions': 'sub'}
+	STATUSES = ('active', 'trialing', 'canceled')
+
+	def __init__(self, latency: float = 0.0, page_size: int = 100, days: int = 365):
+		self.latency = latency
+		self.page_size = page_size
+		self.days = days
+		self.now = int(time.time())
+		self.calls: collections.Counter[str] = collections.Counter()
+		self._created: dict[tuple[str, str], numpy.ndarray] = {}
+
+	async def __call__(self, scope: dict, receive, send) -> None:
+		if (scope['type'] == 'lifespan'):
+			while True:
+				message = await receive()
+
+				if (message['type'] == 'lifespan.startup'):
+					await send({'type': 'lifespan.startup.complete'})
+				elif (message['type'] == 'lifespan.shutdown'):
+					await send({'type': 'lifespan.shutdown.complete'})
+					return
+
+		headers = dict(scope['headers'])
+		account_id = headers.get(b'stripe-account', b'').decode() or scope['path'].rpartition('/')[2]
+		params = {key: values[-1] for key, values in urllib.parse.parse_qs(scope['query_string'].decode()).items()}
+		self.calls[account_id] += 1
+
+		if (self.latency):
+			await asyncio.sleep(self.latency)
+
+		status, body = self.respond(scope['method'], scope['path'], account_id, params)
+		content = json.dumps(body).encode()
+
+		await send({'type': 'http.response.start', 'status': status, 'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(content)).encode())]})
+		await send({'type': 'http.response.body', 'body': content})
+
+	def respond(self, method: str, path: str, account_id: str, params: dict) -> tuple[int, dict]:
+		"""
+		Returns the status and JSON body answering a request
+		"""
+
+		if (path in self.PREFIXES):
+			return 200, self.page(path, account_id, params)
+		elif (path == '/v1/events'):
+			return 200, dict(object='list', data=[], has_more=False)
+		elif (path.startswith('/v1/accounts/')):
+			return 200, dict(id=account_id, object='account', business_profile=dict(name=f'Benchmark {account_id}'), settings=dict(branding=dict(icon=f'file_{account_id}')))
+		elif (path == '/v1/file_links' and method == 'POST'):
+			return 200, dict(id=f'link_{account_id}', object='file_link', url=f'https://files.stripe.com/links/{account_id}')
+
+		return 404, dict(error=dict(type='invalid_request_error', message=f'Unrecognized request URL ({method}: {path})'))
+
+	def created(self, path: str, account_id: str) -> numpy.ndarray:
+		"""
+		Returns the ascending creation times of the records of an account, generated once
+		"""
+
+		key = (path, account_id)
+
+		if (key not in self._created):
+			count = int(account_id.removeprefix('acct_')) if account_id.removeprefix('acct_').isdigit() else 0
+			count = count if path == '/v1/charges' else count // 10
+			self._created[key] = numpy.linspace(self.now - self.days * 24 * 60 * 60, self.now, count, dtype=numpy.int64)
+
+		return self._created[key]
+
+	def page(self, path: str, account_id: str, params: dict) -> dict:
+		"""
+		Returns a page of a list newest first, honoring the `created` range, the `status` of subscriptions, `starting_after` and `limit`
+		The `current_period_end` filter of subscriptions is ignored as every synthetic subscription renews within a month
+		"""
+
+		created = self.created(path, account_id)
+		indices = numpy.arange(len(created))
+
+		if (path == '/v1/subscriptions' and params.get('status', 'all') != 'all'):
+			indices = indices[indices % len(self.STATUSES) == self.STATUSES.index(params['status'])] if params['status'] in self.STATUSES else indices[:0]
+
+		lo = numpy.searchsorted(created[indices], int(params.get('created[gte]', 0)), side='left')
+		hi = numpy.searchsorted(created[indices], int(params['created[lt]']), side='left') if 'created[lt]' in params else len(indices)
+
+		if ('starting_after' in params):
+			hi = min(hi, numpy.searchsorted(indices, int(params['starting_after'].rpartition('_')[2])))
+
+		limit = min(int(params.get('limit', 10)), self.page_size)
+		start = max(lo, hi - limit)
+		data = [self.record(path, int(indices[i]), int(created[indices[i]])) for i in range(hi - 1, start - 1, -1)]
+
+		return dict(object='list', data=data, has_more=bool(start > lo), url=path)
+
+	def record(self, path: str, i: int, created: int) -> dict:
+		"""
+		Returns the synthetic record at an index of a list
+		"""
+
+		id = f'{self.PREFIXES[path]}_{i}'
+
+		if (path == '/v1/charges'):
+			return dict(id=id, object='charge', created=created, amount=500 + i * 37 % 10000, currency='usd', status='failed' if i % 20 == 0 else 'succeeded', refunded=i % 50 == 0, disputed=i % 500 == 0, paid=i % 20 != 0)
+		elif (path == '/v1/customers'):
+			return dict(id=id, object='customer', created=created, email=f'customer{i}@example.com')
+
+		current_period_end = self.now + (i % 28) * 24 * 60 * 60
+
+		return dict(
+			id=id, object='subscription', customer=f'cus_{i}', created=created, status=self.STATUSES[i % len(self.STATUSES)]
+			, current_period_start=current_period_end - 30 * 24 * 60 * 60, current_period_end=current_period_end
+			, trial_start=created if i % len(self.STATUSES) == 1 else None, trial_end=current_period_end if i % len(self.STATUSES) == 1 else None
+			, canceled_at=None, ended_at=None, plan=dict(amount=1000 + i % 5 * 1000, interval='month', interval_count=1)
+		)
+
+def _port() -> int:
+	"""
+	Returns a free local TCP port
+	"""
+
+	with socket.socket() as s:
+		s.bind(('127.0.0.1', 0))
+		return s.getsockname()[1]
+
+def _commit() -> str | None:
+	"""
+	Returns the checked out git commit, if any
+	"""
+
+	try:
+		return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=APP_PATH, capture_output=True, text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def import_profile(module: str = 'main', top: int = 10) -> dict:
+	"""
+	Returns the time a fresh interpreter takes to import a module of the API and the packages that took the longest, measured with `-X importtime`
+	Package times include the packages they import themselves
+
+	:param module: module imported from the app directory
+	:param top: number of packages reported
+	"""
+
+	start = time.perf_counter()
+	output = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=APP_PATH, capture_output=True, text=True, check=True).stderr
+	elapsed = time.perf_counter() - start
+	packages = {}
+
+	# lines read `import time: self [us] | cumulative | imported package`, the outermost import of a package holding its total
+	for line in output.splitlines():
+		_, _, fields = line.partition('import time:')
+		columns = fields.split('|')
+
+		if (len(columns) == 3 and columns[1].strip().isdigit()):
+			package = columns[2].strip().partition('.')[0]
+			packages[package] = max(packages.get(package, 0), int(columns[1]) / 1000)
+
+	return dict(
+		process_s=round(elapsed, 3)
+		, import_ms=round(packages.get(module, 0), 1)
+		, packages=dict(sorted(((name, round(ms, 1)) for name, ms in packages.items() if name != module), key=lambda item: -item[1])[:top])
+	)
+
+async def drive(client: httpx.AsyncClient, params: dict, requests: int, concurrency: int) -> tuple[list[float], int]:
+	"""
+	Requests `/v1/dashboard` concurrently, returning the latency of every request and the number of failed ones
+	"""
+
+	semaphore = asyncio.Semaphore(concurrency)
+	latencies = []
+	errors = 0
+
+	async def request() -> None:
+		nonlocal errors
+
+		async with semaphore:
+			start = time.perf_counter()
+			response = await client.get('/v1/dashboard', params=params)
+			latencies.append(time.perf_counter() - start)
+			errors += response.status_code != 200
+
+	await asyncio.gather(*[request() for _ in range(requests)])
+
+	return latencies, errors
+
+async def benchmark(sizes: list[int], requests: int, concurrency: int, latency: float, page_size: int, days: int, cache: bool) -> dict:
+	"""
+	Serves the fake Stripe API, starts the API against it in a subprocess and measures dashboards of accounts of every size
+	"""
+
+	fake = RevenutFakeStripe(latency, page_size, days)
+	stripe_port, api_port = _port(), _port()
+	shutdown = asyncio.Event()
+	config = Config()
+	config.bind = [f'127.0.0.1:{stripe_port}']
+	config.loglevel = 'WARNING'
+	server = asyncio.ensure_future(serve(fake, config, shutdown_trigger=shutdown.wait))
+
+	env = dict(
+		os.environ
+		, STRIPE_API_KEY='sk_test_benchmark'
+		, STRIPE_API_BASE=f'http://127.0.0.1:{stripe_port}'
+		, STRIPE_CONNECT_BASE=f'http://127.0.0.1:{stripe_port}'
+		, REVENUT_STORE_PATH=os.path.join(tempfile.mkdtemp(), 'revenut.db')
+		# dashboards wait for their sync rather than answer stale at the deadline, which would time the deadline instead of the sync
+		, REVENUT_DASHBOARD_DEADLINE='3600'
+	)
+
+	if (not cache):
+		# every request recomputes its dashboard so the Stripe sync and aggregation are measured
+		env.update(REVENUT_CACHE_TTL='0', REVENUT_CACHE_STALE='0')
+
+	started = time.perf_counter()
+	api = await asyncio.create_subprocess_exec(sys.executable, '-m', 'hypercorn', 'main:app', '--bind', f'127.0.0.1:{api_port}', cwd=APP_PATH, env=env, stderr=subprocess.DEVNULL)
+	results = []
+	startup = {}
+
+	try:
+		async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{api_port}', timeout=None) as client:
+			# the worker answers health checks once it serves requests and readiness checks once its Stripe connections are open
+			for path in ['/health', '/ready']:
+				for _ in range(1000):
+					try:
+						if ((await client.get(path)).status_code == 200):
+							break
+					except httpx.TransportError:
+						pass
+
+					await asyncio.sleep(0.01)
+
+				startup[f'{path[1:]}_s'] = round(time.perf_counter() - started, 4)
+
+			for size in sizes:
+				account_id = f'acct_{size}'
+				params = dict(account=account_id, tzIdentifier='America/Los_Angeles')
+
+				# the first dashboard of an account syncs its store from scratch
+				start = time.perf_counter()
+				await client.get('/v1/dashboard', params=params)
+				cold = time.perf_counter() - start
+				calls = fake.calls[account_id]
+				startup.setdefault('first_response_s', round(time.perf_counter() - started, 4))
+
+				start = time.perf_counter()
+				latencies, errors = await drive(client, params, requests, concurrency)
+				elapsed = time.perf_counter() - start
+				latencies.sort()
+
+				results.append(dict(
+					account=account_id
+					, cold_s=round(cold, 4)
+					, cold_stripe_calls=calls
+					, p50_ms=round(statistics.median(latencies) * 1000, 2)
+					, p99_ms=round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 2)
+					, rps=round(requests / elapsed, 1)
+					, stripe_calls_per_dashboard=round((fake.calls[account_id] - calls) / requests, 2)
+					, errors=errors
+				))
+	finally:
+		api.terminate()
+		await api.wait()
+		shutdown.set()
+		await server
+
+	return dict(
+		timestamp=datetime.datetime.now(datetime.timezone.utc).isoformat()
+		, commit=_commit()
+		, config=dict(sizes=sizes, requests=requests, concurrency=concurrency, latency=latency, page_size=page_size, days=days, cache=cache)
+		# maximum resident set of the terminated API process, reported in KiB on Linux
+		, peak_rss_mb=round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)
+		# seconds from starting the API process until it was healthy, ready and answered its first dashboard
+		, startup=startup
+		, imports=import_profile()
+		, results=results
+	)
+
+def compare(run: dict, path: str) -> None:
+	"""
+	Prints the results of a run next to the previous run with the same configuration saved at `path`
+	"""
+
+	previous = None
+
+	if (os.path.exists(path)):
+		with open(path) as f:
+			runs = [json.loads(line) for line in f if line.strip()]
+			previous = next((r for r in reversed(runs) if r['config'] == run['config']), None)
+
+	before = {r['account']: r for r in previous['results']} if previous else {}
+
+	for result in run['results']:
+		line = ' '.join(f'{key}={value}' for key, value in result.items())
+		baseline = before.get(result['account'])
+
+		if (baseline and baseline['p50_ms']):
+			line += f" | p50 {(result['p50_ms'] - baseline['p50_ms']) / baseline['p50_ms'] * 100:+.0f}% p99 {(result['p99_ms'] - baseline['p99_ms']) / (baseline['p99_ms'] or 1) * 100:+.0f}% vs {previous['commit']}"
+
+		print(line)
+
+	print(f"peak_rss_mb={run['peak_rss_mb']}")
+	line = ' '.join(f'{key}={value}' for key, value in run['startup'].items())
+
+	# runs saved before startup was measured have nothing to compare with
+	if (previous and previous.get('startup', {}).get('first_response_s')):
+		line += f" | first response {(run['startup']['first_response_s'] - previous['startup']['first_response_s']) / previous['startup']['first_response_s'] * 100:+.0f}% vs {previous['commit']}"
+
+	print(line)
+	print(f"import_ms={run['imports']['import_ms']} " + ' '.join(f'{name}={ms}' for name, ms in run['imports']['packages'].items()))
+
+def main() -> None:
+	"""
+	Benchmark `/v1/dashboard` offline against a fake Stripe API and save the results
+	"""
+
+	parser = argparse.ArgumentParser(description='Benchmark /v1/dashboard offline against a fake Stripe API')
+	parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='number of charges of each synthetic account')
+	parser.add_argument('--requests', type=int, default=200, help='dashboards requested per account')
+	parser.add_argument('--concurrency', type=int, default=16, help='dashboards requested at once')
+	parser.add_argument('--latency', type=float, default=0.05, help='seconds the fake Stripe API takes to answer')
+	parser.add_argument('--page-size', type=int, default=100, help='maximum records of a fake Stripe list page')
+	parser.add_argument('--days', type=int, default=365, help='days the synthetic records are spread over')
+	parser.add_argument('--cache', action='store_true', help='serve cached dashboards instead of recomputing every request')
+	parser.add_argument('--output', default=RESULTS_PATH, help='JSON lines file the results are appended to')
+	args = parser.parse_args()
+
+	run = asyncio.run(benchmark(args.sizes, args.requests, args.concurrency, args.latency, args.page_size, args.days, args.cache))
+	compare(run, args.output)
+	os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+
+	with open(args.output, 'a') as f:
+		f.write(json.dumps(run) + '\n')
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,344 @@
+from typing import Any, Awaitable, Callable, Hashable
+from collections import OrderedDict
+
+import os
+import asyncio
+import concurrent.futures
+import functools
+import hashlib
+import logging
+import time
+
+from flight_module import RevenutSingleFlight
+from scheduler_module import background
+from metrics_module import default_metrics, note
+from shared_module import RevenutSharedCache, RevenutSharedEntry
+
+class RevenutCacheEntry:
+	"""
+	Cached value along with its pre-serialized JSON content and entity tag
+	"""
+
+	__slots__ = ('value', 'content', 'etag', 'cacheable', 'ttl', 'updated')
+
+	def __init__(self, value: Any, content: bytes, etag: str | None = None, cacheable: bool = True, ttl: float | None = None):
+		self.value = value
+		self.content = content
+		self.etag = etag or self.tag(content)
+		self.cacheable = cacheable
+		self.ttl = ttl
+		self.updated = time.monotonic()
+
+	@staticmethod
+	def tag(content: bytes) -> str:
+		"""
+		Returns a strong entity tag of some content
+		"""
+		return f'"{hashlib.blake2b(content, digest_size=16).hexdigest()}"'
+
+	def age(self) -> float:
+		"""
+		Returns the number of seconds since the entry was computed
+		"""
+		return time.monotonic() - self.updated
+
+	def matches(self, if_none_match: str | None) -> bool:
+		"""
+		Returns whether an `If-None-Match` request header matches the entity tag
+		https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/If-None-Match
+
+		:param if_none_match: value of the request header
+		"""
+
+		if (not if_none_match):
+			return False
+
+		etags = [etag.strip().removeprefix('W/') for etag in if_none_match.split(',')]
+
+		return '*' in etags or self.etag in etags
+
+class RevenutCache:
+	"""
+	Bounded LRU cache of computed values with a time to live
+	Expired entries are still served while a single background refresh recomputes them (stale-while-revalidate)
+	With a shared cache, entries are written through to the other workers of the host which load them instead of recomputing them
+	and accounts revoked by any worker are dropped by the others within `sync` seconds
+	"""
+
+	def __init__(self, maxsize: int | None = None, ttl: float | None = None, stale: float | None = None, shared: RevenutSharedCache | None = None, lease: float | None = None, sync: float | None = None):
+		self.maxsize = maxsize or int(os.getenv('REVENUT_CACHE_SIZE', 1024))
+		self.ttl = ttl if ttl is not None else float(os.getenv('REVENUT_CACHE_TTL', 60))
+		self.stale = stale if stale is not None else float(os.getenv('REVENUT_CACHE_STALE', 60 * 60))
+		self.shared = shared
+		self.lease = lease or float(os.getenv('REVENUT_SHARED_CACHE_LEASE', 30))
+		self.sync = sync if sync is not None else float(os.getenv('REVENUT_SHARED_CACHE_SYNC', 1))
+		self._entries: OrderedDict[Hashable, RevenutCacheEntry] = OrderedDict()
+		self._flights = RevenutSingleFlight()
+		self._tasks: set[asyncio.Task] = set()
+		self._listeners: list[Callable[[Hashable, RevenutCacheEntry], None]] = []
+		# revocations applied by this worker and when it last read those of the others
+		self._revoked: dict[str, float] = {}
+		self._synced = time.time()
+		# calls to the shared cache are queued to one thread so they neither block the event loop nor reorder the writes of the worker
+		self._writer = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='revenut-shared') if shared else None
+
+	def listen(self, listener: Callable[[Hashable, RevenutCacheEntry], None]) -> None:
+		"""
+		Registers a callback receiving every entry saved, whether recomputed or updated by webhook deltas,
+		and `((account_id,), None)` once an account is revoked
+		"""
+		self._listeners.append(listener)
+
+	def get(self, key: Hashable) -> RevenutCacheEntry | None:
+		"""
+		Returns the entry of a key, fresh or not
+		"""
+
+		entry = self._entries.get(key)
+
+		if (entry is not None):
+			self._entries.move_to_end(key)
+
+		return entry
+
+	def set(self, key: Hashable, entry: RevenutCacheEntry, share: bool = True) -> None:
+		"""
+		Saves the entry of a key, evicting the least recently used entries beyond the size bound
+
+		:param share: write the entry through to the shared cache
+		"""
+
+		self._entries[key] = entry
+		self._entries.move_to_end(key)
+
+		while (len(self._entries) > self.maxsize):
+			self._entries.popitem(last=False)
+
+		if (share and self.shared):
+			self._submit(self.shared.set, key, RevenutSharedEntry(entry.content, entry.etag, time.time() - entry.age(), entry.ttl))
+
+		for listener in self._listeners:
+			listener(key, entry)
+
+	def pop(self, key: Hashable) -> RevenutCacheEntry | None:
+		if (self.shared):
+			self._submit(self.shared.pop, key)
+
+		return self._entries.pop(key, None)
+
+	def keys(self) -> list[Hashable]:
+		return list(self._entries.keys())
+
+	def discard(self, prefix: tuple, keep: list[Hashable] | None = None) -> None:
+		"""
+		Removes the entries whose key starts with a prefix such as `(account_id,)`, from the shared cache as well
+
+		:param keep: keys to only remove from the shared cache, `None` removing every entry of the prefix from this worker too
+		"""
+
+		if (keep is None):
+			for key in [key for key in self._entries if key[:len(prefix)] == prefix]:
+				del self._entries[key]
+
+		if (self.shared):
+			self._submit(self.shared.discard, prefix, keep or [])
+
+	def revoke(self, account_id: str, revoked: float | None = None) -> None:
+		"""
+		Drops the entries of an account and cancels their computations in flight, telling the other workers to do the same
+
+		:param account_id: stripe account identifier
+		:param revoked: Epoch timestamp of a revocation made by another worker
+		"""
+
+		for key in [key for key in self._entries if key[0] == account_id]:
+			del self._entries[key]
+
+		self._flights.cancel(lambda key: key[0] == account_id)
+
+		for listener in self._listeners:
+			listener((account_id,), None)
+
+		if (revoked is None and self.shared):
+			revoked = time.time()
+			self._submit(self.shared.revoke, account_id, revoked)
+
+		if (revoked is not None):
+			self._revoked[account_id] = revoked
+
+	async def latest(self, key: tuple, loads: Callable[[bytes], Any] | None = None) -> RevenutCacheEntry | None:
+		"""
+		Returns the newest entry, fresh or not, of a key or of the keys sharing all but its last item such as the dashboards of previous days
+
+		:param key: identifies the cached value
+		:param loads: returns the value of serialized content, required to use the entries of the shared cache
+		"""
+
+		entries = [entry for k, entry in self._entries.items() if k[:-1] == key[:-1]]
+
+		if (not entries and loads and self.shared):
+			entries = [entry for entry in (self._entry(await self._call(self.shared.get, key), loads),) if entry is not None]
+
+		return max(entries, key=lambda entry: entry.updated, default=None)
+
+	async def fetch(self, key: Hashable, function: Callable[[], Awaitable[RevenutCacheEntry]], loads: Callable[[bytes], Any] | None = None) -> RevenutCacheEntry:
+		"""
+		Returns the entry of a key, computing it with `function` on a miss and refreshing it in the background once expired
+		Background refreshes make their Stripe requests with background priority
+
+		:param key: identifies the cached value
+		:param function: computes the entry of the key
+		:param loads: returns the value of serialized content, required to use the entries of the shared cache
+		"""
+
+		await self._sync()
+		entry = self.get(key)
+		result = 'hit'
+
+		if (entry is None and loads and self.shared):
+			entry = self._entry(await self._call(self.shared.get, key), loads)
+			result = 'shared'
+
+			if (entry is not None):
+				self.set(key, entry, share=False)
+
+		if (entry is None or entry.age() > self._ttl(entry) + self.stale):
+			result = 'coalesced' if key in self._flights else 'miss'
+			default_metrics().inc('revenut_cache_requests_total', result=result)
+			note('cache', result)
+
+			return await self.refresh(key, function, loads)
+
+		result = 'stale' if entry.age() > self._ttl(entry) else result
+		default_metrics().inc('revenut_cache_requests_total', result=result)
+		note('cache', result)
+
+		if (result == 'stale' and key not in self._flights):
+			task = asyncio.ensure_future(background(self.refresh(key, function, loads)))
+			self._tasks.add(task)
+			task.add_done_callback(self._refreshed)
+
+		return entry
+
+	async def refresh(self, key: Hashable, function: Callable[[], Awaitable[RevenutCacheEntry]], loads: Callable[[bytes], Any] | None = None) -> RevenutCacheEntry:
+		"""
+		Recomputes and saves the entry of a key, joining a refresh already in flight
+		With a shared cache only the worker holding the lease of the key recomputes it while the others wait for its entry
+
+		:param key: identifies the cached value
+		:param function: computes the entry of the key
+		:param loads: returns the value of serialized content, required to use the entries of the shared cache
+		"""
+
+		async def compute() -> RevenutCacheEntry:
+			current = self._entries.get(key)
+			leased = False
+
+			if (self.shared and loads):
+				deadline = time.monotonic() + self.lease
+
+				while True:
+					shared = self._entry(await self._call(self.shared.get, key), loads)
+
+					# another worker recomputed the entry since this one did, the second of slack absorbs clock conversions
+					if (shared is not None and shared.age() <= self._ttl(shared) and (current is None or shared.updated > current.updated + 1)):
+						self.set(key, shared, share=False)
+						return shared
+
+					leased = await self._call(self.shared.acquire, key, self.lease)
+
+					if (leased or time.monotonic() > deadline):
+						break
+
+					await asyncio.sleep(0.1)
+
+			try:
+				entry = await function()
+
+				if (entry.cacheable):
+					self.set(key, entry)
+				else:
+					# a dashboard no longer authorized must not keep being served stale
+					self.pop(key)
+
+				return entry
+			finally:
+				if (leased):
+					self._submit(self.shared.release, key)
+
+		return await self._flights.do(key, compute)
+
+	async def _sync(self) -> None:
+		"""
+		Applies the revocations made by the other workers since the last time, reading them at most every `sync` seconds
+		"""
+
+		now = time.time()
+
+		if (not self.shared or now < self._synced + self.sync):
+			return
+
+		# revocations committed slightly after they were timestamped are read again rather than missed
+		since, self._synced = self._synced - self.sync, now
+
+		for account_id, revoked in await self._call(self.shared.revocations, since):
+			if (self._revoked.get(account_id) != revoked):
+				self.revoke(account_id, revoked)
+
+		for account_id in [account_id for account_id, revoked in self._revoked.items() if revoked < since]:
+			del self._revoked[account_id]
+
+	def _entry(self, shared: RevenutSharedEntry | None, loads: Callable[[bytes], Any]) -> RevenutCacheEntry | None:
+		"""
+		Returns the entry of the content saved in the shared cache, if any
+		"""
+
+		if (shared is None):
+			return None
+
+		try:
+			entry = RevenutCacheEntry(loads(shared.content), shared.content, shared.etag, ttl=shared.ttl)
+		except Exception as e:
+			logging.error(e)
+			return None
+
+		# ages are monotonic within a process but wall clock across processes
+		entry.updated = time.monotonic() - (time.time() - shared.updated)
+
+		return entry
+
+	def _submit(self, method: Callable, *args) -> concurrent.futures.Future:
+		"""
+		Queues a call to the shared cache without waiting for it, logging its failure
+		"""
+
+		future = self._writer.submit(method, *args)
+		future.add_done_callback(_logged)
+
+		return future
+
+	async def _call(self, method: Callable, *args) -> Any:
+		"""
+		Returns the result of a call to the shared cache once the calls queued before it completed
+		"""
+		return await asyncio.wrap_future(self._writer.submit(method, *args))
+
+	def _ttl(self, entry: RevenutCacheEntry) -> float:
+		return self.ttl if entry.ttl is None else entry.ttl
+
+	def _refreshed(self, task: asyncio.Task) -> None:
+		self._tasks.discard(task)
+
+		if (not task.cancelled() and task.exception()):
+			logging.error(task.exception())
+
+def _logged(future: concurrent.futures.Future) -> None:
+	if (future.exception()):
+		logging.error(future.exception())
+
+@functools.cache
+def default_cache() -> RevenutCache:
+	"""
+	Returns the process-wide cache of computed dashboards, shared with the other workers of the host unless `REVENUT_SHARED_CACHE` is 0
+	"""
+	return RevenutCache(shared=RevenutSharedCache() if os.getenv('REVENUT_SHARED_CACHE', '1') != '0' else None)
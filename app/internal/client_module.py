@@ -0,0 +1,327 @@
+from typing import AsyncIterator, Callable, TypeVar
+
+import os
+import asyncio
+import collections
+import uuid
+import weakref
+
+import httpx
+import stripe
+
+from scheduler_module import RevenutScheduler
+from metrics_module import default_metrics
+
+T = TypeVar('T')
+
+class RevenutStripeClient:
+	"""
+	Asynchronous client of the Stripe REST API sharing one pool of keep-alive connections
+	Every request goes through the scheduler so rate limits and transient failures are retried instead of surfacing as missing data
+	https://stripe.com/docs/api
+	"""
+
+	def __init__(self, api_key: str | None = None, api_base: str | None = None, connect_base: str | None = None, transport: httpx.AsyncBaseTransport | None = None, scheduler: RevenutScheduler | None = None):
+		self.api_key = api_key or os.getenv('STRIPE_API_KEY')
+		self.api_base = api_base or os.getenv('STRIPE_API_BASE', 'https://api.stripe.com')
+		self.connect_base = connect_base or os.getenv('STRIPE_CONNECT_BASE', 'https://connect.stripe.com')
+		self.http = httpx.AsyncClient(
+			headers={'Authorization': f'Bearer {self.api_key}'}
+			, limits=httpx.Limits(max_connections=int(os.getenv('STRIPE_MAX_CONNECTIONS', 100)), max_keepalive_connections=int(os.getenv('STRIPE_MAX_KEEPALIVE', 20)), keepalive_expiry=60)
+			, timeout=httpx.Timeout(30, connect=10)
+			, transport=transport
+		)
+		self.account_concurrency = int(os.getenv('STRIPE_ACCOUNT_CONCURRENCY', 4))
+		self.shards_max = int(os.getenv('STRIPE_SHARDS_MAX', 8))
+		self.shard_pages = int(os.getenv('STRIPE_SHARD_PAGES', 4))
+		self.scheduler = scheduler or RevenutScheduler()
+		self._accounts: collections.defaultdict[str, asyncio.Semaphore] = collections.defaultdict(lambda: asyncio.Semaphore(self.account_concurrency))
+
+	async def request(self, method: str, url: str, account_id: str | None = None, params: dict | None = None) -> dict:
+		"""
+		Returns the decoded JSON response of a Stripe request or raises the matching `stripe.error.StripeError`
+
+		:param method: HTTP method
+		:param url: absolute URL of the endpoint
+		:param account_id: connected account the request is made on behalf of
+		:param params: query parameters for GET requests, form parameters otherwise
+		"""
+
+		headers = {'Stripe-Account': account_id} if account_id else {}
+		encoded = list(_encode(params or {}))
+
+		# retried POST requests must not create objects twice
+		# https://stripe.com/docs/api/idempotent_requests
+		if (method == 'POST'):
+			headers['Idempotency-Key'] = str(uuid.uuid4())
+
+		async def send() -> httpx.Response:
+			if (method == 'GET'):
+				return await self.http.request(method, url, params=encoded, headers=headers)
+
+			return await self.http.request(method, url, data=dict(encoded), headers=headers)
+
+		try:
+			# bound the requests in flight per connected account
+			async with self._accounts[account_id]:
+				response = await self.scheduler.request(account_id, send)
+		except httpx.HTTPError as e:
+			raise stripe.error.APIConnectionError(f'Error communicating with Stripe: {e!r}') from e
+
+		if (response.is_error):
+			raise _error(response)
+
+		return response.json()
+
+	async def list(self, resource: str, account_id: str | None = None, **params) -> AsyncIterator[dict]:
+		"""
+		Yields every record of an auto-paginated Stripe list
+		https://stripe.com/docs/api/pagination
+
+		:param resource: path of the list endpoint such as `/v1/charges`
+		:param account_id: connected account the records belong to
+		:param params: filters of the list
+		"""
+
+		params.setdefault('limit', 100)
+
+		while True:
+			page = await self.request('GET', self.api_base + resource, account_id, params)
+
+			for record in page['data']:
+				yield record
+
+			if (not page.get('has_more') or not page['data']):
+				break
+
+			params['starting_after'] = page['data'][-1]['id']
+
+	async def pages(self, resource: str, projection: Callable[[dict], T], account_id: str | None = None, **params) -> 'AsyncIterator[list[T]]':
+		"""
+		Yields every page of an auto-paginated Stripe list projected record by record
+		Only the compact projections outlive the page so the full Stripe objects are released as soon as each page is processed
+
+		:param resource: path of the list endpoint such as `/v1/charges`
+		:param projection: returns the compact record of a Stripe object
+		:param account_id: connected account the records belong to
+		:param params: filters of the list
+		"""
+
+		params.setdefault('limit', 100)
+
+		while True:
+			page = await self.request('GET', self.api_base + resource, account_id, params)
+			_count(resource, page['data'])
+			records = [projection(record) for record in page['data']]
+			has_more = page.get('has_more') and page['data']
+
+			if (has_more):
+				params['starting_after'] = page['data'][-1]['id']
+
+			del page
+			yield records
+
+			if (not has_more):
+				break
+
+	async def shards(self, resource: str, projection: Callable[[dict], T], account_id: str | None, epochStart: int, epochEnd: int, **params) -> 'AsyncIterator[list[T]]':
+		"""
+		Yields the projected pages of a Stripe list created within a timeframe, paginating time shards concurrently
+		A shard whose first page shows more pages than `shard_pages` ahead splits its remaining range in two, so the shard count follows
+		the observed density of records up to `shards_max` while the requests in flight stay bounded per account
+
+		:param resource: path of the list endpoint such as `/v1/charges`
+		:param projection: returns the compact record of a Stripe object
+		:param account_id: connected account the records belong to
+		:param epochStart: request records created greater than or equal to Epoch timestamp
+		:param epochEnd: request records created less than or equal to Epoch timestamp
+		:param params: filters of the list other than `created`
+		"""
+
+		params.setdefault('limit', 100)
+		queue: asyncio.Queue = asyncio.Queue()
+		tasks: set[asyncio.Task] = set()
+		shards = 0
+
+		async def shard(gte: int, lt: int) -> None:
+			page = await self.request('GET', self.api_base + resource, account_id, {**params, 'created': {'gte': gte, 'lt': lt}})
+			data = page['data']
+			_count(resource, data)
+
+			if (not page.get('has_more') or not data):
+				await queue.put([projection(record) for record in data])
+				return
+
+			# Stripe lists newest first so every record newer than the last one of the page has been listed
+			boundary = data[-1]['created']
+			density = len(data) / (data[0]['created'] - boundary + 1)
+			pages = (boundary - gte) * density / params['limit']
+
+			if (pages > self.shard_pages and shards < self.shards_max and boundary > gte):
+				await queue.put([projection(record) for record in data if record['created'] > boundary])
+				middle = (gte + boundary + 1) // 2
+				spawn(gte, middle)
+				spawn(middle, boundary + 1)
+			else:
+				await queue.put([projection(record) for record in data])
+
+				async for records in self.pages(resource, projection, account_id, **params, created={'gte': gte, 'lt': lt}, starting_after=data[-1]['id']):
+					await queue.put(records)
+
+		def spawn(gte: int, lt: int) -> None:
+			nonlocal shards
+			shards += 1
+			task = asyncio.ensure_future(shard(gte, lt))
+			tasks.add(task)
+			task.add_done_callback(queue.put_nowait)
+
+		spawn(epochStart, epochEnd + 1)
+
+		try:
+			while (tasks):
+				item = await queue.get()
+
+				if (isinstance(item, asyncio.Task)):
+					tasks.discard(item)
+					item.result()
+				else:
+					yield item
+		finally:
+			for task in tasks:
+				task.cancel()
+
+	async def retrieve(self, resource: str, account_id: str | None = None) -> stripe.stripe_object.StripeObject:
+		"""
+		Returns a Stripe object
+
+		:param resource: path of the object such as `/v1/accounts/acct_123`
+		:param account_id: connected account the object belongs to
+		"""
+
+		response = await self.request('GET', self.api_base + resource, account_id)
+
+		return stripe.util.convert_to_stripe_object(response, self.api_key, None, account_id)
+
+	async def create(self, resource: str, account_id: str | None = None, **params) -> stripe.stripe_object.StripeObject:
+		"""
+		Creates and returns a Stripe object
+
+		:param resource: path of the list endpoint such as `/v1/file_links`
+		:param account_id: connected account the object belongs to
+		:param params: attributes of the object
+		"""
+
+		response = await self.request('POST', self.api_base + resource, account_id, params)
+
+		return stripe.util.convert_to_stripe_object(response, self.api_key, None, account_id)
+
+	async def oauth(self, resource: str, **params) -> dict:
+		"""
+		Returns the response of a Stripe Connect OAuth request
+		https://stripe.com/docs/connect/oauth-reference
+
+		:param resource: path of the OAuth endpoint such as `/oauth/token`
+		:param params: form parameters of the request
+		"""
+		return await self.request('POST', self.connect_base + resource, None, params)
+
+	async def warm(self, connections: int | None = None) -> None:
+		"""
+		Opens keep-alive connections to the Stripe API ahead of the first requests so they skip the TCP and TLS handshakes
+		Raises `stripe.error.APIConnectionError` when Stripe cannot be reached
+
+		:param connections: connections opened at once, defaults to `STRIPE_WARM_CONNECTIONS`
+		"""
+
+		connections = connections or int(os.getenv('STRIPE_WARM_CONNECTIONS', 4))
+
+		try:
+			# any answer, even an error status, leaves its connection in the pool
+			await asyncio.gather(*[self.http.request('HEAD', self.api_base) for _ in range(connections)])
+		except httpx.HTTPError as e:
+			raise stripe.error.APIConnectionError(f'Error communicating with Stripe: {e!r}') from e
+
+	async def close(self) -> None:
+		await self.http.aclose()
+
+def _count(resource: str, data: list) -> None:
+	"""
+	Counts a fetched page and its records
+	"""
+
+	metrics = default_metrics()
+	metrics.inc('revenut_stripe_pages_total', resource=resource)
+	metrics.inc('revenut_stripe_records_total', len(data), resource=resource)
+
+def _encode(params: dict, prefix: str | None = None):
+	"""
+	Yields parameters flattened the way Stripe expects them e.g. `created[gte]=1` and `types[0]=charge.refunded`
+	"""
+
+	for key, value in params.items():
+		key = f'{prefix}[{key}]' if prefix else key
+
+		if (value is None):
+			continue
+		elif (isinstance(value, dict)):
+			yield from _encode(value, key)
+		elif (isinstance(value, (list, tuple))):
+			yield from _encode(dict(enumerate(value)), key)
+		elif (isinstance(value, bool)):
+			yield key, str(value).lower()
+		else:
+			yield key, str(value)
+
+def _error(response: httpx.Response) -> stripe.error.StripeError:
+	"""
+	Returns the `stripe.error.StripeError` matching an error response the same way the Stripe SDK does
+	"""
+
+	try:
+		body = response.json()
+		error = body['error']
+	except (ValueError, KeyError, TypeError):
+		return stripe.error.APIError(f'Invalid response object from API: {response.text!r} (HTTP response code was {response.status_code})', response.text, response.status_code, None, response.headers)
+
+	args = (response.text, response.status_code, body, response.headers)
+
+	# OAuth errors are a string code while API errors are a hash
+	if (isinstance(error, str)):
+		return stripe.oauth_error.OAuthError(error, body.get('error_description', error), *args)
+
+	if (response.status_code == 429):
+		return stripe.error.RateLimitError(error.get('message'), *args)
+	elif (response.status_code in [400, 404]):
+		return stripe.error.InvalidRequestError(error.get('message'), error.get('param'), error.get('code'), *args)
+	elif (response.status_code == 401):
+		return stripe.error.AuthenticationError(error.get('message'), *args)
+	elif (response.status_code == 402):
+		return stripe.error.CardError(error.get('message'), error.get('param'), error.get('code'), *args)
+	elif (response.status_code == 403):
+		return stripe.error.PermissionError(error.get('message'), *args)
+
+	return stripe.error.APIError(error.get('message'), *args)
+
+_clients: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, RevenutStripeClient] = weakref.WeakKeyDictionary()
+
+def default_client() -> RevenutStripeClient:
+	"""
+	Returns the client shared by every request of the running event loop
+	"""
+
+	loop = asyncio.get_running_loop()
+
+	if (loop not in _clients):
+		_clients[loop] = RevenutStripeClient()
+
+	return _clients[loop]
+
+async def close_client() -> None:
+	"""
+	Closes the client of the running event loop and its pooled connections
+	"""
+
+	client = _clients.pop(asyncio.get_running_loop(), None)
+
+	if (client):
+		await client.close()
@@ -1,4 +1,4 @@
-from enum import IntEnum
+from enum import Enum, IntEnum
 
 class RevenutChangeType(IntEnum):
 	"""
@@ -20,6 +20,23 @@ class RevenutAuthorizationType(IntEnum):
 	REVOKED = -1
 	ERROR = -2
 
+class RevenutGranularityType(str, Enum):
+	"""
+	Enumeration of the period lengths of a history
+	"""
+
+	DAY = 'day'
+	WEEK = 'week'
+	MONTH = 'month'
+
+class RevenutPriorityType(IntEnum):
+	"""
+	Enumeration of the priorities of Stripe requests, lower values served first
+	"""
+
+	INTERACTIVE = 0
+	BACKGROUND = 1
+
 def main() -> None:
 	print(RevenutChangeType.INCREASE)
 	print(RevenutAuthorizationType.AUTHORIZED_ID)
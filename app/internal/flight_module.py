@@ -0,0 +1,43 @@
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+import asyncio
+
+T = TypeVar('T')
+
+class RevenutSingleFlight:
+	"""
+	Coalesces concurrent calls sharing a key into one in-flight computation whose result every caller receives
+	"""
+
+	def __init__(self):
+		self._flights: dict[Hashable, asyncio.Future] = {}
+
+	async def do(self, key: Hashable, function: Callable[[], Awaitable[T]]) -> T:
+		"""
+		Returns the result of `function`, joining the computation already running for `key` if there is one
+
+		:param key: identifies identical computations
+		:param function: starts the computation when none is in flight
+		"""
+
+		flight = self._flights.get(key)
+
+		if (flight is None):
+			flight = asyncio.ensure_future(function())
+			self._flights[key] = flight
+			flight.add_done_callback(lambda _: self._flights.pop(key, None))
+
+		# a caller going away must not cancel the computation other callers are waiting on
+		return await asyncio.shield(flight)
+
+	def cancel(self, match: Callable[[Hashable], bool]) -> None:
+		"""
+		Cancels the computations in flight whose key matches, their callers receiving `asyncio.CancelledError`
+		"""
+
+		for key, flight in list(self._flights.items()):
+			if (match(key)):
+				flight.cancel()
+
+	def __contains__(self, key: Hashable) -> bool:
+		return key in self._flights
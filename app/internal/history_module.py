@@ -0,0 +1,101 @@
+from enums import RevenutGranularityType
+from store_module import RevenutRollup, RevenutStore
+from pydantic import BaseModel
+from timezone_module import RevenutTimezone
+
+import datetime
+
+class RevenutHistoryPeriod(BaseModel):
+	"""
+	Totals of an account for one day, week or month
+	"""
+
+	DateStart:datetime.date
+	VolumeGross:float = 0
+	VolumeRefunded:float = 0
+	CountPayments:int = 0
+	CountCustomers:int = 0
+	CountTrials:int = 0
+
+class RevenutHistory(BaseModel):
+	"""
+	Trend of an account's metrics answered from per-day rollups
+	"""
+
+	AccountID:str
+	TimezonePreference:str
+	Granularity:RevenutGranularityType = RevenutGranularityType.DAY
+	DateFrom:datetime.date
+	DateTo:datetime.date
+	Periods:list[RevenutHistoryPeriod] = []
+
+	@classmethod
+	def from_rollups(cls, account_id: str, timezone: str, dateFrom: datetime.date, dateTo: datetime.date, granularity: RevenutGranularityType, rollups: list[RevenutRollup]) -> 'RevenutHistory':
+		"""
+		Returns the history of saved days grouped by granularity, days without records included
+
+		:param rollups: saved days within the range
+		"""
+
+		days = {rollup.day: rollup for rollup in rollups}
+		periods: dict[datetime.date, RevenutHistoryPeriod] = {}
+		day = dateFrom
+
+		while (day <= dateTo):
+			start = period_start(day, granularity)
+			period = periods.setdefault(start, RevenutHistoryPeriod(DateStart=start))
+			rollup = days.get(day.isoformat())
+
+			if (rollup):
+				period.VolumeGross += rollup.gross / 100
+				period.VolumeRefunded += rollup.refunds / 100
+				period.CountPayments += rollup.payments
+				period.CountCustomers += rollup.customers
+				period.CountTrials += rollup.trials
+
+			day += datetime.timedelta(days=1)
+
+		return cls(AccountID=account_id, TimezonePreference=timezone, Granularity=granularity, DateFrom=dateFrom, DateTo=dateTo, Periods=list(periods.values()))
+
+def period_start(day: datetime.date, granularity: RevenutGranularityType) -> datetime.date:
+	"""
+	Returns the first day of the period a day belongs to, weeks starting on Monday
+	"""
+
+	if (granularity == RevenutGranularityType.WEEK):
+		return day - datetime.timedelta(days=day.weekday())
+	elif (granularity == RevenutGranularityType.MONTH):
+		return day.replace(day=1)
+
+	return day
+
+def refresh_rollups(store: RevenutStore, account_id: str, timezone: str) -> int:
+	"""
+	Recomputes the local days of an account holding records saved since its rollups were last refreshed
+	Runs in a thread off the event loop, the rollups being written through the writer queue of the store like its other writes
+	Returns the number of recomputed days
+
+	:param store: local record store
+	:param account_id: stripe account identifier
+	:param timezone: timezone identifier the days are local to
+	"""
+
+	local = RevenutTimezone(timezone)
+	hours, version = store.changes(account_id, store.cursor(account_id, f'rollups:{timezone}') or 0)
+	days = set()
+
+	# an hour of a timezone with a fractional offset spans two local days
+	for hour in hours:
+		days.add(datetime.datetime.fromtimestamp(hour * 3600, local.zone).date())
+		days.add(datetime.datetime.fromtimestamp(hour * 3600 + 3599, local.zone).date())
+
+	store.queued(store.set_rollups, account_id, timezone, [RevenutRollup(day.isoformat(), *store.totals(account_id, *local.day(day))) for day in sorted(days)], version)
+
+	return len(days)
+
+def main() -> None:
+	history = RevenutHistory.from_rollups('acct_123', 'America/Los_Angeles', datetime.date(2023, 1, 1), datetime.date(2023, 3, 31), RevenutGranularityType.MONTH, [RevenutRollup('2023-02-14', 1000, 1, 0, 0, 0)])
+	print(history.model_dump_json())
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,131 @@
+from typing import AsyncIterator, Awaitable, Callable, Hashable
+from collections import defaultdict
+
+import os
+import asyncio
+import contextlib
+import functools
+import json
+import logging
+
+from cache_module import RevenutCache, RevenutCacheEntry, default_cache
+from scheduler_module import background
+
+class RevenutLive:
+	"""
+	Pushes dashboard changes to every subscribed session of an account as Server-Sent Events
+	One upstream refresh per account runs while it has sessions and its updates, like webhook deltas, reach every session through the cache
+	https://developer.mozilla.org/en-US/docs/Web/API/Server-sent_events/Using_server-sent_events
+	"""
+
+	def __init__(self, cache: RevenutCache | None = None, interval: float | None = None, heartbeat: float = 15, queue_size: int = 16):
+		self.cache = cache or default_cache()
+		self.interval = interval or float(os.getenv('REVENUT_LIVE_INTERVAL', 30))
+		self.heartbeat = heartbeat
+		self.queue_size = queue_size
+		self._sessions: defaultdict[Hashable, set[asyncio.Queue]] = defaultdict(set)
+		self._refreshers: dict[Hashable, asyncio.Task] = {}
+		self.cache.listen(self.publish)
+
+	def publish(self, key: Hashable, entry: RevenutCacheEntry) -> None:
+		"""
+		Hands a saved dashboard to the sessions of its account and timezone, or ends every session of a revoked account
+		Sessions too slow to keep up skip to the latest dashboards since every patch is computed against what they last received
+
+		:param key: cache key of the dashboard, its account and timezone followed by the local day, or `(account_id,)` of a revoked account
+		:param entry: saved dashboard, `None` once the account is revoked
+		"""
+
+		if (entry is None):
+			sessions = [queue for session, queues in self._sessions.items() if session[0] == key[0] for queue in queues]
+
+			for session in [session for session in self._refreshers if session[0] == key[0]]:
+				self._refreshers[session].cancel()
+		else:
+			sessions = self._sessions.get(key[:2], ())
+
+		for queue in sessions:
+			if (queue.full()):
+				queue.get_nowait()
+
+			queue.put_nowait(entry)
+
+	@contextlib.asynccontextmanager
+	async def subscribe(self, key: Hashable, refresh: Callable[[], Awaitable]) -> AsyncIterator[asyncio.Queue]:
+		"""
+		Returns the queue receiving the dashboards of an account and timezone, refreshing them upstream while any session listens
+
+		:param key: account and timezone of the dashboards
+		:param refresh: recomputes the dashboard
+		"""
+
+		queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+		self._sessions[key].add(queue)
+
+		if (key not in self._refreshers):
+			self._refreshers[key] = asyncio.ensure_future(background(self._refresh(refresh)))
+
+		try:
+			yield queue
+		finally:
+			self._sessions[key].discard(queue)
+
+			if (not self._sessions[key]):
+				del self._sessions[key]
+				self._refreshers.pop(key).cancel()
+
+	async def stream(self, key: Hashable, entry: RevenutCacheEntry, refresh: Callable[[], Awaitable]) -> AsyncIterator[bytes]:
+		"""
+		Yields a `snapshot` event of the dashboard followed by a `patch` event with only the changed fields of every update
+
+		:param key: account and timezone of the dashboards
+		:param entry: current dashboard
+		:param refresh: recomputes the dashboard
+		"""
+
+		async with self.subscribe(key, refresh) as queue:
+			last = json.loads(entry.content)
+			etag = entry.etag
+			yield _event('snapshot', entry.content)
+
+			while True:
+				try:
+					entry = await asyncio.wait_for(queue.get(), self.heartbeat)
+				except asyncio.TimeoutError:
+					# comments keep proxies from closing idle connections
+					yield b': keepalive\n\n'
+					continue
+
+				# the account was revoked
+				if (entry is None):
+					return
+				elif (entry.etag == etag):
+					continue
+
+				current = json.loads(entry.content)
+				changes = {field: value for field, value in current.items() if last.get(field) != value}
+				last, etag = current, entry.etag
+
+				yield _event('patch', json.dumps(changes).encode())
+
+	async def _refresh(self, refresh: Callable[[], Awaitable]) -> None:
+		while True:
+			await asyncio.sleep(self.interval)
+
+			try:
+				await refresh()
+			except Exception as e:
+				logging.error(e)
+
+	def __len__(self) -> int:
+		return sum(len(sessions) for sessions in self._sessions.values())
+
+def _event(name: str, data: bytes) -> bytes:
+	return b'event: ' + name.encode() + b'\ndata: ' + data + b'\n\n'
+
+@functools.cache
+def default_live() -> RevenutLive:
+	"""
+	Returns the process-wide live dashboard sessions
+	"""
+	return RevenutLive()
@@ -0,0 +1,164 @@
+from typing import Awaitable, TypeVar
+from collections import defaultdict
+
+import bisect
+import contextvars
+import functools
+import time
+
+T = TypeVar('T')
+
+# durations of the stages of the request being served, reported in its `Server-Timing` header
+timings: contextvars.ContextVar[dict[str, float | str] | None] = contextvars.ContextVar('timings', default=None)
+
+class RevenutMetrics:
+	"""
+	Process-wide counters and histograms rendered in the Prometheus text exposition format
+	https://prometheus.io/docs/instrumenting/exposition_formats/
+	"""
+
+	BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+	HELP = {
+		'revenut_stage_seconds': 'Duration of the fetch and aggregation stages of dashboards'
+		, 'revenut_stripe_requests_total': 'Stripe requests sent by status code'
+		, 'revenut_stripe_retries_total': 'Stripe requests retried by reason'
+		, 'revenut_stripe_pages_total': 'Stripe list pages fetched by resource'
+		, 'revenut_stripe_records_total': 'Stripe records processed by resource'
+		, 'revenut_cache_requests_total': 'Dashboard cache lookups by result'
+		, 'revenut_dashboard_fallbacks_total': 'Dashboards answered past their deadline from completed and last known sections'
+	}
+
+	def __init__(self):
+		self._counters: defaultdict[str, defaultdict[tuple, float]] = defaultdict(lambda: defaultdict(float))
+		self._histograms: defaultdict[str, dict[tuple, list[float]]] = defaultdict(dict)
+
+	def inc(self, name: str, value: float = 1, **labels: str) -> None:
+		"""
+		Increments a counter
+
+		:param name: name of the counter
+		:param value: amount added to the counter
+		:param labels: labels of the counter
+		"""
+		self._counters[name][tuple(sorted(labels.items()))] += value
+
+	def observe(self, name: str, value: float, **labels: str) -> None:
+		"""
+		Records an observation in a histogram
+
+		:param name: name of the histogram
+		:param value: observed value
+		:param labels: labels of the histogram
+		"""
+
+		# per bucket counts followed by the sum and count of observations, made cumulative when rendered
+		histogram = self._histograms[name].setdefault(tuple(sorted(labels.items())), [0] * (len(self.BUCKETS) + 2))
+		histogram[bisect.bisect_left(self.BUCKETS, value)] += 1
+		histogram[-2] += value
+		histogram[-1] += 1
+
+	def render(self) -> str:
+		"""
+		Returns every metric in the Prometheus text format
+		"""
+
+		lines = []
+
+		for name, series in self._counters.items():
+			lines += [f'# HELP {name} {self.HELP.get(name, name)}', f'# TYPE {name} counter']
+			lines += [f'{name}{_labels(labels)} {value:g}' for labels, value in series.items()]
+
+		for name, series in self._histograms.items():
+			lines += [f'# HELP {name} {self.HELP.get(name, name)}', f'# TYPE {name} histogram']
+
+			for labels, histogram in series.items():
+				total = 0
+
+				for bound, count in zip((*self.BUCKETS, '+Inf'), histogram):
+					total += count
+					lines.append(f'{name}_bucket{_labels(labels + (("le", str(bound)),))} {total}')
+
+				lines += [f'{name}_sum{_labels(labels)} {histogram[-2]:g}', f'{name}_count{_labels(labels)} {histogram[-1]}']
+
+		return '\n'.join(lines) + '\n'
+
+class RevenutTimer:
+	"""
+	Context manager timing a stage into the stage histogram and the `Server-Timing` of the request being served
+	"""
+
+	__slots__ = ('stage', 'start')
+
+	def __init__(self, stage: str):
+		self.stage = stage
+
+	def __enter__(self) -> 'RevenutTimer':
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, *exc) -> None:
+		elapsed = time.perf_counter() - self.start
+		default_metrics().observe('revenut_stage_seconds', elapsed, stage=self.stage)
+		note(self.stage, elapsed)
+
+async def timed(stage: str, awaitable: Awaitable[T]) -> T:
+	"""
+	Returns the result of an awaitable timed as a stage
+	"""
+
+	with RevenutTimer(stage):
+		return await awaitable
+
+def note(name: str, value: float | str) -> None:
+	"""
+	Adds a duration in seconds, or a description, to the `Server-Timing` of the request being served
+	"""
+
+	request_timings = timings.get()
+
+	if (request_timings is None):
+		return
+
+	if (isinstance(value, str)):
+		request_timings[name] = value
+	else:
+		request_timings[name] = request_timings.get(name, 0) + value
+
+def start_timings() -> dict[str, float | str]:
+	"""
+	Starts collecting the `Server-Timing` of the request being served, including the tasks it spawns
+	"""
+
+	request_timings = {}
+	timings.set(request_timings)
+
+	return request_timings
+
+def server_timing(request_timings: dict[str, float | str]) -> str:
+	"""
+	Returns the `Server-Timing` header value of collected timings
+	https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Server-Timing
+	"""
+	return ', '.join(f'{name};desc="{value}"' if isinstance(value, str) else f'{name};dur={value * 1000:.1f}' for name, value in request_timings.items())
+
+def _labels(labels: tuple) -> str:
+	if (not labels):
+		return ''
+
+	return '{' + ','.join(f'{key}="{str(value)}"' for key, value in labels) + '}'
+
+@functools.cache
+def default_metrics() -> RevenutMetrics:
+	"""
+	Returns the process-wide metrics
+	"""
+	return RevenutMetrics()
+
+def main() -> None:
+	with RevenutTimer('example'):
+		default_metrics().inc('revenut_stripe_pages_total', resource='/v1/charges')
+
+	print(default_metrics().render())
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,149 @@
+from typing import Awaitable, Callable
+
+import os
+import asyncio
+import datetime
+import functools
+import logging
+import time
+
+from scheduler_module import background
+from timezone_module import RevenutTimezone
+
+class RevenutPrefetch:
+	"""
+	Keeps the dashboards of recently active accounts warm by recomputing them in the background
+	Dashboards are recomputed on a cadence and right after local midnight, when every window of `set_locale` moves and a new cache key starts cold
+	"""
+
+	def __init__(self, interval: float | None = None, active: float | None = None, concurrency: int | None = None, grace: float = 5, maxsize: int | None = None):
+		"""
+		:param interval: seconds between the refreshes of an account, 0 disables prefetching
+		:param active: seconds an account is prefetched after its last request
+		:param concurrency: dashboards prefetched at once
+		:param grace: seconds after local midnight the dashboards of the new day are prefetched
+		:param maxsize: maximum number of dashboards prefetched, the least recently requested ones being dropped beyond it
+		"""
+
+		self.interval = interval if interval is not None else float(os.getenv('REVENUT_PREFETCH_INTERVAL', 5 * 60))
+		self.active = active or float(os.getenv('REVENUT_PREFETCH_ACTIVE', 24 * 60 * 60))
+		self.concurrency = concurrency or int(os.getenv('REVENUT_PREFETCH_CONCURRENCY', 4))
+		self.grace = grace
+		self.maxsize = maxsize or int(os.getenv('REVENUT_PREFETCH_SIZE', 10000))
+		# last request and next prefetch Epoch timestamps of every (account, timezone), least recently requested first
+		self._accounts: dict[tuple[str, str], list[float]] = {}
+		self._wake = asyncio.Event()
+
+	def touch(self, account_id: str, timezone: str) -> None:
+		"""
+		Records a request for the authorized dashboard of an account, keeping it warm for the active period
+
+		:param account_id: stripe account identifier
+		:param timezone: timezone identifier
+		"""
+
+		now = time.time()
+		key = (account_id, timezone)
+
+		if (key in self._accounts):
+			self._accounts[key] = self._accounts.pop(key)
+			self._accounts[key][0] = now
+		else:
+			# the request itself computes the dashboard so the first prefetch waits for the next one due
+			self._accounts[key] = [now, self.due(timezone, now)]
+			self._wake.set()
+
+			if (len(self._accounts) > self.maxsize):
+				del self._accounts[next(iter(self._accounts))]
+
+	def discard(self, account_id: str) -> None:
+		"""
+		Stops prefetching the dashboards of an account
+		"""
+
+		for key in [key for key in self._accounts if key[0] == account_id]:
+			del self._accounts[key]
+
+	def due(self, timezone: str, now: float) -> float:
+		"""
+		Returns when a dashboard prefetched now is due again: after the cadence or right after local midnight, whichever comes first
+		"""
+
+		local = RevenutTimezone(timezone, datetime.datetime.fromtimestamp(now, datetime.timezone.utc))
+		midnight = local.start(local.today + datetime.timedelta(days=1)).timestamp()
+
+		return min(now + self.interval, midnight + self.grace)
+
+	async def run(self, refresh: Callable[[str, str], Awaitable]) -> None:
+		"""
+		Prefetches due dashboards until cancelled, dropping the accounts no longer authorized
+
+		:param refresh: recomputes the dashboard of an account and timezone, returning whether the account is still authorized
+		"""
+
+		semaphore = asyncio.Semaphore(self.concurrency)
+		tasks: set[asyncio.Task] = set()
+
+		async def prefetch(key: tuple[str, str]) -> None:
+			async with semaphore:
+				try:
+					if (not await refresh(*key)):
+						self._accounts.pop(key, None)
+						return
+				except Exception as e:
+					logging.error(e)
+
+			if (key in self._accounts):
+				self._accounts[key][1] = self.due(key[1], time.time())
+				self._wake.set()
+
+		try:
+			while True:
+				now = time.time()
+
+				for key, (active_at, _) in list(self._accounts.items()):
+					if (active_at < now - self.active):
+						del self._accounts[key]
+
+				due = [key for key, (_, due_at) in self._accounts.items() if due_at <= now]
+
+				# every due dashboard is prefetched in its own task so a slow account never delays the next scans
+				for key in due:
+					# not due again until this prefetch completes
+					self._accounts[key][1] = float('inf')
+					task = asyncio.ensure_future(prefetch(key))
+					tasks.add(task)
+					task.add_done_callback(tasks.discard)
+
+				wake = min([now + self.interval, *(due_at for _, due_at in self._accounts.values())])
+				self._wake.clear()
+
+				try:
+					await asyncio.wait_for(self._wake.wait(), max(1, wake - time.time()))
+				except asyncio.TimeoutError:
+					pass
+		finally:
+			for task in tasks:
+				task.cancel()
+
+	def start(self, refresh: Callable[[str, str], Awaitable]) -> asyncio.Task | None:
+		"""
+		Starts prefetching in the background unless disabled
+
+		:param refresh: recomputes the dashboard of an account and timezone, returning whether the account is still authorized
+		"""
+
+		if (not self.interval):
+			return None
+
+		return asyncio.ensure_future(background(self.run(refresh)))
+
+	def __len__(self) -> int:
+		return len(self._accounts)
+
+@functools.cache
+def default_prefetch() -> RevenutPrefetch:
+	"""
+	Returns the process-wide prefetcher
+	"""
+	return RevenutPrefetch()
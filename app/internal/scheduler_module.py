@@ -0,0 +1,202 @@
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+import os
+import asyncio
+import collections
+import contextvars
+import email.utils
+import heapq
+import itertools
+import random
+import time
+
+import httpx
+
+from enums import RevenutPriorityType
+from metrics_module import default_metrics
+
+T = TypeVar('T')
+
+# priority of the Stripe requests made by the running task, interactive unless the task runs in the background
+priority: contextvars.ContextVar[RevenutPriorityType] = contextvars.ContextVar('priority', default=RevenutPriorityType.INTERACTIVE)
+
+class RevenutTokenBucket:
+	"""
+	Token bucket pacing the requests made on behalf of one account
+	Tokens are reserved ahead of time so waiting requests are served in arrival order
+	"""
+
+	__slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+	def __init__(self, rate: float, capacity: float):
+		self.rate = rate
+		self.capacity = capacity
+		self.tokens = capacity
+		self.updated = time.monotonic()
+
+	def reserve(self) -> float:
+		"""
+		Takes a token and returns the seconds to wait before it is available
+		"""
+
+		now = time.monotonic()
+		self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate) - 1
+		self.updated = now
+
+		return max(0, -self.tokens / self.rate)
+
+	def pause(self, seconds: float) -> None:
+		"""
+		Withholds tokens for some seconds, e.g. after Stripe answered `429 Too Many Requests`
+		"""
+
+		self.reserve()
+		self.tokens = min(self.tokens + 1, -seconds * self.rate)
+
+class RevenutPriorityLimiter:
+	"""
+	Bounds the requests in flight, handing freed slots to the waiters of the highest priority first
+	"""
+
+	def __init__(self, limit: int):
+		self.limit = limit
+		self._active = 0
+		self._waiters: list[tuple[int, int, asyncio.Future]] = []
+		self._order = itertools.count()
+
+	async def acquire(self, priority: RevenutPriorityType) -> None:
+		if (self._active < self.limit and not self._waiters):
+			self._active += 1
+			return
+
+		future = asyncio.get_running_loop().create_future()
+		heapq.heappush(self._waiters, (priority, next(self._order), future))
+
+		try:
+			await future
+		except asyncio.CancelledError:
+			# the slot was handed over right before the cancellation
+			if (future.done() and not future.cancelled()):
+				self.release()
+			raise
+
+	def release(self) -> None:
+		while (self._waiters):
+			future = heapq.heappop(self._waiters)[2]
+
+			if (not future.done()):
+				future.set_result(None)
+				return
+
+		self._active -= 1
+
+	def __len__(self) -> int:
+		return self._active
+
+class RevenutScheduler:
+	"""
+	Schedules every Stripe request of the process within a global concurrency limit and per-account rate limits
+	Rate limited, failed and unreachable requests are retried with jittered exponential backoff honoring `Retry-After`
+	https://stripe.com/docs/rate-limits
+	"""
+
+	def __init__(self, concurrency: int | None = None, rate: float | None = None, burst: float | None = None, retries: int | None = None, backoff: float | None = None, backoff_max: float | None = None):
+		self.limiter = RevenutPriorityLimiter(concurrency or int(os.getenv('STRIPE_CONCURRENCY', 64)))
+		self.rate = rate or float(os.getenv('STRIPE_ACCOUNT_RATE', 25))
+		self.burst = burst or float(os.getenv('STRIPE_ACCOUNT_BURST', self.rate))
+		self.retries = retries if retries is not None else int(os.getenv('STRIPE_MAX_RETRIES', 3))
+		self.backoff = backoff if backoff is not None else float(os.getenv('STRIPE_BACKOFF', 0.5))
+		self.backoff_max = backoff_max if backoff_max is not None else float(os.getenv('STRIPE_BACKOFF_MAX', 8))
+		self._buckets: collections.defaultdict[Hashable, RevenutTokenBucket] = collections.defaultdict(lambda: RevenutTokenBucket(self.rate, self.burst))
+
+	async def request(self, account_id: str | None, send: Callable[[], Awaitable[httpx.Response]]) -> httpx.Response:
+		"""
+		Returns the response of a request once it no longer needs retrying
+
+		:param account_id: account whose rate limit the request counts against, `None` for the platform
+		:param send: sends the request
+		"""
+
+		bucket = self._buckets[account_id]
+		metrics = default_metrics()
+
+		for attempt in itertools.count():
+			delay = bucket.reserve()
+
+			if (delay):
+				await asyncio.sleep(delay)
+
+			await self.limiter.acquire(priority.get())
+
+			try:
+				response = await send()
+			except httpx.TransportError:
+				if (attempt >= self.retries):
+					raise
+
+				response = None
+			finally:
+				self.limiter.release()
+
+			metrics.inc('revenut_stripe_requests_total', status=str(response.status_code) if response is not None else 'error')
+
+			if (response is not None and (attempt >= self.retries or not self.retryable(response))):
+				return response
+
+			delay = self.retry_after(response) or self.jitter(attempt)
+			metrics.inc('revenut_stripe_retries_total', reason=str(response.status_code) if response is not None else 'transport')
+
+			if (response is not None and response.status_code == 429):
+				bucket.pause(delay)
+
+			await asyncio.sleep(delay)
+
+	def retryable(self, response: httpx.Response) -> bool:
+		"""
+		Returns whether a response is worth retrying, deferring to Stripe's `Stripe-Should-Retry` header when present
+		"""
+
+		should_retry = response.headers.get('Stripe-Should-Retry')
+
+		if (not response.is_error):
+			return False
+		elif (should_retry is not None):
+			return should_retry == 'true'
+
+		return response.status_code == 429 or response.status_code >= 500
+
+	def jitter(self, attempt: int) -> float:
+		"""
+		Returns a random delay up to an exponential backoff so clients retrying together spread out
+		"""
+		return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+
+	def retry_after(self, response: httpx.Response | None) -> float | None:
+		"""
+		Returns the seconds a response asks to wait before retrying, if any
+		"""
+
+		value = response.headers.get('Retry-After') if response is not None else None
+
+		if (not value):
+			return None
+
+		try:
+			seconds = float(value)
+		except ValueError:
+			try:
+				seconds = email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+			except (TypeError, ValueError):
+				return None
+
+		return max(0, seconds)
+
+async def background(awaitable: Awaitable[T]) -> T:
+	"""
+	Awaits with background priority so the Stripe requests it makes yield to interactive ones
+	Meant to run as its own task since the priority holds for the rest of the calling task
+	"""
+
+	priority.set(RevenutPriorityType.BACKGROUND)
+
+	return await awaitable
@@ -0,0 +1,181 @@
+from typing import Hashable, NamedTuple
+
+import os
+import json
+import sqlite3
+import tempfile
+import threading
+import time
+
+class RevenutSharedEntry(NamedTuple):
+	"""
+	Serialized cache entry shared across worker processes
+	"""
+
+	content: bytes
+	etag: str
+	updated: float
+	ttl: float | None
+
+class RevenutSharedCache:
+	"""
+	Cache of serialized entries shared by the worker processes of a host through a SQLite file
+	Entries expire after their TTL plus the stale period and the least recently used ones are evicted beyond the size bound
+	Leases let one worker compute an entry while the others wait for its result instead of calling Stripe as well
+	Revocations tell the other workers to drop what they hold of an account that logged out
+	"""
+
+	SCHEMA = """
+		CREATE TABLE IF NOT EXISTS entries (
+			key TEXT NOT NULL PRIMARY KEY
+			, content BLOB NOT NULL
+			, etag TEXT NOT NULL
+			, updated REAL NOT NULL
+			, ttl REAL
+			, accessed REAL NOT NULL
+		);
+		CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+		CREATE TABLE IF NOT EXISTS leases (
+			key TEXT NOT NULL PRIMARY KEY
+			, expires REAL NOT NULL
+		);
+		CREATE TABLE IF NOT EXISTS revocations (
+			account TEXT NOT NULL PRIMARY KEY
+			, revoked REAL NOT NULL
+		);
+	"""
+
+	def __init__(self, path: str | None = None, maxsize: int | None = None, ttl: float | None = None, stale: float | None = None):
+		"""
+		:param path: SQLite file shared by the workers, defaults to the directory of the local store
+		:param maxsize: maximum number of entries
+		:param ttl: seconds entries without their own TTL stay fresh
+		:param stale: seconds expired entries are kept to be served while refreshing
+		"""
+
+		store = os.getenv('REVENUT_STORE_PATH') or os.path.join(tempfile.gettempdir(), 'revenut.db')
+		self.path = path or os.getenv('REVENUT_SHARED_CACHE_PATH') or os.path.join(os.path.dirname(store), 'revenut-cache.db')
+		self.maxsize = maxsize or int(os.getenv('REVENUT_SHARED_CACHE_SIZE', 10000))
+		self.ttl = ttl if ttl is not None else float(os.getenv('REVENUT_CACHE_TTL', 60))
+		self.stale = stale if stale is not None else float(os.getenv('REVENUT_CACHE_STALE', 60 * 60))
+		self._local = threading.local()
+		self._sets = 0
+
+		with self.connection() as connection:
+			connection.executescript(self.SCHEMA)
+
+	def connection(self) -> sqlite3.Connection:
+		"""
+		Returns the SQLite connection owned by the calling thread
+		"""
+
+		connection = getattr(self._local, 'connection', None)
+
+		if (connection is None):
+			connection = sqlite3.connect(self.path, timeout=30)
+			connection.execute('PRAGMA journal_mode=WAL')
+			connection.execute('PRAGMA synchronous=NORMAL')
+			self._local.connection = connection
+
+		return connection
+
+	def get(self, key: Hashable) -> RevenutSharedEntry | None:
+		"""
+		Returns the entry of a key unless it expired past its stale period
+		"""
+
+		with self.connection() as connection:
+			row = connection.execute('UPDATE entries SET accessed = ? WHERE key = ? RETURNING content, etag, updated, ttl', (time.time(), _key(key))).fetchone()
+
+		if (row is None):
+			return None
+
+		entry = RevenutSharedEntry(*row)
+
+		if (time.time() - entry.updated > (self.ttl if entry.ttl is None else entry.ttl) + self.stale):
+			return None
+
+		return entry
+
+	def set(self, key: Hashable, entry: RevenutSharedEntry) -> None:
+		"""
+		Saves the entry of a key, evicting expired and least recently used entries every so often
+		"""
+
+		with self.connection() as connection:
+			connection.execute('INSERT OR REPLACE INTO entries (key, content, etag, updated, ttl, accessed) VALUES (?, ?, ?, ?, ?, ?)', (_key(key), *entry, time.time()))
+
+		self._sets += 1
+
+		if (self._sets % 64 == 0):
+			self.evict()
+
+	def pop(self, key: Hashable) -> None:
+		with self.connection() as connection:
+			connection.execute('DELETE FROM entries WHERE key = ?', (_key(key),))
+
+	def discard(self, prefix: tuple, keep: list[Hashable] = []) -> None:
+		"""
+		Removes the entries whose key starts with a prefix such as `(account_id,)`
+
+		:param prefix: first items of the keys to remove
+		:param keep: keys not to remove
+		"""
+
+		start = json.dumps(list(prefix), default=str)[:-1] + ','
+
+		with self.connection() as connection:
+			connection.execute(f'DELETE FROM entries WHERE substr(key, 1, ?) = ? AND key NOT IN ({", ".join("?" * len(keep))})', (len(start), start, *map(_key, keep)))
+
+	def evict(self) -> None:
+		"""
+		Removes expired entries and the least recently used ones beyond the size bound
+		"""
+
+		with self.connection() as connection:
+			connection.execute('DELETE FROM entries WHERE updated + COALESCE(ttl, ?) + ? < ?', (self.ttl, self.stale, time.time()))
+			connection.execute('DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY accessed DESC LIMIT -1 OFFSET ?)', (self.maxsize,))
+			connection.execute('DELETE FROM leases WHERE expires < ?', (time.time(),))
+			# no entry saved before a revocation outlives it
+			connection.execute('DELETE FROM revocations WHERE revoked + ? + ? < ?', (self.ttl, self.stale, time.time()))
+
+	def acquire(self, key: Hashable, seconds: float) -> bool:
+		"""
+		Returns whether the calling worker obtained the lease of a key, held until released or for some seconds
+		"""
+
+		now = time.time()
+
+		with self.connection() as connection:
+			cursor = connection.execute('INSERT INTO leases (key, expires) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET expires = excluded.expires WHERE expires < ?', (_key(key), now + seconds, now))
+
+		return cursor.rowcount == 1
+
+	def release(self, key: Hashable) -> None:
+		with self.connection() as connection:
+			connection.execute('DELETE FROM leases WHERE key = ?', (_key(key),))
+
+	def revoke(self, account_id: str, revoked: float) -> None:
+		"""
+		Removes the entries of an account and records when it was revoked for the other workers
+
+		:param account_id: stripe account identifier
+		:param revoked: Epoch timestamp of the revocation
+		"""
+
+		self.discard((account_id,))
+
+		with self.connection() as connection:
+			connection.execute('INSERT OR REPLACE INTO revocations (account, revoked) VALUES (?, ?)', (account_id, revoked))
+
+	def revocations(self, since: float) -> list[tuple[str, float]]:
+		"""
+		Returns the accounts revoked after an Epoch timestamp along with when they were
+		"""
+		return self.connection().execute('SELECT account, revoked FROM revocations WHERE revoked > ?', (since,)).fetchall()
+
+def _key(key: Hashable) -> str:
+	"""
+	Returns the text form of a cache key such as `["acct_123", "America/Los_Angeles", "2023-07-01"]`
+	"""
+	return json.dumps(list(key) if isinstance(key, tuple) else key, default=str)
@@ -0,0 +1,650 @@
+from typing import Any, Callable, NamedTuple
+
+import os
+import asyncio
+import concurrent.futures
+import functools
+import sqlite3
+import tempfile
+import threading
+
+from aggregate_module import RevenutChargeColumns, RevenutSubscriptionColumns
+
+class RevenutCharge(NamedTuple):
+	"""
+	Compact projection of a Stripe charge with only the fields used for metrics
+	"""
+
+	id: str
+	created: int
+	amount: int
+	status: str
+	refunded: bool
+	disputed: bool
+
+	@classmethod
+	def from_stripe(cls, charge) -> 'RevenutCharge':
+		"""
+		Returns a projection of a `stripe.Charge` (or its JSON representation)
+		"""
+		return cls(charge['id'], int(charge['created']), int(charge['amount']), charge['status'], bool(charge['refunded']), bool(charge['disputed']))
+
+class RevenutCustomer(NamedTuple):
+	"""
+	Compact projection of a Stripe customer
+	"""
+
+	id: str
+	created: int
+
+	@classmethod
+	def from_stripe(cls, customer) -> 'RevenutCustomer':
+		"""
+		Returns a projection of a `stripe.Customer` (or its JSON representation)
+		"""
+		return cls(customer['id'], int(customer['created']))
+
+class RevenutSubscription(NamedTuple):
+	"""
+	Compact projection of a Stripe subscription with only the fields used for forecasts
+	"""
+
+	id: str
+	customer: str | None
+	status: str
+	created: int
+	current_period_start: int
+	current_period_end: int
+	trial_start: int | None
+	trial_end: int | None
+	canceled_at: int | None
+	ended_at: int | None
+	amount: int
+	interval: str | None
+	interval_count: int
+
+	@classmethod
+	def from_stripe(cls, subscription) -> 'RevenutSubscription':
+		"""
+		Returns a projection of a `stripe.Subscription` (or its JSON representation)
+		"""
+
+		plan = subscription.get('plan') or {}
+
+		return cls(
+			subscription['id']
+			, subscription.get('customer')
+			, subscription['status']
+			, int(subscription['created'])
+			, int(subscription['current_period_start'])
+			, int(subscription['current_period_end'])
+			, subscription.get('trial_start')
+			, subscription.get('trial_end')
+			, subscription.get('canceled_at')
+			, subscription.get('ended_at')
+			, plan.get('amount') or 0
+			, plan.get('interval')
+			, plan.get('interval_count') or 1
+		)
+
+class RevenutAccount(NamedTuple):
+	"""
+	Profile of a connected account along with the last file link issued for its branding icon
+	"""
+
+	id: str
+	name: str | None
+	icon: str | None
+	icon_url: str | None
+	icon_expires: int
+	updated: int
+
+class RevenutRollup(NamedTuple):
+	"""
+	Totals of an account for one local day, amounts in cents
+	"""
+
+	day: str
+	gross: int
+	payments: int
+	customers: int
+	trials: int
+	refunds: int
+
+class RevenutConnection(NamedTuple):
+	"""
+	Account connected through Stripe Connect OAuth along with the digest of the authorization code it was connected with
+	"""
+
+	id: str
+	code: str
+	connected: int
+	scope: str | None
+	livemode: bool
+
+class RevenutAnalyticsMonth(NamedTuple):
+	"""
+	Subscription analytics of an account for one local month, amounts in cents
+	Trials are counted in the month their subscription was created (signup cohort)
+	"""
+
+	month: str
+	mrr: int
+	mrr_new: int
+	mrr_churned: int
+	subscribers: int
+	subscribers_new: int
+	churned: int
+	gross: int
+	trials: int
+	converted: int
+	pending: int
+
+class RevenutStore:
+	"""
+	Persistent per-account record store backed by SQLite so Stripe data only needs to be fetched incrementally
+	"""
+
+	SCHEMA = """
+		CREATE TABLE IF NOT EXISTS charges (
+			account TEXT NOT NULL
+			, id TEXT NOT NULL
+			, created INTEGER NOT NULL
+			, amount INTEGER NOT NULL
+			, status TEXT NOT NULL
+			, refunded INTEGER NOT NULL
+			, disputed INTEGER NOT NULL
+			, PRIMARY KEY (account, id)
+		);
+		CREATE INDEX IF NOT EXISTS charges_created ON charges (account, created);
+		CREATE TABLE IF NOT EXISTS customers (
+			account TEXT NOT NULL
+			, id TEXT NOT NULL
+			, created INTEGER NOT NULL
+			, PRIMARY KEY (account, id)
+		);
+		CREATE INDEX IF NOT EXISTS customers_created ON customers (account, created);
+		CREATE TABLE IF NOT EXISTS subscriptions (
+			account TEXT NOT NULL
+			, id TEXT NOT NULL
+			, customer TEXT
+			, status TEXT NOT NULL
+			, created INTEGER NOT NULL
+			, current_period_start INTEGER NOT NULL
+			, current_period_end INTEGER NOT NULL
+			, trial_start INTEGER
+			, trial_end INTEGER
+			, canceled_at INTEGER
+			, ended_at INTEGER
+			, amount INTEGER NOT NULL
+			, interval TEXT
+			, interval_count INTEGER NOT NULL
+			, PRIMARY KEY (account, id)
+		);
+		CREATE INDEX IF NOT EXISTS subscriptions_status ON subscriptions (account, status, current_period_end);
+		CREATE TABLE IF NOT EXISTS changes (
+			account TEXT NOT NULL
+			, hour INTEGER NOT NULL
+			, version INTEGER NOT NULL
+			, PRIMARY KEY (account, hour)
+		);
+		CREATE TABLE IF NOT EXISTS rollups (
+			account TEXT NOT NULL
+			, timezone TEXT NOT NULL
+			, day TEXT NOT NULL
+			, gross INTEGER NOT NULL
+			, payments INTEGER NOT NULL
+			, customers INTEGER NOT NULL
+			, trials INTEGER NOT NULL
+			, refunds INTEGER NOT NULL
+			, PRIMARY KEY (account, timezone, day)
+		);
+		CREATE TABLE IF NOT EXISTS analytics (
+			account TEXT NOT NULL
+			, timezone TEXT NOT NULL
+			, month TEXT NOT NULL
+			, mrr INTEGER NOT NULL
+			, mrr_new INTEGER NOT NULL
+			, mrr_churned INTEGER NOT NULL
+			, subscribers INTEGER NOT NULL
+			, subscribers_new INTEGER NOT NULL
+			, churned INTEGER NOT NULL
+			, gross INTEGER NOT NULL
+			, trials INTEGER NOT NULL
+			, converted INTEGER NOT NULL
+			, pending INTEGER NOT NULL
+			, PRIMARY KEY (account, timezone, month)
+		);
+		CREATE TABLE IF NOT EXISTS connections (
+			id TEXT NOT NULL PRIMARY KEY
+			, code TEXT NOT NULL UNIQUE
+			, connected INTEGER NOT NULL
+			, scope TEXT
+			, livemode INTEGER NOT NULL
+		);
+		CREATE TABLE IF NOT EXISTS accounts (
+			id TEXT NOT NULL PRIMARY KEY
+			, name TEXT
+			, icon TEXT
+			, icon_url TEXT
+			, icon_expires INTEGER NOT NULL
+			, updated INTEGER NOT NULL
+		);
+		CREATE TABLE IF NOT EXISTS cursors (
+			account TEXT NOT NULL
+			, name TEXT NOT NULL
+			, value INTEGER NOT NULL
+			, PRIMARY KEY (account, name)
+		);
+	"""
+
+	def __init__(self, path: str | None = None):
+		self.path = path or os.getenv('REVENUT_STORE_PATH') or os.path.join(tempfile.gettempdir(), 'revenut.db')
+		self._local = threading.local()
+		self._locks: dict[tuple[str, str], asyncio.Lock] = {}
+		# SQLite takes one writer at a time anyway, queuing writes to one thread keeps them in the order they were made
+		self._writer = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='revenut-store')
+
+		with self.connection() as connection:
+			connection.executescript(self.SCHEMA)
+
+	def connection(self) -> sqlite3.Connection:
+		"""
+		Returns the SQLite connection owned by the calling thread
+		"""
+
+		connection = getattr(self._local, 'connection', None)
+
+		if (connection is None):
+			connection = sqlite3.connect(self.path, timeout=30)
+			connection.execute('PRAGMA journal_mode=WAL')
+			connection.execute('PRAGMA synchronous=NORMAL')
+			self._local.connection = connection
+
+		return connection
+
+	async def write(self, method: Callable, *args) -> Any:
+		"""
+		Returns the result of a write of the store run off the event loop once the writes queued before it completed
+		A write still runs when its caller is cancelled, so a write queued afterwards always lands after it
+
+		:param method: writing method of the store
+		:param args: arguments of the method
+		"""
+		return await asyncio.wrap_future(self._writer.submit(method, *args))
+
+	def queued(self, method: Callable, *args) -> Any:
+		"""
+		Returns the result of a write of the store once the writes queued before it completed, blocking the calling thread
+		Meant for refreshes computed in a thread off the event loop, never for the writer thread itself
+
+		:param method: writing method of the store
+		:param args: arguments of the method
+		"""
+		return self._writer.submit(method, *args).result()
+
+	def lock(self, account_id: str, name: str = 'charges') -> asyncio.Lock:
+		"""
+		Returns the lock serializing syncs of an account so concurrent requests don't fetch the same records twice
+
+		:param account_id: stripe account identifier
+		:param name: records synced under the lock
+		"""
+		return self._locks.setdefault((account_id, name), asyncio.Lock())
+
+	def cursor(self, account_id: str, name: str) -> int | None:
+		"""
+		Returns a sync cursor of an account
+
+		:param account_id: stripe account identifier
+		:param name: name of the cursor
+		"""
+
+		row = self.connection().execute('SELECT value FROM cursors WHERE account = ? AND name = ?', (account_id, name)).fetchone()
+
+		return row[0] if row else None
+
+	def set_cursor(self, account_id: str, name: str, value: int) -> None:
+		"""
+		Saves a sync cursor of an account
+
+		:param account_id: stripe account identifier
+		:param name: name of the cursor
+		:param value: Epoch timestamp the account was synced up to
+		"""
+
+		with self.connection() as connection:
+			connection.execute('INSERT OR REPLACE INTO cursors (account, name, value) VALUES (?, ?, ?)', (account_id, name, value))
+
+	def upsert_charges(self, account_id: str, charges: list[RevenutCharge]) -> None:
+		"""
+		Inserts or updates charges of an account
+		Refunded and disputed flags are sticky so an older snapshot can't revert them
+
+		:param account_id: stripe account identifier
+		:param charges: collection of charges to save
+		"""
+
+		with self.connection() as connection:
+			connection.executemany("""
+				INSERT INTO charges (account, id, created, amount, status, refunded, disputed) VALUES (?, ?, ?, ?, ?, ?, ?)
+				ON CONFLICT (account, id) DO UPDATE SET
+					amount = excluded.amount
+					, status = excluded.status
+					, refunded = MAX(refunded, excluded.refunded)
+					, disputed = MAX(disputed, excluded.disputed)
+			""", [(account_id, *charge) for charge in charges])
+			self._touch(connection, account_id, [charge.created for charge in charges])
+
+	def charge(self, account_id: str, charge_id: str) -> RevenutCharge | None:
+		"""
+		Returns a stored charge of an account
+		"""
+
+		row = self.connection().execute('SELECT id, created, amount, status, refunded, disputed FROM charges WHERE account = ? AND id = ?', (account_id, charge_id)).fetchone()
+
+		return RevenutCharge(*row[:4], bool(row[4]), bool(row[5])) if row else None
+
+	def dispute_charges(self, account_id: str, charge_ids: list[str]) -> None:
+		"""
+		Flags charges of an account as disputed
+
+		:param account_id: stripe account identifier
+		:param charge_ids: identifiers of the disputed charges
+		"""
+
+		with self.connection() as connection:
+			created = [connection.execute('UPDATE charges SET disputed = 1 WHERE account = ? AND id = ? RETURNING created', (account_id, charge_id)).fetchall() for charge_id in charge_ids]
+			self._touch(connection, account_id, [row[0] for rows in created for row in rows])
+
+	def charges(self, account_id: str, epochStart: int) -> list[RevenutCharge]:
+		"""
+		Returns the stored charges of an account
+
+		:param account_id: stripe account identifier
+		:param epochStart: identify records created greater than or equal to Epoch timestamp
+		"""
+
+		rows = self.connection().execute('SELECT id, created, amount, status, refunded, disputed FROM charges WHERE account = ? AND created >= ? ORDER BY created', (account_id, epochStart))
+
+		return [RevenutCharge(id, created, amount, status, bool(refunded), bool(disputed)) for id, created, amount, status, refunded, disputed in rows]
+
+	def charge_columns(self, account_id: str, epochStart: int) -> RevenutChargeColumns:
+		"""
+		Returns the stored charges of an account projected into columns
+
+		:param account_id: stripe account identifier
+		:param epochStart: identify records created greater than or equal to Epoch timestamp
+		"""
+
+		rows = self.connection().execute("""
+			SELECT created, amount, status = 'succeeded' AND refunded = 0 AND disputed = 0
+			FROM charges WHERE account = ? AND created >= ? ORDER BY created
+		""", (account_id, epochStart))
+
+		return RevenutChargeColumns.from_rows(rows)
+
+	def upsert_customers(self, account_id: str, customers: list[RevenutCustomer]) -> None:
+		"""
+		Inserts or updates customers of an account
+
+		:param account_id: stripe account identifier
+		:param customers: collection of customers to save
+		"""
+
+		with self.connection() as connection:
+			connection.executemany('INSERT OR REPLACE INTO customers (account, id, created) VALUES (?, ?, ?)', [(account_id, *customer) for customer in customers])
+			self._touch(connection, account_id, [customer.created for customer in customers])
+
+	def customer(self, account_id: str, customer_id: str) -> RevenutCustomer | None:
+		"""
+		Returns a stored customer of an account
+		"""
+
+		row = self.connection().execute('SELECT id, created FROM customers WHERE account = ? AND id = ?', (account_id, customer_id)).fetchone()
+
+		return RevenutCustomer(*row) if row else None
+
+	def upsert_subscriptions(self, account_id: str, subscriptions: list[RevenutSubscription]) -> None:
+		"""
+		Inserts or updates subscriptions of an account
+
+		:param account_id: stripe account identifier
+		:param subscriptions: collection of subscriptions to save
+		"""
+
+		with self.connection() as connection:
+			connection.executemany(f'INSERT OR REPLACE INTO subscriptions (account, {", ".join(RevenutSubscription._fields)}) VALUES (?{", ?" * len(RevenutSubscription._fields)})', [(account_id, *subscription) for subscription in subscriptions])
+			self._touch(connection, account_id, [s.created for s in subscriptions] + [epoch for s in subscriptions for epoch in (s.trial_start, s.canceled_at, s.ended_at) if epoch])
+
+	def subscription(self, account_id: str, subscription_id: str) -> RevenutSubscription | None:
+		"""
+		Returns a stored subscription of an account
+		"""
+
+		row = self.connection().execute(f'SELECT {", ".join(RevenutSubscription._fields)} FROM subscriptions WHERE account = ? AND id = ?', (account_id, subscription_id)).fetchone()
+
+		return RevenutSubscription(*row) if row else None
+
+	def upsert_connection(self, record: RevenutConnection) -> None:
+		"""
+		Records the connection of an account, replacing a previous one
+		"""
+
+		with self.connection() as connection:
+			connection.execute(f'INSERT OR REPLACE INTO connections ({", ".join(RevenutConnection._fields)}) VALUES (?{", ?" * (len(RevenutConnection._fields) - 1)})', record)
+
+	def connection_code(self, code: str) -> RevenutConnection | None:
+		"""
+		Returns the connection made with an authorization code
+
+		:param code: digest of the authorization code
+		"""
+
+		row = self.connection().execute(f'SELECT {", ".join(RevenutConnection._fields)} FROM connections WHERE code = ?', (code,)).fetchone()
+
+		return RevenutConnection(*row[:4], bool(row[4])) if row else None
+
+	def delete_records(self, account_id: str) -> None:
+		"""
+		Removes every record, rollup, cursor and the connection of an account
+		"""
+
+		with self.connection() as connection:
+			for table in ('charges', 'customers', 'subscriptions', 'changes', 'rollups', 'analytics', 'cursors'):
+				connection.execute(f'DELETE FROM {table} WHERE account = ?', (account_id,))
+
+			connection.execute('DELETE FROM accounts WHERE id = ?', (account_id,))
+			connection.execute('DELETE FROM connections WHERE id = ?', (account_id,))
+
+	def upsert_account(self, account: RevenutAccount) -> None:
+		"""
+		Inserts or updates the profile of an account
+		"""
+
+		with self.connection() as connection:
+			connection.execute(f'INSERT OR REPLACE INTO accounts ({", ".join(RevenutAccount._fields)}) VALUES (?{", ?" * (len(RevenutAccount._fields) - 1)})', account)
+
+	def account(self, account_id: str) -> RevenutAccount | None:
+		"""
+		Returns the stored profile of an account
+		"""
+
+		row = self.connection().execute(f'SELECT {", ".join(RevenutAccount._fields)} FROM accounts WHERE id = ?', (account_id,)).fetchone()
+
+		return RevenutAccount(*row) if row else None
+
+	def delete_account(self, account_id: str) -> None:
+		"""
+		Removes the stored profile of an account so the next dashboard retrieves it from Stripe
+		"""
+
+		with self.connection() as connection:
+			connection.execute('DELETE FROM accounts WHERE id = ?', (account_id,))
+
+	def subscriptions(self, account_id: str) -> list[RevenutSubscription]:
+		"""
+		Returns every stored subscription of an account
+		"""
+
+		rows = self.connection().execute(f'SELECT {", ".join(RevenutSubscription._fields)} FROM subscriptions WHERE account = ?', (account_id,))
+
+		return [RevenutSubscription(*row) for row in rows]
+
+	def subscription_columns(self, account_id: str, statuses: list[str], epochEnd: int) -> RevenutSubscriptionColumns:
+		"""
+		Returns the stored subscriptions of an account in some statuses renewing by a date, projected into columns
+		Answered by a range scan of the status index ordered by current period end
+
+		:param account_id: stripe account identifier
+		:param statuses: statuses of the subscriptions
+		:param epochEnd: identify records whose current period ends less than or equal to Epoch timestamp
+		"""
+
+		rows = self.connection().execute(f"""
+			SELECT created, current_period_end, amount, status
+			FROM subscriptions WHERE account = ? AND status IN ({", ".join("?" * len(statuses))}) AND current_period_end <= ? ORDER BY current_period_end
+		""", (account_id, *statuses, epochEnd))
+
+		return RevenutSubscriptionColumns.from_rows(rows)
+
+	def subscription_ids(self, account_id: str, statuses: list[str]) -> set[str]:
+		"""
+		Returns the identifiers of the stored subscriptions of an account in some statuses
+		"""
+
+		rows = self.connection().execute(f'SELECT id FROM subscriptions WHERE account = ? AND status IN ({", ".join("?" * len(statuses))})', (account_id, *statuses))
+
+		return {row[0] for row in rows}
+
+	def changes(self, account_id: str, version: int) -> tuple[list[int], int]:
+		"""
+		Returns the UTC hours holding records saved since a version along with the current version
+
+		:param account_id: stripe account identifier
+		:param version: version returned by a previous call, 0 for every hour ever saved
+		"""
+
+		connection = self.connection()
+		current = self.cursor(account_id, 'version') or 0
+		hours = [hour for hour, in connection.execute('SELECT hour FROM changes WHERE account = ? AND version > ? AND version <= ?', (account_id, version, current))]
+
+		return hours, current
+
+	def totals(self, account_id: str, epochStart: int, epochEnd: int) -> tuple[int, int, int, int, int]:
+		"""
+		Returns the gross volume, payment count, new customers, new trials and refunded volume of a timeframe
+
+		:param account_id: stripe account identifier
+		:param epochStart: identify records created greater than or equal to Epoch timestamp
+		:param epochEnd: identify records created less than Epoch timestamp
+		"""
+
+		connection = self.connection()
+		gross, payments, refunds = connection.execute("""
+			SELECT
+				COALESCE(SUM(CASE WHEN status = 'succeeded' AND refunded = 0 AND disputed = 0 THEN amount END), 0)
+				, COUNT(CASE WHEN status = 'succeeded' AND refunded = 0 AND disputed = 0 THEN 1 END)
+				, COALESCE(SUM(CASE WHEN status = 'succeeded' AND refunded = 1 THEN amount END), 0)
+			FROM charges WHERE account = ? AND created >= ? AND created < ?
+		""", (account_id, epochStart, epochEnd)).fetchone()
+		customers, = connection.execute('SELECT COUNT(*) FROM customers WHERE account = ? AND created >= ? AND created < ?', (account_id, epochStart, epochEnd)).fetchone()
+		trials, = connection.execute('SELECT COUNT(*) FROM subscriptions WHERE account = ? AND trial_start >= ? AND trial_start < ?', (account_id, epochStart, epochEnd)).fetchone()
+
+		return gross, payments, customers, trials, refunds
+
+	def set_rollups(self, account_id: str, timezone: str, rollups: list[RevenutRollup], version: int) -> None:
+		"""
+		Saves recomputed days of an account along with the version they are current with
+
+		:param account_id: stripe account identifier
+		:param timezone: timezone identifier the days are local to
+		:param rollups: collection of recomputed days
+		:param version: version returned by `changes`
+		"""
+
+		with self.connection() as connection:
+			connection.executemany('INSERT OR REPLACE INTO rollups (account, timezone, day, gross, payments, customers, trials, refunds) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', [(account_id, timezone, *rollup) for rollup in rollups])
+			connection.execute('INSERT OR REPLACE INTO cursors (account, name, value) VALUES (?, ?, ?)', (account_id, f'rollups:{timezone}', version))
+
+	def rollups(self, account_id: str, timezone: str, dayFrom: str, dayTo: str) -> list[RevenutRollup]:
+		"""
+		Returns the saved days of an account within a range
+
+		:param account_id: stripe account identifier
+		:param timezone: timezone identifier the days are local to
+		:param dayFrom: first day formatted as `YYYY-MM-DD`
+		:param dayTo: last day formatted as `YYYY-MM-DD`
+		"""
+
+		rows = self.connection().execute('SELECT day, gross, payments, customers, trials, refunds FROM rollups WHERE account = ? AND timezone = ? AND day >= ? AND day <= ? ORDER BY day', (account_id, timezone, dayFrom, dayTo))
+
+		return [RevenutRollup(*row) for row in rows]
+
+	def set_analytics(self, account_id: str, timezone: str, months: list[RevenutAnalyticsMonth], version: int) -> None:
+		"""
+		Saves recomputed months of an account along with the version they are current with
+
+		:param account_id: stripe account identifier
+		:param timezone: timezone identifier the months are local to
+		:param months: collection of recomputed months
+		:param version: version returned by `changes`
+		"""
+
+		with self.connection() as connection:
+			connection.executemany(f'INSERT OR REPLACE INTO analytics (account, timezone, {", ".join(RevenutAnalyticsMonth._fields)}) VALUES (?, ?{", ?" * len(RevenutAnalyticsMonth._fields)})', [(account_id, timezone, *month) for month in months])
+			connection.execute('INSERT OR REPLACE INTO cursors (account, name, value) VALUES (?, ?, ?)', (account_id, f'analytics:{timezone}', version))
+
+	def analytics(self, account_id: str, timezone: str, monthFrom: str, monthTo: str) -> list[RevenutAnalyticsMonth]:
+		"""
+		Returns the saved months of an account within a range, both bounds inclusive
+
+		:param account_id: stripe account identifier
+		:param timezone: timezone identifier the months are local to
+		:param monthFrom: first day of the first month formatted as YYYY-MM-DD
+		:param monthTo: first day of the last month formatted as YYYY-MM-DD
+		"""
+
+		rows = self.connection().execute(f'SELECT {", ".join(RevenutAnalyticsMonth._fields)} FROM analytics WHERE account = ? AND timezone = ? AND month >= ? AND month <= ? ORDER BY month', (account_id, timezone, monthFrom, monthTo))
+
+		return [RevenutAnalyticsMonth(*row) for row in rows]
+
+	def delete_analytics(self, account_id: str, timezone: str, monthFrom: str) -> None:
+		"""
+		Removes the saved months of an account from a month on, as changed records affect the subscriptions of every later month
+
+		:param account_id: stripe account identifier
+		:param timezone: timezone identifier the months are local to
+		:param monthFrom: first day of the first month removed formatted as YYYY-MM-DD
+		"""
+
+		with self.connection() as connection:
+			connection.execute('DELETE FROM analytics WHERE account = ? AND timezone = ? AND month >= ?', (account_id, timezone, monthFrom))
+
+	def _touch(self, connection: sqlite3.Connection, account_id: str, epochs: list[int]) -> None:
+		"""
+		Flags the hours of saved records as changed under a new version so rollups and analytics only recompute the days and months they fall on
+		"""
+
+		if (not epochs):
+			return
+
+		version, = connection.execute("""
+			INSERT INTO cursors (account, name, value) VALUES (?, 'version', 1)
+			ON CONFLICT (account, name) DO UPDATE SET value = value + 1 RETURNING value
+		""", (account_id,)).fetchone()
+		connection.executemany('INSERT OR REPLACE INTO changes (account, hour, version) VALUES (?, ?, ?)', [(account_id, hour, version) for hour in {int(epoch) // 3600 for epoch in epochs}])
+
+@functools.cache
+def default_store() -> RevenutStore:
+	"""
+	Returns the process-wide store
+	"""
+	return RevenutStore()
+
+def main() -> None:
+	store = default_store()
+	print(store.path)
+
+if __name__ == '__main__':
+	main()
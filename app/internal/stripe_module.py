@@ -1,22 +1,71 @@
-from enums import RevenutChangeType, RevenutAuthorizationType
+from enums import RevenutChangeType, RevenutAuthorizationType, RevenutGranularityType
+from aggregate_module import RevenutChargeColumns, RevenutSubscriptionColumns, RevenutCustomerColumns
+from store_module import RevenutAccount, RevenutAnalyticsMonth, RevenutConnection, RevenutCharge, RevenutCustomer, RevenutSubscription, RevenutStore, default_store
+from client_module import default_client, close_client
+from cache_module import RevenutCacheEntry, default_cache
+from history_module import RevenutHistory, refresh_rollups
+from analytics_module import refresh_analytics
+from timezone_module import RevenutTimezone
+from metrics_module import RevenutTimer, default_metrics, note, timed
+from flight_module import RevenutSingleFlight
+from scheduler_module import background
+from prefetch_module import default_prefetch
+from typing import AsyncIterator, Awaitable, Callable, TypeVar
 from dotenv import load_dotenv
-from pydantic import BaseModel
-from zoneinfo import ZoneInfo
+from pydantic import BaseModel, Field
 
 import os
-import calendar
 import datetime
-import dateutil.relativedelta
-import locale
+import hashlib
 import logging
 import time
-import concurrent.futures
+import asyncio
 
 import stripe
 
+T = TypeVar('T')
+
 load_dotenv()
-stripe.api_key = os.getenv('STRIPE_API_KEY')
-stripe.log = 'info'		
+
+# events are only retrievable for 30 days so older sync cursors require a full sync
+STRIPE_EVENTS_RETENTION = 30 * 24 * 60 * 60
+# re-request records created shortly before the last sync in case they were not listed yet
+STRIPE_SYNC_OVERLAP = 5 * 60
+# no Stripe object was created before 2011
+STRIPE_EPOCH = int(datetime.datetime(2011, 1, 1, tzinfo=datetime.timezone.utc).timestamp())
+# errors still worth retrying later once the scheduler gave up on them
+STRIPE_TRANSIENT_ERRORS = (stripe.error.RateLimitError, stripe.error.APIConnectionError, stripe.error.APIError)
+# seconds a stored account profile is served before being retrieved again in the background
+REVENUT_ACCOUNT_TTL = float(os.getenv('REVENUT_ACCOUNT_TTL', 60 * 60))
+# seconds the file links of account icons stay valid, they are reissued in the background once less than the profile TTL is left
+REVENUT_ICON_EXPIRE = int(os.getenv('REVENUT_ICON_EXPIRE', 24 * 60 * 60))
+# only subscriptions in these statuses count towards the forecasts
+STRIPE_SUBSCRIPTION_STATUSES = ['active', 'trialing']
+STRIPE_SUBSCRIPTION_EVENTS = ['customer.subscription.created', 'customer.subscription.updated', 'customer.subscription.deleted', 'customer.subscription.paused', 'customer.subscription.resumed', 'customer.subscription.trial_will_end']
+# seconds `/v1/dashboard` waits for Stripe before answering from the sections ready and the last known dashboard
+REVENUT_DASHBOARD_DEADLINE = float(os.getenv('REVENUT_DASHBOARD_DEADLINE', 10))
+# fields of the dashboard computed by each section, the forecast fields are derived from them
+DASHBOARD_SECTIONS = {
+	'charges': ['VolumeGrossToday', 'CountPaymentsToday', 'VolumeGrossMonthCurrent', 'VolumeGrossMonthPrevious', 'VolumeGrossMonthToDatePrevious']
+	, 'subscriptions': ['VolumePending', 'VolumeTrialing', 'CountTrialingMonthCurrent']
+	, 'customers': ['CountTrialingToday']
+	, 'account': ['AccountName', 'AccountIconURL']
+}
+STRIPE_CHARGE_EVENTS = ['charge.succeeded', 'charge.failed', 'charge.captured', 'charge.updated', 'charge.refunded', 'charge.dispute.created']
+
+# coalesced and background retrievals of account profiles
+_profiles = RevenutSingleFlight()
+_tasks: set[asyncio.Task] = set()
+# dashboards being computed by cache key, read for their completed sections once a deadline passes
+_loading: dict[tuple, 'RevenutStripe'] = {}
+
+class RevenutSection(BaseModel):
+	"""
+	Freshness of a section of the dashboard
+	"""
+
+	IsStale:bool = False
+	DateUpdated:datetime.datetime | None = None
 
 class RevenutStripe(BaseModel):
 	#region Properties
@@ -29,15 +78,15 @@ class RevenutStripe(BaseModel):
 	AccountIconURL:str | None = None
 	AuthorizationCode:str | None = None
 	TimezonePreference:str | None = None
-	DateToday:datetime.datetime = datetime.datetime.now()
-	DateDayStartCurrent:datetime.datetime = datetime.datetime.now()
-	DateDayEndCurrent:datetime.datetime = datetime.datetime.now()
-	DateMonthStartCurrent:datetime.datetime = datetime.datetime.now()
-	DateMonthEndCurrent:datetime.datetime = datetime.datetime.now()
-	DateMonthEndPrevious:datetime.datetime = datetime.datetime.now()
-	DateMonthToDateCurrent:datetime.datetime = datetime.datetime.now()
-	DateMonthStartPrevious:datetime.datetime = datetime.datetime.now()
-	DateMonthToDatePrevious:datetime.datetime = datetime.datetime.now()
+	DateToday:datetime.datetime = Field(default_factory=datetime.datetime.now)
+	DateDayStartCurrent:datetime.datetime = Field(default_factory=datetime.datetime.now)
+	DateDayEndCurrent:datetime.datetime = Field(default_factory=datetime.datetime.now)
+	DateMonthStartCurrent:datetime.datetime = Field(default_factory=datetime.datetime.now)
+	DateMonthEndCurrent:datetime.datetime = Field(default_factory=datetime.datetime.now)
+	DateMonthEndPrevious:datetime.datetime = Field(default_factory=datetime.datetime.now)
+	DateMonthToDateCurrent:datetime.datetime = Field(default_factory=datetime.datetime.now)
+	DateMonthStartPrevious:datetime.datetime = Field(default_factory=datetime.datetime.now)
+	DateMonthToDatePrevious:datetime.datetime = Field(default_factory=datetime.datetime.now)
 	VolumeGrossToday:float = 0
 	VolumeGrossMonthCurrent:float = 0
 	VolumeGrossMonthCurrentPercent:float = 0
@@ -54,6 +103,7 @@ class RevenutStripe(BaseModel):
 	CountPaymentsToday:int = 0
 	CountTrialingToday:int = 0
 	CountTrialingMonthCurrent:int = 0
+	Sections:dict[str, RevenutSection] = {}
 	#endregion
 
 	def __init__(self, *a, **kw):
@@ -63,8 +113,246 @@ class RevenutStripe(BaseModel):
 			self.set_locale()
 			self.Status = RevenutAuthorizationType.INITIALIZED
 
+		# outside of an event loop (e.g. scripts) the model populates itself, async callers should use `create` instead
+		if ((self.AuthorizationCode or self.AccountID) and not _running_loop()):
+			_run(self.load())
+
+	@classmethod
+	async def create(cls, *a, **kw) -> 'RevenutStripe':
+		"""
+		Returns a model populated from Stripe without blocking the running event loop
+		"""
+
+		rStripe = cls(*a, **kw)
+		await rStripe.load()
+
+		return rStripe
+
+	@classmethod
+	async def connect(cls, code: str) -> 'RevenutStripe':
+		"""
+		Returns a model of the account an authorization code connects, recording the connection so the code is only exchanged once
+		Only the token is retrieved so the dashboard of the account can be computed right after
+
+		:param code: authorization code returned from Stripe Connect
+		"""
+
+		store = default_store()
+		rStripe = cls()
+		digest = hashlib.blake2b(code.encode(), digest_size=16).hexdigest()
+		connection = store.connection_code(digest)
+
+		if (connection is None):
+			token = await rStripe.token(code)
+
+			if (isinstance(token, stripe.error.StripeError)):
+				rStripe.Status = RevenutAuthorizationType.ERROR
+				rStripe.Error = token.user_message
+				rStripe.Code = token.http_status
+				return rStripe
+
+			connection = RevenutConnection(rStripe.user_id(token), digest, int(time.time()), token.get('scope'), bool(token.get('livemode')))
+			await store.write(store.upsert_connection, connection)
+
+		rStripe.AccountID = connection.id
+		rStripe.Status = RevenutAuthorizationType.AUTHORIZED_CODE
+		rStripe.IsAuthorized = True
+
+		return rStripe
+
+	@classmethod
+	async def disconnect(cls, account_id: str) -> None:
+		"""
+		Evicts the cached dashboards, stored records, sync cursors and connection of an account, in every worker of the host,
+		cancelling its dashboards in flight, ending its live sessions and no longer prefetching it
+
+		:param account_id: stripe account identifier
+		"""
+
+		store = default_store()
+		default_cache().revoke(account_id)
+		default_prefetch().discard(account_id)
+
+		# queued behind the writes of the syncs just cancelled so none of them lands after it
+		await store.write(store.delete_records, account_id)
+
+	@classmethod
+	async def warm(cls, attempts: int | None = None) -> bool:
+		"""
+		Opens the local store, the dashboard cache and the pooled Stripe connections of the worker ahead of its first dashboard
+		Returns whether Stripe answered within the attempts
+
+		:param attempts: tries to reach Stripe, one second apart then doubling up to 30 seconds, `None` trying until it answers
+		"""
+
+		default_store()
+		default_cache()
+		attempt = 0
+
+		while (attempts is None or attempt < attempts):
+			try:
+				await default_client().warm()
+				return True
+			except stripe.error.APIConnectionError as e:
+				logging.warning(e)
+
+			attempt += 1
+
+			if (attempts is None or attempt < attempts):
+				await asyncio.sleep(min(2 ** (attempt - 1), 30))
+
+		return False
+
+	@classmethod
+	async def dashboard(cls, account_id: str, timezone: str, refresh: bool = False, deadline: float | None = None) -> RevenutCacheEntry:
+		"""
+		Returns the cached dashboard of an account for a timezone and local day
+		Concurrent requests share one computation and expired dashboards are refreshed in the background
+		Past the deadline the computation keeps running in the background to repopulate the cache
+		while the sections it completed are returned along with the others of the last known dashboard
+
+		:param account_id: stripe account identifier
+		:param timezone: timezone identifier
+		:param refresh: recompute the dashboard even if the cached one is fresh
+		:param deadline: seconds to wait for the dashboard to be computed
+		"""
+
+		key = (account_id, timezone, RevenutTimezone(timezone).today)
+
+		async def compute() -> RevenutCacheEntry:
+			rStripe = cls(AccountID=account_id, TimezonePreference=timezone)
+			_loading[key] = rStripe
+
+			try:
+				await rStripe.load()
+			finally:
+				_loading.pop(key, None)
+
+			return rStripe.cache_entry()
+
+		if (refresh):
+			flight = asyncio.ensure_future(default_cache().refresh(key, compute, cls.model_validate_json))
+		else:
+			flight = asyncio.ensure_future(default_cache().fetch(key, compute, cls.model_validate_json))
+
+		_tasks.add(flight)
+		flight.add_done_callback(_finished)
+
+		done, _ = await asyncio.wait([flight], timeout=deadline)
+
+		# the account was disconnected while its dashboard was computed
+		if (flight.cancelled()):
+			rStripe = cls(AccountID=account_id, TimezonePreference=timezone)
+			rStripe.Status = RevenutAuthorizationType.REVOKED
+			return rStripe.cache_entry()
+		elif (done):
+			return flight.result()
+
+		default_metrics().inc('revenut_dashboard_fallbacks_total')
+		note('deadline', 'exceeded')
+
+		return await cls.fallback(key)
+
+	@classmethod
+	async def fallback(cls, key: tuple) -> RevenutCacheEntry:
+		"""
+		Returns a dashboard of the sections completed so far by the computation of a key, the other sections filled from the last known dashboard and flagged stale
+		Raises a transient error when neither the account nor a previous dashboard is known
+
+		:param key: cache key of the dashboard
+		"""
+
+		account_id, timezone, _ = key
+		loading = _loading.get(key)
+		last = await default_cache().latest(key, cls.model_validate_json)
+		profile = default_store().account(account_id)
+
+		if (last is None and profile is None):
+			raise stripe.error.APIConnectionError('Stripe did not answer within the deadline')
+
+		rStripe = cls(AccountID=account_id, TimezonePreference=timezone)
+
+		if (last):
+			rStripe.IsAuthorized, rStripe.Status, rStripe.Code = last.value.IsAuthorized, last.value.Status, last.value.Code
+
+		if (profile):
+			rStripe.set_account(profile)
+
+		for name, fields in DASHBOARD_SECTIONS.items():
+			if (name in rStripe.Sections):
+				continue
+			elif (loading and name in loading.Sections):
+				source, section = loading, loading.Sections[name]
+			elif (last):
+				source, section = last.value, RevenutSection(IsStale=True, DateUpdated=last.value.Sections[name].DateUpdated if name in last.value.Sections else last.value.DateToday)
+			else:
+				source, section = None, RevenutSection(IsStale=True)
+
+			for field in fields if source else ():
+				setattr(rStripe, field, getattr(source, field))
+
+			rStripe.Sections[name] = section
+
+		rStripe.set_forecast()
+		entry = rStripe.cache_entry()
+		entry.cacheable = False
+
+		return entry
+
+	@classmethod
+	async def dashboards(cls, account_ids: list[str], timezone: str, concurrency: int | None = None) -> AsyncIterator[tuple[str, RevenutCacheEntry | Exception]]:
+		"""
+		Yields the cached dashboards of accounts in the order they complete, computing at most `concurrency` of them at once
+		Failed dashboards are yielded as their exception so one account doesn't hold back the others
+
+		:param account_ids: stripe account identifiers
+		:param timezone: timezone identifier
+		:param concurrency: dashboards computed at once, defaults to `REVENUT_BATCH_CONCURRENCY`
+		"""
+
+		semaphore = asyncio.Semaphore(concurrency or int(os.getenv('REVENUT_BATCH_CONCURRENCY', 8)))
+
+		async def dashboard(account_id: str) -> tuple[str, RevenutCacheEntry | Exception]:
+			async with semaphore:
+				try:
+					return account_id, await cls.dashboard(account_id, timezone)
+				except Exception as e:
+					logging.error(e)
+					return account_id, e
+
+		tasks = [asyncio.ensure_future(dashboard(account_id)) for account_id in dict.fromkeys(account_ids)]
+
+		try:
+			for task in asyncio.as_completed(tasks):
+				yield await task
+		finally:
+			# the client went away before every dashboard was streamed
+			for task in tasks:
+				task.cancel()
+
+	def cache_entry(self, ttl: float | None = None) -> RevenutCacheEntry:
+		"""
+		Returns the model serialized for the dashboard cache
+		The entity tag ignores when the model and its sections were computed so unchanged metrics keep the same tag
+
+		:param ttl: seconds the entry stays fresh, defaults to the cache TTL
+		"""
+
+		return RevenutCacheEntry(
+			self
+			, self.model_dump_json().encode()
+			, RevenutCacheEntry.tag(self.model_dump_json(exclude={'DateToday', 'Sections'}).encode())
+			, cacheable=self.IsAuthorized
+			, ttl=ttl
+		)
+
+	async def load(self) -> None:
+		"""
+		Populates properties from Stripe, fetching all data sets concurrently over the shared client
+		"""
+
 		if (self.AuthorizationCode):
-			token = self.token(self.AuthorizationCode)
+			token = await self.token(self.AuthorizationCode)
 
 			if (isinstance(token, dict)):
 				self.AccountID = self.user_id(token)
@@ -76,41 +364,88 @@ class RevenutStripe(BaseModel):
 				self.Code = token.http_status
 
 		elif (self.AccountID):
-			with concurrent.futures.ThreadPoolExecutor() as pool:
-				transactions = pool.submit(self.transactions, self.AccountID, int(self.DateMonthStartPrevious.timestamp()))
-				subscriptions = pool.submit(self.subscriptions, self.AccountID, int(self.DateMonthEndCurrent.timestamp()))
-				customers = pool.submit(self.customers, self.AccountID, int(self.DateDayStartCurrent.timestamp()))
-				account = pool.submit(self.account, self.AccountID)
+			# each data set is aggregated as soon as it arrives so a dashboard past its deadline can return the sections already done
+			transactions, subscriptions, customers, account = await asyncio.gather(
+				self.section('charges', self.transactions(self.AccountID, int(self.DateMonthStartPrevious.timestamp())), self.set_transactions)
+				, self.section('subscriptions', self.subscriptions(self.AccountID, int(self.DateMonthEndCurrent.timestamp())), self.set_subscriptions)
+				, self.section('customers', self.customers(self.AccountID, int(self.DateDayStartCurrent.timestamp())), self.set_customers)
+				, timed('account', self.account_profile(self.AccountID))
+				, return_exceptions=True
+			)
+
+			if (isinstance(account, STRIPE_TRANSIENT_ERRORS)):
+				raise account
+
+			store = default_store()
+
+			# a stored profile can outlive the authorization of the account which the data sets then report
+			for result in (transactions, subscriptions, customers):
+				if (isinstance(result, (stripe.error.AuthenticationError, stripe.error.PermissionError))):
+					await store.write(store.delete_account, self.AccountID)
+					account = result
+					break
+
+			self.set_account(account)
 
-				self.set_transactions(transactions.result())
-				self.set_subscriptions(subscriptions.result())
-				self.set_customers(customers.result())
-				self.set_account(account.result())
+			# data sets still failing after retries must not be reported as zero revenue of an authorized account
+			for result in (transactions, subscriptions, customers):
+				if (self.IsAuthorized and isinstance(result, BaseException)):
+					raise result
+
+			self.set_forecast()
+
+	async def section(self, name: str, awaitable: Awaitable[T], aggregate: Callable[[T], None]) -> T:
+		"""
+		Returns a data set fetched from Stripe after aggregating it into its section of the dashboard
+
+		:param name: name of the section
+		:param awaitable: fetches the data set
+		:param aggregate: sets the properties of the section from the data set
+		"""
+
+		result = await timed(name, awaitable)
+
+		with RevenutTimer(f'aggregate_{name}'):
+			aggregate(result)
+
+		self.Sections[name] = RevenutSection(DateUpdated=datetime.datetime.now(datetime.timezone.utc))
+
+		return result
 
 	def set_locale(self) -> None:
 		"""
-		Set locale properties
+		Set the local day and month boundaries of the dashboard
 		"""
 
-		locale.setlocale(locale.LC_ALL, '')
-		self.DateToday = self.DateToday.astimezone(ZoneInfo(self.TimezonePreference)) if self.TimezonePreference else datetime.datetime.now()
-		self.DateDayStartCurrent = self.DateToday.replace(hour=0, minute=0, second=0, microsecond=0)
-		self.DateDayEndCurrent = self.DateToday.replace(hour=23, minute=59, second=59, microsecond=999)
-		self.DateMonthStartCurrent = self.DateToday.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-		self.DateMonthEndCurrent = self.DateToday.replace(day=calendar.monthrange(self.DateToday.year, self.DateToday.month)[1], hour=23, minute=59, second=59, microsecond=999)
-		self.DateMonthToDateCurrent = self.DateToday.replace(day=self.DateToday.day, hour=23, minute=59, second=59, microsecond=999)
+		# window boundaries are converted to UTC once per timezone and day so records are bucketed on their raw `created` values
+		timezone = RevenutTimezone(self.TimezonePreference, self.DateToday)
+		windows = timezone.windows()
 
-		self.DateMonthStartPrevious = self.DateMonthStartCurrent + dateutil.relativedelta.relativedelta(months=-1)
-		self.DateMonthEndPrevious = self.DateMonthEndCurrent + dateutil.relativedelta.relativedelta(months=-1)
-		self.DateMonthToDatePrevious = self.DateDayEndCurrent - dateutil.relativedelta.relativedelta(months=1)
+		self.DateToday = timezone.now
+		self.DateDayStartCurrent = windows.day_start
+		self.DateDayEndCurrent = windows.day_end
+		self.DateMonthStartCurrent = windows.month_start
+		self.DateMonthEndCurrent = windows.month_end
+		self.DateMonthToDateCurrent = windows.day_end
 
-	def set_subscriptions(self, subscriptions: list) -> None:
+		self.DateMonthStartPrevious = windows.month_start_previous
+		self.DateMonthEndPrevious = windows.month_end_previous
+		self.DateMonthToDatePrevious = windows.month_to_date_previous
+
+	def set_subscriptions(self, subscriptions: RevenutSubscriptionColumns) -> None:
 		"""
 		Set properties dependent on retrieving subscriptions data
 		"""
 		
 		self.VolumePending = self.subscriptions_upcoming(subscriptions, self.DateMonthEndCurrent.timestamp())
 		self.VolumeTrialing, self.CountTrialingMonthCurrent = self.subscriptions_trialing(subscriptions, epochEnd=int(self.DateMonthEndCurrent.timestamp())).values()
+		self.set_forecast()
+
+	def set_forecast(self) -> None:
+		"""
+		Set properties derived from the charges and subscriptions metrics
+		"""
+
 		self.VolumeGrossMonthForecast = self.VolumeGrossMonthCurrent + self.VolumePending + self.VolumeTrialing
 		self.VolumeGrossMonthOverMonthPercentChange = self._percentage_diff(self.VolumeGrossMonthPrevious, self.VolumeGrossMonthForecast)
 		self.VolumeGrossMonthCurrentPercent = self.VolumeGrossMonthForecast and ((self.VolumeGrossMonthCurrent / self.VolumeGrossMonthForecast) * 100.0) or 0
@@ -125,229 +460,540 @@ class RevenutStripe(BaseModel):
 		else:
 			self.VolumeGrossMonthOverMonthPercentChangeType = RevenutChangeType.NOCHANGE
 
-	def set_transactions(self, transactions: list) -> None:
+	def set_transactions(self, transactions: RevenutChargeColumns) -> None:
 		"""
 		Set properties dependent on retrieving charges data
 		"""
 
-		self.VolumeGrossToday, self.CountPaymentsToday = self.transactions_date(transactions, self.DateDayStartCurrent.timestamp(), self.DateDayEndCurrent.timestamp()).values()
-		self.VolumeGrossMonthCurrent = self.transactions_date(transactions, self.DateMonthStartCurrent.timestamp(), self.DateMonthEndCurrent.timestamp())["amount"]
-		self.VolumeGrossMonthPrevious = self.transactions_date(transactions, self.DateMonthStartPrevious.timestamp(), self.DateMonthEndPrevious.timestamp())["amount"]
-		self.VolumeGrossMonthToDatePrevious = self.transactions_date(transactions, self.DateMonthStartPrevious.timestamp(), self.DateMonthToDatePrevious.timestamp())["amount"]
+		today, monthCurrent, monthPrevious, monthToDatePrevious = transactions.windows(self.transactions_windows())
+
+		self.VolumeGrossToday, self.CountPaymentsToday = today.values()
+		self.VolumeGrossMonthCurrent = monthCurrent["amount"]
+		self.VolumeGrossMonthPrevious = monthPrevious["amount"]
+		self.VolumeGrossMonthToDatePrevious = monthToDatePrevious["amount"]
 
-	def set_customers(self, customers: list) -> None:
+	def transactions_windows(self) -> list[tuple[float, float]]:
+		"""
+		Returns the timeframes of the charges metrics: today, current month, previous month and previous month to date
+		"""
+
+		return [
+			(self.DateDayStartCurrent.timestamp(), self.DateDayEndCurrent.timestamp())
+			, (self.DateMonthStartCurrent.timestamp(), self.DateMonthEndCurrent.timestamp())
+			, (self.DateMonthStartPrevious.timestamp(), self.DateMonthEndPrevious.timestamp())
+			, (self.DateMonthStartPrevious.timestamp(), self.DateMonthToDatePrevious.timestamp())
+		]
+
+	def set_customers(self, customers: RevenutCustomerColumns) -> None:
 		"""
 		Set properties dependent on retrieving customer data
 		"""
 
 		self.CountTrialingToday = self.customers_date(customers, int(self.DateDayStartCurrent.timestamp()), int(self.DateDayEndCurrent.timestamp()))
 
-	def set_account(self, account: stripe.Account | stripe.error.StripeError) -> None:
+	def set_account(self, account: RevenutAccount | stripe.error.StripeError) -> None:
 		"""
 		Set properties dependent on retrieving acccount data
 		"""
 
-		if (type(account) is stripe.Account):
+		if (isinstance(account, RevenutAccount)):
 			self.IsAuthorized = True
 			self.Status = RevenutAuthorizationType.AUTHORIZED_ID
-			self.Code = 200		
-			self.AccountName = account.business_profile.name
+			self.Code = 200
+			self.AccountName = account.name
+			self.Sections['account'] = RevenutSection(DateUpdated=datetime.datetime.fromtimestamp(account.updated, datetime.timezone.utc))
 
-			accountIconFileLink = self.account_icon(account.stripe_id, account.settings.branding.icon)
-			if (accountIconFileLink):
-				self.AccountIconURL = accountIconFileLink.url
+			if (account.icon_url and account.icon_expires > time.time()):
+				self.AccountIconURL = account.icon_url
 		elif (isinstance(account, stripe.error.StripeError)):
 			self.Status = RevenutAuthorizationType.ERROR
 			self.Error = account.user_message
 			self.Code = account.http_status
 
-	def account(self, account_id) -> stripe.error.StripeError | stripe.Account:
+	def apply_charge(self, previous: RevenutCharge | None, charge: RevenutCharge) -> None:
+		"""
+		Applies the change of a charge to the charges metrics without recomputing them
+
+		:param previous: state of the charge already accounted for, if any
+		:param charge: current state of the charge
+		"""
+
+		today, monthCurrent, monthPrevious, monthToDatePrevious = self.transactions_windows()
+
+		for c, sign in ((previous, -1), (charge, 1)):
+			if (c is None or c.status != 'succeeded' or c.refunded or c.disputed):
+				continue
+
+			amount = sign * c.amount / 100
+
+			if (today[0] <= c.created <= today[1]):
+				self.VolumeGrossToday += amount
+				self.CountPaymentsToday += sign
+			if (monthCurrent[0] <= c.created <= monthCurrent[1]):
+				self.VolumeGrossMonthCurrent += amount
+			if (monthPrevious[0] <= c.created <= monthPrevious[1]):
+				self.VolumeGrossMonthPrevious += amount
+			if (monthToDatePrevious[0] <= c.created <= monthToDatePrevious[1]):
+				self.VolumeGrossMonthToDatePrevious += amount
+
+		self.set_forecast()
+
+	def apply_subscription(self, previous: RevenutSubscription | None, subscription: RevenutSubscription) -> None:
+		"""
+		Applies the change of a subscription to the pending and trialing forecasts without recomputing them
+
+		:param previous: state of the subscription already accounted for, if any
+		:param subscription: current state of the subscription
+		"""
+
+		epochEnd = self.DateMonthEndCurrent.timestamp()
+
+		for s, sign in ((previous, -1), (subscription, 1)):
+			if (s is None or s.current_period_end > epochEnd):
+				continue
+
+			if (s.status == 'active'):
+				self.VolumePending += sign * s.amount / 100
+			elif (s.status == 'trialing'):
+				self.VolumeTrialing += sign * s.amount / 100
+				self.CountTrialingMonthCurrent += sign
+
+		self.set_forecast()
+
+	def apply_customer(self, customer: RevenutCustomer) -> None:
+		"""
+		Applies a new customer to the customers metrics without recomputing them
+		"""
+
+		if (self.DateDayStartCurrent.timestamp() <= customer.created <= self.DateDayEndCurrent.timestamp()):
+			self.CountTrialingToday += 1
+
+	async def account(self, account_id) -> stripe.error.StripeError | stripe.Account:
 		account_retrieve = None
 
 		try:
 			# https://stripe.com/docs/api/accounts/retrieve
-			account_retrieve = stripe.Account.retrieve(account_id)
+			account_retrieve = await default_client().retrieve(f'/v1/accounts/{account_id}')
 		except Exception as e:
 			logging.error(e)
 			return e
 
 		return account_retrieve
 
-	def account_icon(self, account_id: str, fileId: str) -> None | stripe.FileLink:
+	async def account_profile(self, account_id: str) -> stripe.error.StripeError | RevenutAccount:
+		"""
+		Returns the profile of an account, only retrieving it from Stripe while it isn't stored
+		Stored profiles are retrieved again in the background once stale or once their icon link nears its expiry
+
+		:param account_id: stripe account identifier
+		"""
+
+		profile = default_store().account(account_id)
+
+		if (profile is None):
+			return await _profiles.do(account_id, lambda: self.account_refresh(account_id))
+
+		now = time.time()
+
+		if ((profile.updated < now - REVENUT_ACCOUNT_TTL or (profile.icon and profile.icon_expires < now + REVENUT_ACCOUNT_TTL)) and account_id not in _profiles):
+			task = asyncio.ensure_future(background(_profiles.do(account_id, lambda: self.account_refresh(account_id, profile))))
+			_tasks.add(task)
+			task.add_done_callback(_tasks.discard)
+
+		return profile
+
+	async def account_refresh(self, account_id: str, profile: RevenutAccount | None = None) -> stripe.error.StripeError | RevenutAccount:
+		"""
+		Retrieves and stores the profile of an account, issuing a file link for its icon unless the stored one is still valid long enough
+
+		:param account_id: stripe account identifier
+		:param profile: profile stored so far, if any
+		"""
+
+		store = default_store()
+		account = await self.account(account_id)
+
+		if (isinstance(account, stripe.error.StripeError)):
+			# the next dashboard reports the error of an account no longer authorized
+			if (not isinstance(account, STRIPE_TRANSIENT_ERRORS)):
+				await store.write(store.delete_account, account_id)
+
+			return account
+
+		now = time.time()
+		icon = account.settings.branding.icon
+		iconURL, iconExpires = None, 0
+
+		if (profile and profile.icon == icon and profile.icon_expires >= now + REVENUT_ACCOUNT_TTL):
+			iconURL, iconExpires = profile.icon_url, profile.icon_expires
+		elif (icon):
+			accountIconFileLink = await timed('file_link', self.account_icon(account_id, icon))
+
+			if (accountIconFileLink):
+				iconURL, iconExpires = accountIconFileLink.url, accountIconFileLink.get('expires_at') or self._icon_expire(REVENUT_ICON_EXPIRE // 60)
+
+		profile = RevenutAccount(account_id, account.business_profile.name, icon, iconURL, iconExpires, int(now))
+		await store.write(store.upsert_account, profile)
+
+		return profile
+
+	async def account_icon(self, account_id: str, fileId: str) -> None | stripe.FileLink:
 		accountIconFileLink = None
 
+		if (not fileId):
+			return accountIconFileLink
+
 		try:
 			# https://stripe.com/docs/file-upload#download-file-contents
 			# https://stripe.com/docs/api/file_links/create
-			accountIconFileLink = stripe.FileLink.create(stripe_account=account_id, file=fileId, expires_at=self._icon_expire())
+			accountIconFileLink = await default_client().create('/v1/file_links', account_id, file=fileId, expires_at=self._icon_expire(REVENUT_ICON_EXPIRE // 60))
 		except Exception as e:
 			logging.error(e)
 
 		return accountIconFileLink
 
-	def transactions(self, account_id: str, epochStart: int) -> list:
+	async def transactions(self, account_id: str, epochStart: int) -> RevenutChargeColumns:
 		"""
-		Returns a collection of auto-paginated charges from Stripe
+		Returns a collection of charges from the local store after syncing it incrementally with Stripe
 
 		:param account_id: stripe account identifier
 		:param epochStart: request records greater than or equal to Epoch timestamp
 		"""
-		charges_list = []
 
-		try:
-			# https://stripe.com/docs/api/charges/list
-			charges = stripe.Charge.list(stripe_account=account_id, limit=100, created={'gte': epochStart})
-		except Exception as e:
-			logging.error(e)
-		else:
-			for charge in charges.auto_paging_iter():
-				utcToLocaldatetime = time.localtime(charge.created)
-				charge.created = time.mktime(utcToLocaldatetime)
-				charges_list.append(charge)
+		store = default_store()
+		await self.transactions_update(store, account_id, epochStart)
+
+		return await asyncio.to_thread(store.charge_columns, account_id, epochStart)
+
+	async def transactions_update(self, store: RevenutStore, account_id: str, epochStart: int) -> None:
+		"""
+		Syncs the charges of the local store incrementally with Stripe
+		Only charges created since the last sync are paginated and charges whose state changed since then are refreshed from events
+		The cursors only move once a sync succeeds so a failed one is retried entirely by the next call
+
+		:param store: local record store
+		:param account_id: stripe account identifier
+		:param epochStart: request records greater than or equal to Epoch timestamp
+		"""
+
+		async with store.lock(account_id):
+			epochSynced = int(time.time())
+			syncedFrom = store.cursor(account_id, 'charges_from')
+			syncedTo = store.cursor(account_id, 'charges_to')
+
+			if (syncedFrom is None or syncedTo is None or epochStart < syncedFrom or syncedTo < epochSynced - STRIPE_EVENTS_RETENTION):
+				# cold account: paginate the whole timeframe
+				await self.transactions_sync(store, account_id, epochStart)
+				await store.write(store.set_cursor, account_id, 'charges_from', epochStart)
+			else:
+				await self.transactions_sync(store, account_id, syncedTo - STRIPE_SYNC_OVERLAP)
+				await self.transactions_events(store, account_id, syncedTo - STRIPE_SYNC_OVERLAP, syncedFrom)
+
+			await store.write(store.set_cursor, account_id, 'charges_to', epochSynced)
+
+	async def transactions_sync(self, store: RevenutStore, account_id: str, epochStart: int, epochEnd: int | None = None) -> None:
+		"""
+		Saves charges paginated from Stripe into the local store
+
+		:param store: local record store
+		:param account_id: stripe account identifier
+		:param epochStart: request records greater than or equal to Epoch timestamp
+		:param epochEnd: request records less than or equal to Epoch timestamp, now by default
+		"""
+
+		# https://stripe.com/docs/api/charges/list
+		# store writes run off the event loop as they may wait for another worker to release the SQLite write lock
+		async for charges_page in default_client().shards('/v1/charges', RevenutCharge.from_stripe, account_id, epochStart, epochEnd or int(time.time())):
+			await store.write(store.upsert_charges, account_id, charges_page)
+
+	async def transactions_events(self, store: RevenutStore, account_id: str, epochStart: int, epochFrom: int) -> None:
+		"""
+		Saves charges whose refund, dispute or payment state changed into the local store
+
+		:param store: local record store
+		:param account_id: stripe account identifier
+		:param epochStart: request events greater than or equal to Epoch timestamp
+		:param epochFrom: ignore charges created before the synced timeframe
+		"""
+
+		# https://stripe.com/docs/api/events/list
+		events = default_client().list('/v1/events', account_id, created={'gte': epochStart}, types=STRIPE_CHARGE_EVENTS)
+		charges_changed = {}
+		charges_disputed = []
+
+		# events are listed newest first so the first snapshot of a charge is its latest state
+		async for event in events:
+			record = event['data']['object']
+
+			if (event['type'] == 'charge.dispute.created'):
+				charges_disputed.append(record['charge'])
+			elif (record['id'] not in charges_changed and record['created'] >= epochFrom):
+				charges_changed[record['id']] = RevenutCharge.from_stripe(record)
+
+		await store.write(store.upsert_charges, account_id, list(charges_changed.values()))
+		await store.write(store.dispute_charges, account_id, charges_disputed)
+
+	async def backfill(self, account_id: str, epochStart: int, epochEnd: int | None = None) -> None:
+		"""
+		Syncs the charges, customers and subscriptions of an account created since a date into the local store
+		Used to load the history of newly connected accounts with time-sharded concurrent pagination
+
+		:param account_id: stripe account identifier
+		:param epochStart: request records created greater than or equal to Epoch timestamp
+		:param epochEnd: request records created less than or equal to Epoch timestamp, records up to now being synced incrementally by default
+		"""
+
+		store = default_store()
+
+		async def subscriptions() -> None:
+			# https://stripe.com/docs/api/subscriptions/list
+			async for subscriptions_page in default_client().shards('/v1/subscriptions', RevenutSubscription.from_stripe, account_id, epochStart, epochEnd or int(time.time()), status='all'):
+				await store.write(store.upsert_subscriptions, account_id, subscriptions_page)
+
+		# a bounded timeframe is paginated as is rather than through the incremental charges cursors
+		charges = self.transactions(account_id, epochStart) if (epochEnd is None) else self.transactions_sync(store, account_id, epochStart, epochEnd)
+
+		await asyncio.gather(charges, self.customers(account_id, epochStart, epochEnd), subscriptions())
+
+	@classmethod
+	async def history(cls, account_id: str, timezone: str, dateFrom: datetime.date, dateTo: datetime.date, granularity: RevenutGranularityType = RevenutGranularityType.DAY) -> RevenutHistory:
+		"""
+		Returns the history of an account answered from per-day rollups
+		Records are only paginated from Stripe for the part of the range never synced and the time elapsed since the last sync,
+		then only the local days holding changed records are recomputed
+
+		:param account_id: stripe account identifier
+		:param timezone: timezone identifier
+		:param dateFrom: first local day of the history
+		:param dateTo: last local day of the history
+		:param granularity: length of the periods of the history
+		"""
+
+		store = default_store()
+		await cls.history_sync(store, account_id, RevenutTimezone(timezone).day(dateFrom)[0])
+		await asyncio.to_thread(refresh_rollups, store, account_id, timezone)
+		rollups = await asyncio.to_thread(store.rollups, account_id, timezone, dateFrom.isoformat(), dateTo.isoformat())
+
+		return RevenutHistory.from_rollups(account_id, timezone, dateFrom, dateTo, granularity, rollups)
+
+	@classmethod
+	async def history_sync(cls, store: RevenutStore, account_id: str, epochFrom: int) -> None:
+		"""
+		Syncs the records of an account created since a date into the local store
+		Records are only paginated from Stripe for the part of the range never synced and the time elapsed since the last sync
+		Concurrent syncs of an account wait for each other so their ranges are only paginated once
+
+		:param store: local record store
+		:param account_id: stripe account identifier
+		:param epochFrom: request records created greater than or equal to Epoch timestamp
+		"""
+
+		async with store.lock(account_id, 'history'):
+			epochSynced = int(time.time())
+			syncedFrom = store.cursor(account_id, 'history_from')
+			syncedTo = store.cursor(account_id, 'history_to')
+
+			if (syncedFrom is None or syncedTo is None):
+				await cls().backfill(account_id, epochFrom)
+				await store.write(store.set_cursor, account_id, 'history_from', epochFrom)
+			else:
+				if (epochFrom < syncedFrom):
+					# only the older part of the range never synced is paginated
+					await cls().backfill(account_id, epochFrom, syncedFrom)
+					await store.write(store.set_cursor, account_id, 'history_from', epochFrom)
+
+				await cls().backfill(account_id, syncedTo - STRIPE_SYNC_OVERLAP)
+
+			await store.write(store.set_cursor, account_id, 'history_to', epochSynced)
+
+	@classmethod
+	async def analytics(cls, account_id: str, timezone: str, months: int) -> list[RevenutAnalyticsMonth]:
+		"""
+		Returns the monthly subscription analytics of an account computed from the local store
+		Charges are synced for the range like histories while every subscription of the account is synced once then kept current from events,
+		then only the months affected by changed records are recomputed
+
+		:param account_id: stripe account identifier
+		:param timezone: timezone identifier
+		:param months: number of months up to the current one, preceded by the month they start from
+		"""
+
+		store = default_store()
+		dateFrom = RevenutTimezone(timezone).month_start(-months)
 
-		return charges_list
+		await asyncio.gather(cls.history_sync(store, account_id, RevenutTimezone(timezone).day(dateFrom)[0]), cls().subscriptions_backfill(store, account_id))
 
-	def transactions_date(self, charges_list: list, epochStart: float, epochEnd: float) -> dict:
+		return await asyncio.to_thread(refresh_analytics, store, account_id, timezone, dateFrom)
+
+	def transactions_date(self, charges_columns: RevenutChargeColumns, epochStart: float, epochEnd: float) -> dict:
 		"""
-		Returns a collection of successful transactions within a timeframe
+		Returns the amount and count of successful transactions within a timeframe
 
-		:param charges_list: collection of charges to search on
+		:param charges_columns: columns of charges to search on
 		:param epochStart: identify records created greater than or equal to Epoch timestamp
 		:param epochEnd: identify records created less than or equal to Epoch timestamp
 		"""
 
-		transactions_dict = dict(
-			amount = 0
-			, count = 0
-		)
-		
-		charges_date = list(filter(lambda x: 
-									x.created >= epochStart
-									and x.created <= epochEnd
-									and x.refunded is False 
-									and x.status == 'succeeded' 
-									and x.disputed is False                                
-									, charges_list))
-		
-		charges_date_amount = sum((charge.amount / 100) for charge in charges_date)
-		charges_date_count = len(charges_date)
+		return charges_columns.windows([(epochStart, epochEnd)])[0]
+
+	async def subscriptions(self, account_id: str, epochEnd: int) -> RevenutSubscriptionColumns:
+		"""
+		Returns the active and trialing subscriptions renewing by a date from the local store after syncing it incrementally with Stripe
 
-		transactions_dict['amount'] = charges_date_amount
-		transactions_dict['count'] = charges_date_count
+		:param account_id: stripe account identifier
+		:param epochEnd: identify records whose current period ends less than or equal to Epoch timestamp
+		"""
 
-		return transactions_dict
+		store = default_store()
+		await self.subscriptions_update(store, account_id)
 
-	def subscriptions(self, account_id: str, epochEnd: int, status: str | None = None) -> list:
+		return await asyncio.to_thread(store.subscription_columns, account_id, STRIPE_SUBSCRIPTION_STATUSES, epochEnd)
+
+	async def subscriptions_update(self, store: RevenutStore, account_id: str) -> None:
 		"""
-		Returns a collection of auto-paginated subscriptions from Stripe
+		Syncs the active and trialing subscriptions of the local store incrementally with Stripe
+		Cold accounts list every subscription in those statuses, then only subscriptions changed since the last sync are refreshed from events
+		The cursor only moves once a sync succeeds so a failed one is retried entirely by the next call
 
+		:param store: local record store
 		:param account_id: stripe account identifier
-		:param epochStart: request records less than or equal to current period end Epoch timestamp
-		:param status: status of the subscriptions to retrieve
 		"""
-		
-		subscriptions_list = []
-		
-		try:
-			# https://stripe.com/docs/api/subscriptions/list
-			if status:
-				subscriptions = stripe.Subscription.list(stripe_account=account_id, limit=100, current_period_end={'lte': epochEnd}, status=status)
+
+		async with store.lock(account_id, 'subscriptions'):
+			epochSynced = int(time.time())
+			syncedTo = store.cursor(account_id, 'subscriptions_to')
+
+			if (syncedTo is None or syncedTo < epochSynced - STRIPE_EVENTS_RETENTION):
+				await self.subscriptions_sync(store, account_id)
 			else:
-				subscriptions = stripe.Subscription.list(stripe_account=account_id, limit=100, current_period_end={'lte': epochEnd})
-		except Exception as e:
-			logging.error(e)
-		else:
-			for s in subscriptions.auto_paging_iter():
-				# convert to local timezone
-				utcToLocaldatetime1 = time.localtime(s.current_period_end)
-				utcToLocaldatetime2 = time.localtime(s.current_period_start)
-				s.current_period_end = time.mktime(utcToLocaldatetime1)
-				s.current_period_start = time.mktime(utcToLocaldatetime2)
-				subscriptions_list.append(s)
+				await self.subscriptions_events(store, account_id, syncedTo - STRIPE_SYNC_OVERLAP)
 
-		return subscriptions_list
+			await store.write(store.set_cursor, account_id, 'subscriptions_to', epochSynced)
 
-	def subscriptions_trialing(self, subscriptions_list: list, epochEnd: int, epochStart:int | None = None) -> dict:
+	async def subscriptions_backfill(self, store: RevenutStore, account_id: str) -> None:
 		"""
-		Returns the dollar amount and count of subscriptions that are still in trial phase for current month
+		Syncs every subscription of an account into the local store whatever its status once, then only the subscriptions changed since the last sync
+
+		:param store: local record store
+		:param account_id: stripe account identifier
 		"""
 
-		subscriptions_trialing = []
-		subscriptions_dict = dict(
-			amount = 0
-			, count = 0
-		)
+		async with store.lock(account_id, 'subscriptions'):
+			if (store.cursor(account_id, 'subscriptions_from') is None):
+				epochSynced = int(time.time())
+
+				# https://stripe.com/docs/api/subscriptions/list
+				async for subscriptions_page in default_client().shards('/v1/subscriptions', RevenutSubscription.from_stripe, account_id, STRIPE_EPOCH, epochSynced, status='all'):
+					await store.write(store.upsert_subscriptions, account_id, subscriptions_page)
+
+				await store.write(store.set_cursor, account_id, 'subscriptions_from', STRIPE_EPOCH)
+
+				# the active and trialing subscriptions were listed as well
+				if (store.cursor(account_id, 'subscriptions_to') is None):
+					await store.write(store.set_cursor, account_id, 'subscriptions_to', epochSynced)
+
+		await self.subscriptions_update(store, account_id)
+
+	async def subscriptions_sync(self, store: RevenutStore, account_id: str) -> None:
+		"""
+		Saves every active and trialing subscription into the local store, listing each status in parallel time shards
+		Stored subscriptions no longer listed left those statuses unnoticed and are retrieved again
+
+		:param store: local record store
+		:param account_id: stripe account identifier
+		"""
+
+		listed = set()
+
+		async def subscriptions(status: str) -> None:
+			# https://stripe.com/docs/api/subscriptions/list
+			async for subscriptions_page in default_client().shards('/v1/subscriptions', RevenutSubscription.from_stripe, account_id, STRIPE_EPOCH, int(time.time()), status=status):
+				await store.write(store.upsert_subscriptions, account_id, subscriptions_page)
+				listed.update(s.id for s in subscriptions_page)
+
+		async def subscription(subscription_id: str) -> RevenutSubscription:
+			# https://stripe.com/docs/api/subscriptions/retrieve
+			return RevenutSubscription.from_stripe(await default_client().retrieve(f'/v1/subscriptions/{subscription_id}', account_id))
+
+		indexed = store.subscription_ids(account_id, STRIPE_SUBSCRIPTION_STATUSES)
+		await asyncio.gather(*[subscriptions(status) for status in STRIPE_SUBSCRIPTION_STATUSES])
+		await store.write(store.upsert_subscriptions, account_id, await asyncio.gather(*[subscription(subscription_id) for subscription_id in indexed - listed]))
+
+	async def subscriptions_events(self, store: RevenutStore, account_id: str, epochStart: int) -> None:
+		"""
+		Saves subscriptions created or changed since a date into the local store
+
+		:param store: local record store
+		:param account_id: stripe account identifier
+		:param epochStart: request events greater than or equal to Epoch timestamp
+		"""
+
+		# https://stripe.com/docs/api/events/list
+		events = default_client().list('/v1/events', account_id, created={'gte': epochStart}, types=STRIPE_SUBSCRIPTION_EVENTS)
+		subscriptions_changed = {}
+
+		# events are listed newest first so the first snapshot of a subscription is its latest state
+		async for event in events:
+			record = event['data']['object']
+
+			if (record['id'] not in subscriptions_changed):
+				subscriptions_changed[record['id']] = RevenutSubscription.from_stripe(record)
+
+		await store.write(store.upsert_subscriptions, account_id, list(subscriptions_changed.values()))
+
+	def subscriptions_trialing(self, subscriptions_columns: RevenutSubscriptionColumns, epochEnd: int, epochStart:int | None = None) -> dict:
+		"""
+		Returns the dollar amount and count of subscriptions that are still in trial phase for current month
+		"""
 
 		if (epochStart):
-			subscriptions_trialing = list(filter(lambda x: (x.status == 'trialing' or x.status == 'canceled') and x.created >= epochStart and x.created <= epochEnd, subscriptions_list))
+			subscriptions_trialing = subscriptions_columns.where('trialing', 'canceled') & (subscriptions_columns.created >= epochStart) & (subscriptions_columns.created <= epochEnd)
 		else:
-			subscriptions_trialing = list(filter(lambda x: x.status == 'trialing' and x.current_period_end <= epochEnd, subscriptions_list))
-		
-		subscriptions_trialing_amount = sum((subscription.plan.amount / 100) for subscription in subscriptions_trialing)
-		subscriptions_trialing_count = len(subscriptions_trialing)
-
-		subscriptions_dict['amount'] = subscriptions_trialing_amount
-		subscriptions_dict['count'] = subscriptions_trialing_count
+			subscriptions_trialing = subscriptions_columns.where('trialing') & (subscriptions_columns.current_period_end <= epochEnd)
 
-		return subscriptions_dict
+		return subscriptions_columns.total(subscriptions_trialing)
 
-	def subscriptions_upcoming(self, subscriptions_list: list, epochEnd: float) -> float:
+	def subscriptions_upcoming(self, subscriptions_columns: RevenutSubscriptionColumns, epochEnd: float) -> float:
 		"""
 		Returns the dollar amount of active subscriptions that haven't been invoiced yet by current month end
 		"""
 
-		subscriptions_upcoming = list(filter(lambda x: 
-			x.current_period_end <= epochEnd		# subscriptions that will be invoiced before end of month
-			and x.status == 'active'				# payment should have been successful before
-		, subscriptions_list))
-
-		subscriptions_upcoming_amount = sum((subscription.plan.amount / 100) for subscription in subscriptions_upcoming)
-		#subscriptions_upcoming_count = len(subscriptions_upcoming)
+		subscriptions_upcoming = (
+			(subscriptions_columns.current_period_end <= epochEnd)		# subscriptions that will be invoiced before end of month
+			& subscriptions_columns.where('active')						# payment should have been successful before
+		)
 
-		return subscriptions_upcoming_amount
+		return subscriptions_columns.total(subscriptions_upcoming)['amount']
 
-	def customers(self, account_id: str, epochStart: int) -> list:
+	async def customers(self, account_id: str, epochStart: int, epochEnd: int | None = None) -> RevenutCustomerColumns:
 		"""
-		Returns an auto-paginated list of customers from Stripe
+		Returns the columns of auto-paginated customers from Stripe, saving each page into the local store
 
 		:param account_id: stripe account identifier
 		:param epochStart: request records created greater than or equal to Epoch timestamp
+		:param epochEnd: request records created less than or equal to Epoch timestamp, now by default
 		"""
 		
-		customers_list = []
+		store = default_store()
+		customers_columns = RevenutCustomerColumns.builder()
 
-		try:
-			# https://stripe.com/docs/api/customers/list
-			customers = stripe.Customer.list(stripe_account=account_id, limit=100, created={'gte': epochStart})
-		except Exception as e:
-			logging.error(e)
-		else:
-			for c in customers.auto_paging_iter():
-				utcToLocaldatetime = time.localtime(c.created)
-				c.created = time.mktime(utcToLocaldatetime)
-				customers_list.append(c)
+		# https://stripe.com/docs/api/customers/list
+		async for customers_page in default_client().shards('/v1/customers', RevenutCustomer.from_stripe, account_id, epochStart, epochEnd or int(time.time())):
+			await store.write(store.upsert_customers, account_id, customers_page)
+			customers_columns.extend(c.created for c in customers_page)
 
-		return customers_list
+		return RevenutCustomerColumns(customers_columns.array())
 	
-	def customers_date(self, customers_list: list, epochStart: float, epochEnd: float) -> int:
+	def customers_date(self, customers_columns: RevenutCustomerColumns, epochStart: float, epochEnd: float) -> int:
 		"""
 		Returns the number of customers created in the requested timespan
 		:param epochStart: records created greater than or equal to timestamp
 		:param epochEnd: records created less than or equal to timestamp
 		"""
-		
-		customers_count = 0
-
-		customers_date = list(filter(lambda x:
-			x.created >= epochStart
-			and x.created <= epochEnd
-		, customers_list))
-
-		customers_count = len(customers_date)
 
-		return customers_count
+		return customers_columns.count(epochStart, epochEnd)
 
-	def token(self, auth_code: str) -> stripe.error.StripeError | dict:
+	async def token(self, auth_code: str) -> stripe.error.StripeError | dict:
 		"""
 		Used both for turning an authorization_code into an account connection, and for getting a new access token using a refresh_token
 		https://stripe.com/docs/connect/oauth-reference#post-token
@@ -358,7 +1004,7 @@ class RevenutStripe(BaseModel):
 		response = None
 
 		try:
-			response = stripe.OAuth.token(grant_type='authorization_code', code=auth_code)
+			response = await default_client().oauth('/oauth/token', grant_type='authorization_code', code=auth_code)
 		except Exception as e:
 			logging.error(e)
 			return e
@@ -376,7 +1022,7 @@ class RevenutStripe(BaseModel):
 
 		return account_id
 
-	def revoke(self, account_id: str) -> str | None:
+	async def revoke(self, account_id: str) -> str | None:
 		"""
 		Used for revoking access to an account
 		"""
@@ -386,7 +1032,7 @@ class RevenutStripe(BaseModel):
 
 		try:
 			# https://stripe.com/docs/connect/oauth-reference#post-deauthorize
-			response = stripe.OAuth.deauthorize(client_id=client_id, stripe_user_id=account_id)
+			response = (await default_client().oauth('/oauth/deauthorize', client_id=client_id, stripe_user_id=account_id))['stripe_user_id']
 		except Exception as e:
 			response = e.code
 		
@@ -409,6 +1055,38 @@ class RevenutStripe(BaseModel):
 		except ZeroDivisionError:
 			return float('inf')
 
+def _finished(task: asyncio.Task) -> None:
+	_tasks.discard(task)
+
+	# failures of dashboards past their deadline have no caller left to receive them
+	if (not task.cancelled() and task.exception()):
+		logging.error(task.exception())
+
+def _running_loop() -> bool:
+	"""
+	Returns whether the caller runs inside an event loop
+	"""
+
+	try:
+		asyncio.get_running_loop()
+	except RuntimeError:
+		return False
+
+	return True
+
+def _run(coroutine) -> None:
+	"""
+	Runs a coroutine in a new event loop and closes the loop's client once done
+	"""
+
+	async def run():
+		try:
+			await coroutine
+		finally:
+			await close_client()
+
+	asyncio.run(run())
+
 def main() -> None:
 	"""
 	Run RevenutStripe independent of API
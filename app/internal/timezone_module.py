@@ -0,0 +1,99 @@
+from typing import NamedTuple
+from zoneinfo import ZoneInfo
+
+import calendar
+import datetime
+import dateutil.relativedelta
+import functools
+
+class RevenutWindows(NamedTuple):
+	"""
+	Local day and month boundaries the metrics of a dashboard are computed over
+	"""
+
+	day_start: datetime.datetime
+	day_end: datetime.datetime
+	month_start: datetime.datetime
+	month_end: datetime.datetime
+	month_start_previous: datetime.datetime
+	month_end_previous: datetime.datetime
+	month_to_date_previous: datetime.datetime
+
+class RevenutTimezone:
+	"""
+	Local calendar of a timezone whose day and month boundaries are converted to UTC once per request
+	Records keep their UTC `created` values and are bucketed against these boundaries, so stored records are shared across timezones
+	"""
+
+	__slots__ = ('zone', 'now', 'today')
+
+	def __init__(self, timezone: str, now: datetime.datetime | None = None):
+		"""
+		:param timezone: timezone identifier
+		:param now: current instant, naive values being server local time
+		"""
+
+		self.zone = ZoneInfo(timezone)
+		self.now = (now or datetime.datetime.now(datetime.timezone.utc)).astimezone(self.zone)
+		self.today = self.now.date()
+
+	def start(self, day: datetime.date) -> datetime.datetime:
+		"""
+		Returns the first instant of a local day, in UTC terms 23 or 25 hours before the next one around DST changes
+		"""
+		return datetime.datetime.combine(day, datetime.time(), tzinfo=self.zone)
+
+	def end(self, day: datetime.date) -> datetime.datetime:
+		"""
+		Returns the last instant of a local day
+		"""
+		return datetime.datetime.fromtimestamp(self.start(day + datetime.timedelta(days=1)).timestamp() - 1e-6, self.zone)
+
+	def month_start(self, months: int = 0) -> datetime.date:
+		"""
+		Returns the first day of the month `months` away from the current one
+		"""
+		return self.today.replace(day=1) + dateutil.relativedelta.relativedelta(months=months)
+
+	def month_end(self, months: int = 0) -> datetime.date:
+		"""
+		Returns the last day of the month `months` away from the current one
+		"""
+
+		start = self.month_start(months)
+
+		return start.replace(day=calendar.monthrange(start.year, start.month)[1])
+
+	def day(self, day: datetime.date) -> tuple[int, int]:
+		"""
+		Returns the Epoch timestamps a local day starts at and the next one starts at
+		"""
+		return int(self.start(day).timestamp()), int(self.start(day + datetime.timedelta(days=1)).timestamp())
+
+	def windows(self) -> RevenutWindows:
+		"""
+		Returns the boundaries of the dashboard windows of the current local day, computed once per timezone and day
+		"""
+		return _windows(self.zone.key, self.today)
+
+@functools.lru_cache(maxsize=1024)
+def _windows(timezone: str, today: datetime.date) -> RevenutWindows:
+	local = RevenutTimezone(timezone, datetime.datetime.combine(today, datetime.time(12), tzinfo=ZoneInfo(timezone)))
+
+	return RevenutWindows(
+		local.start(today)
+		, local.end(today)
+		, local.start(local.month_start())
+		, local.end(local.month_end())
+		, local.start(local.month_start(-1))
+		, local.end(local.month_end(-1))
+		, local.end(today - dateutil.relativedelta.relativedelta(months=1))
+	)
+
+def main() -> None:
+	timezone = RevenutTimezone('America/Los_Angeles', datetime.datetime(2023, 3, 12, 12, tzinfo=datetime.timezone.utc))
+	print(timezone.start(timezone.today), timezone.end(timezone.today))
+	print(timezone.day(timezone.today))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,113 @@
+import os
+import logging
+
+import stripe
+
+from cache_module import RevenutCache, default_cache
+from store_module import RevenutCharge, RevenutCustomer, RevenutSubscription, RevenutStore, default_store
+
+# events of connected accounts consumed by the webhook endpoint
+# https://stripe.com/docs/api/events/types
+WEBHOOK_EVENTS = ['charge.succeeded', 'charge.failed', 'charge.captured', 'charge.updated', 'charge.refunded', 'charge.dispute.created', 'customer.created', 'customer.subscription.created', 'customer.subscription.updated', 'customer.subscription.deleted', 'customer.subscription.paused', 'customer.subscription.resumed', 'customer.subscription.trial_will_end']
+
+class RevenutWebhook:
+	"""
+	Applies Stripe webhook events of connected accounts as deltas to the local store and to the cached dashboards
+	Cached dashboards kept current by webhooks are only recomputed from Stripe lists once their reconciliation TTL expires
+	"""
+
+	def __init__(self, store: RevenutStore | None = None, cache: RevenutCache | None = None, secret: str | None = None, reconcile: float | None = None):
+		self.store = store or default_store()
+		self.cache = cache or default_cache()
+		self.secret = secret or os.getenv('STRIPE_WEBHOOK_SECRET')
+		self.reconcile = reconcile or float(os.getenv('REVENUT_RECONCILE_TTL', 60 * 60))
+
+	def construct(self, payload: bytes, signature: str | None) -> stripe.Event:
+		"""
+		Returns the event of a webhook request after verifying its signature
+		https://stripe.com/docs/webhooks#verify-events
+
+		:param payload: raw body of the request
+		:param signature: `Stripe-Signature` header of the request
+		"""
+		return stripe.Webhook.construct_event(payload, signature or '', self.secret)
+
+	async def apply(self, event: stripe.Event) -> bool:
+		"""
+		Applies an event to the local store and to the cached dashboards of its account
+		Writes are queued with the other writes of the store so none lands after the records of a logged out account are deleted
+		Returns whether the event was applied
+
+		:param event: verified Stripe event
+		"""
+
+		account_id = event.get('account')
+		record = event.data.object
+
+		if (not account_id or event.type not in WEBHOOK_EVENTS):
+			return False
+
+		# accounts logged out or not loaded yet have no profile, their next dashboard syncs them from Stripe instead
+		if (self.store.account(account_id) is None):
+			return False
+
+		if (event.type == 'charge.dispute.created'):
+			previous = self.store.charge(account_id, record.charge)
+
+			if (previous is None):
+				return False
+
+			await self.store.write(self.store.dispute_charges, account_id, [previous.id])
+			self._apply(account_id, lambda rStripe: rStripe.apply_charge(previous, previous._replace(disputed=True)))
+		elif (event.type.startswith('charge.')):
+			charge = RevenutCharge.from_stripe(record)
+			previous = self.store.charge(account_id, charge.id)
+
+			# refunds and disputes are sticky like in the store
+			if (previous):
+				charge = charge._replace(refunded=charge.refunded or previous.refunded, disputed=charge.disputed or previous.disputed)
+
+			await self.store.write(self.store.upsert_charges, account_id, [charge])
+			self._apply(account_id, lambda rStripe: rStripe.apply_charge(previous, charge))
+		elif (event.type == 'customer.created'):
+			customer = RevenutCustomer.from_stripe(record)
+
+			# redelivered events must not be counted twice
+			if (self.store.customer(account_id, customer.id)):
+				return False
+
+			await self.store.write(self.store.upsert_customers, account_id, [customer])
+			self._apply(account_id, lambda rStripe: rStripe.apply_customer(customer))
+		else:
+			subscription = RevenutSubscription.from_stripe(record)
+			previous = self.store.subscription(account_id, subscription.id)
+
+			if (previous is None and event.data.get('previous_attributes')):
+				previous = RevenutSubscription.from_stripe({**record, **event.data.previous_attributes})
+
+			await self.store.write(self.store.upsert_subscriptions, account_id, [subscription])
+			self._apply(account_id, lambda rStripe: rStripe.apply_subscription(previous, subscription))
+
+		return True
+
+	def _apply(self, account_id: str, delta) -> None:
+		"""
+		Applies a delta to every cached dashboard of an account and re-serializes them
+		Dashboards of the account cached only by other workers are discarded so they are recomputed rather than miss the delta
+		"""
+
+		keys = [key for key in self.cache.keys() if key[0] == account_id]
+
+		self.cache.discard((account_id,), keep=keys)
+
+		for key in keys:
+			entry = self.cache.get(key)
+
+			try:
+				delta(entry.value)
+			except Exception as e:
+				# the next reconciliation recomputes the dashboard from Stripe
+				logging.error(e)
+				self.cache.pop(key)
+			else:
+				self.cache.set(key, entry.value.cache_entry(ttl=self.reconcile))
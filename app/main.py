@@ -1,13 +1,56 @@
 import asyncio
+import contextlib
 
 from hypercorn.config import Config
 from hypercorn.asyncio import serve
 
-from fastapi import FastAPI, Response, status, HTTPException
+from fastapi import FastAPI, Header, Query, Request, Response, status, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 
-from internal.stripe_module import RevenutStripe
-from internal.enums import RevenutAuthorizationType
+from internal.stripe_module import RevenutStripe, REVENUT_DASHBOARD_DEADLINE, STRIPE_TRANSIENT_ERRORS
+from internal.history_module import RevenutHistory
+from internal.analytics_module import RevenutAnalyticsMRR, RevenutAnalyticsChurn, RevenutAnalyticsCohorts
+from internal.enums import RevenutAuthorizationType, RevenutGranularityType
+
+# internal modules import each other by module name so shared state must be imported the same way
+from client_module import close_client
+from webhook_module import RevenutWebhook
+from live_module import default_live
+from prefetch_module import default_prefetch
+from metrics_module import RevenutTimer, default_metrics, server_timing, start_timings
+
+import datetime
+import zoneinfo
+
+import stripe
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Keeps the dashboards of active accounts warm while the worker runs and closes the pooled Stripe connections when it shuts down
+    The worker reports ready once its store and Stripe connections are open
+    """
+
+    async def refresh(account: str, tzIdentifier: str) -> bool:
+        dashboard = await RevenutStripe.dashboard(account, tzIdentifier, refresh=True)
+        return bool(dashboard.value.AccountName)
+
+    async def warm():
+        # the worker keeps trying to reach Stripe and only takes traffic once its connections are open
+        app.state.ready = await RevenutStripe.warm()
+
+    app.state.ready = False
+    warming = asyncio.ensure_future(warm())
+    prefetch = default_prefetch().start(refresh)
+    yield
+
+    warming.cancel()
+
+    if (prefetch):
+        prefetch.cancel()
+
+    await close_client()
 
 app = FastAPI(
     title="Revenut API",
@@ -20,9 +63,19 @@ app = FastAPI(
     license_info={
         "name": "Apache 2.0",
         "url": "https://github.com/hbcondo/revenut-api/blob/e24853c36326820a99c21f21c40306a20ca14923/LICENSE"
-    }
+    },
+    lifespan=lifespan
 )
 
+# accounts a batch request may ask for at once
+BATCH_ACCOUNTS_MAX = 100
+# months of analytics a request may ask for
+ANALYTICS_MONTHS_MAX = 24
+# days of history a request may ask for
+HISTORY_DAYS_MAX = 3 * 366
+# no Stripe object was created before 2011
+HISTORY_DATE_MIN = datetime.date(2011, 1, 1)
+
 origins = [
     "https://app.revenut.com"
 ]
@@ -32,11 +85,25 @@ app.add_middleware(
     allow_origins=origins
 )
 
+@app.exception_handler(stripe.error.StripeError)
+async def stripe_error_handler(request: Request, exc: stripe.error.StripeError) -> JSONResponse:
+    """
+    Reports Stripe failures the scheduler could not retry away instead of answering with incomplete metrics
+    """
+
+    if (isinstance(exc, STRIPE_TRANSIENT_ERRORS)):
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"detail": exc.user_message}, headers={"Retry-After": "5"})
+
+    return JSONResponse(status_code=status.HTTP_502_BAD_GATEWAY, content={"detail": exc.user_message})
+
 """
 If you are using a third party library that communicates with something 
 (a database, an API, the file system, etc.) and doesn't have support for using await, 
 then declare your path operation functions as normally, with just def
 
+Stripe is called through the pooled async client in ```internal.client_module``` 
+so the endpoints talking to Stripe are declared with async def
+
 Source: https://fastapi.tiangolo.com/async/
 """
 
@@ -54,48 +121,245 @@ def read_health() -> bool:
     """
     return True
 
+@app.get("/ready", status_code=status.HTTP_200_OK, summary="Readiness check")
+def read_ready(response: Response) -> bool:
+    """
+    API readiness check request, failing until the worker opened its store and pooled Stripe connections
+    """
+
+    if (not getattr(app.state, "ready", False)):
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        return False
+
+    return True
+
+@app.get("/metrics", response_class=PlainTextResponse, status_code=status.HTTP_200_OK, summary="Prometheus metrics")
+def read_metrics() -> PlainTextResponse:
+    """
+    Returns stage timings, Stripe request, retry, page and record counters and cache lookups in the Prometheus text format
+    """
+    return PlainTextResponse(default_metrics().render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/v1/dashboard", response_model=RevenutStripe, status_code=status.HTTP_401_UNAUTHORIZED, summary="SaaS metrics")
-def read_account(
+async def read_account(
     response: Response
     , tzIdentifier: str
     , code: str | None = None
     , account: str | None = None
+    , if_none_match: str | None = Header(default=None)
 ) -> RevenutStripe:
     """
     Returns SaaS metrics as a populated ```RevenutStripe``` object
     - **tzIdentifier**: Timezone identifier https://en.wikipedia.org/wiki/List_of_tz_database_time_zones
     - **code**: Authorization code returned by OAuth provider
     - **account**: Account identifier returned by OAuth provider
+
+    Responses carry an ```ETag``` so polling clients sending ```If-None-Match``` get ```304 Not Modified``` until metrics change
+    and a ```Server-Timing``` breakdown of the fetch and aggregation stages
+
+    Dashboards taking longer than ```REVENUT_DASHBOARD_DEADLINE``` return the sections computed so far and the others from the last known dashboard,
+    flagged ```IsStale``` in ```Sections```, while the computation completes in the background
     """
 
     rStripe = RevenutStripe()
+    dashboard = None
+    timings = start_timings()
 
-    if (code):
-        rStripe = RevenutStripe(AuthorizationCode=code)
-        
-        if (rStripe.IsAuthorized):
-            rStripe = RevenutStripe(AccountID=rStripe.AccountID, TimezonePreference=tzIdentifier)
+    with RevenutTimer("total"):
+        if (code):
+            rStripe = await RevenutStripe.connect(code)
 
-    if (account):
-        rStripe = RevenutStripe(AccountID=account, TimezonePreference=tzIdentifier)
+            if (rStripe.IsAuthorized):
+                dashboard = await RevenutStripe.dashboard(rStripe.AccountID, tzIdentifier, deadline=REVENUT_DASHBOARD_DEADLINE)
 
-    if (rStripe.AccountName):
-        response.status_code = status.HTTP_200_OK
+        if (account):
+            dashboard = await RevenutStripe.dashboard(account, tzIdentifier, deadline=REVENUT_DASHBOARD_DEADLINE)
+
+    response.headers["Server-Timing"] = server_timing(timings)
+
+    if (dashboard):
+        headers = {"ETag": dashboard.etag, "Cache-Control": "private, no-cache", "Server-Timing": response.headers["Server-Timing"]}
+
+        if (not dashboard.value.AccountName):
+            return Response(content=dashboard.content, media_type="application/json", status_code=status.HTTP_401_UNAUTHORIZED, headers={"Server-Timing": response.headers["Server-Timing"]})
+
+        # only authorized accounts are kept warm so arbitrary identifiers cost a single dashboard
+        default_prefetch().touch(dashboard.value.AccountID, tzIdentifier)
+
+        if (dashboard.matches(if_none_match)):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        return Response(content=dashboard.content, media_type="application/json", status_code=status.HTTP_200_OK, headers=headers)
 
     return rStripe
 
+@app.get("/v1/dashboard/stream", response_class=StreamingResponse, status_code=status.HTTP_200_OK, summary="Live SaaS metrics")
+async def read_account_stream(
+    tzIdentifier: str
+    , account: str
+) -> StreamingResponse:
+    """
+    Streams SaaS metrics as Server-Sent Events: a ```snapshot``` event with the ```RevenutStripe``` object followed by ```patch``` events with only its changed fields
+    - **tzIdentifier**: Timezone identifier https://en.wikipedia.org/wiki/List_of_tz_database_time_zones
+    - **account**: Account identifier returned by OAuth provider
+
+    Changes come from webhook deltas and from one periodic incremental refresh per account shared by every session, replacing independent polling
+    """
+
+    dashboard = await RevenutStripe.dashboard(account, tzIdentifier)
+
+    if (not dashboard.value.AccountName):
+        return Response(content=dashboard.content, media_type="application/json", status_code=status.HTTP_401_UNAUTHORIZED)
+
+    default_prefetch().touch(account, tzIdentifier)
+
+    async def refresh():
+        return await RevenutStripe.dashboard(account, tzIdentifier, refresh=True)
+
+    return StreamingResponse(
+        default_live().stream((account, tzIdentifier), dashboard, refresh)
+        , media_type="text/event-stream"
+        , headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/v1/dashboards", response_class=StreamingResponse, status_code=status.HTTP_200_OK, summary="SaaS metrics of many accounts")
+async def read_accounts(
+    tzIdentifier: str
+    , account: list[str] = Query()
+) -> StreamingResponse:
+    """
+    Streams the SaaS metrics of many accounts as newline delimited JSON ```RevenutStripe``` objects in the order they complete
+    - **tzIdentifier**: Timezone identifier https://en.wikipedia.org/wiki/List_of_tz_database_time_zones
+    - **account**: Account identifiers returned by OAuth provider, repeated once per account
+
+    Accounts failing to load are streamed with an ```ERROR``` status instead of failing the whole batch
+    """
+
+    if (len(account) > BATCH_ACCOUNTS_MAX):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"At most {BATCH_ACCOUNTS_MAX} accounts per request")
+
+    async def stream():
+        async for account_id, dashboard in RevenutStripe.dashboards(account, tzIdentifier):
+            if (isinstance(dashboard, Exception)):
+                rStripe = RevenutStripe(AccountID=account_id, Status=RevenutAuthorizationType.ERROR, Code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+                if (isinstance(dashboard, stripe.error.StripeError)):
+                    rStripe.Error = dashboard.user_message
+                    rStripe.Code = dashboard.http_status or status.HTTP_503_SERVICE_UNAVAILABLE
+
+                yield rStripe.model_dump_json().encode() + b"\n"
+            else:
+                if (dashboard.value.AccountName):
+                    default_prefetch().touch(account_id, tzIdentifier)
+
+                yield dashboard.content + b"\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson", headers={"Cache-Control": "private, no-cache"})
+
+@app.get("/v1/dashboard/history", response_model=RevenutHistory, status_code=status.HTTP_200_OK, summary="SaaS metrics history")
+async def read_history(
+    account: str
+    , tzIdentifier: str
+    , dateFrom: datetime.date = Query(alias="from")
+    , dateTo: datetime.date = Query(alias="to")
+    , granularity: RevenutGranularityType = RevenutGranularityType.DAY
+) -> RevenutHistory:
+    """
+    Returns the gross volume, refunds, payments, new customers and new trials of an account per day, week or month
+    - **account**: Account identifier returned by OAuth provider
+    - **tzIdentifier**: Timezone identifier https://en.wikipedia.org/wiki/List_of_tz_database_time_zones
+    - **from**: First day of the history formatted as YYYY-MM-DD
+    - **to**: Last day of the history formatted as YYYY-MM-DD
+    - **granularity**: Length of the periods: day, week or month
+
+    Histories are answered from per-day rollups so a year of trend costs as much as 365 stored days, up to ```HISTORY_DAYS_MAX``` days per request
+    """
+
+    if (dateFrom > dateTo):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="from must not be after to")
+    elif ((dateTo - dateFrom).days >= HISTORY_DAYS_MAX):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"At most {HISTORY_DAYS_MAX} days per request")
+    elif (dateFrom < HISTORY_DATE_MIN):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"from must not be before {HISTORY_DATE_MIN.isoformat()}")
+
+    try:
+        zoneinfo.ZoneInfo(tzIdentifier)
+    except (ValueError, zoneinfo.ZoneInfoNotFoundError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unknown tzIdentifier")
+
+    return await RevenutStripe.history(account, tzIdentifier, dateFrom, dateTo, granularity)
+
+@app.get("/v1/analytics/mrr", response_model=RevenutAnalyticsMRR, status_code=status.HTTP_200_OK, summary="MRR over time")
+async def read_analytics_mrr(
+    account: str
+    , tzIdentifier: str
+    , months: int = Query(default=12, ge=1, le=ANALYTICS_MONTHS_MAX)
+) -> RevenutAnalyticsMRR:
+    """
+    Returns the monthly recurring revenue of an account at the end of every month, its new, churned and net new MRR and its gross volume
+    - **account**: Account identifier returned by OAuth provider
+    - **tzIdentifier**: Timezone identifier https://en.wikipedia.org/wiki/List_of_tz_database_time_zones
+    - **months**: Number of months up to the current one
+    """
+
+    return RevenutAnalyticsMRR.from_months(account, tzIdentifier, await read_analytics(account, tzIdentifier, months))
+
+@app.get("/v1/analytics/churn", response_model=RevenutAnalyticsChurn, status_code=status.HTTP_200_OK, summary="Churn over time")
+async def read_analytics_churn(
+    account: str
+    , tzIdentifier: str
+    , months: int = Query(default=12, ge=1, le=ANALYTICS_MONTHS_MAX)
+) -> RevenutAnalyticsChurn:
+    """
+    Returns the subscribers and MRR of an account lost every month relative to the start of the month
+    - **account**: Account identifier returned by OAuth provider
+    - **tzIdentifier**: Timezone identifier https://en.wikipedia.org/wiki/List_of_tz_database_time_zones
+    - **months**: Number of months up to the current one
+    """
+
+    return RevenutAnalyticsChurn.from_months(account, tzIdentifier, await read_analytics(account, tzIdentifier, months))
+
+@app.get("/v1/analytics/cohorts", response_model=RevenutAnalyticsCohorts, status_code=status.HTTP_200_OK, summary="Trial conversion by signup cohort")
+async def read_analytics_cohorts(
+    account: str
+    , tzIdentifier: str
+    , months: int = Query(default=12, ge=1, le=ANALYTICS_MONTHS_MAX)
+) -> RevenutAnalyticsCohorts:
+    """
+    Returns the trials of the subscriptions created every month and how many of them converted to paid subscriptions
+    - **account**: Account identifier returned by OAuth provider
+    - **tzIdentifier**: Timezone identifier https://en.wikipedia.org/wiki/List_of_tz_database_time_zones
+    - **months**: Number of months up to the current one
+    """
+
+    return RevenutAnalyticsCohorts.from_months(account, tzIdentifier, await read_analytics(account, tzIdentifier, months))
+
+async def read_analytics(account: str, tzIdentifier: str, months: int):
+    """
+    Returns the computed months of the analytics endpoints, stored months only being recomputed once records of their period change
+    """
+
+    try:
+        zoneinfo.ZoneInfo(tzIdentifier)
+    except (ValueError, zoneinfo.ZoneInfoNotFoundError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unknown tzIdentifier")
+
+    return await RevenutStripe.analytics(account, tzIdentifier, months)
+
 @app.get("/v1/logout", response_model=RevenutStripe, status_code=status.HTTP_401_UNAUTHORIZED, summary="Logout")
-def read_logout(
+async def read_logout(
     response: Response
     , account: str
 ) -> RevenutStripe:
     """
-    Revokes access to requested account
+    Revokes access to requested account, then evicts its cached dashboards and stored records from every worker and ends its live sessions
     - **account**: Account identifier
     """
 
     rStripe = RevenutStripe()
-    account_id = rStripe.revoke(account)
+    # dashboards other workers compute until they drop the account fail authorization rather than get cached
+    account_id = await rStripe.revoke(account)
+    await RevenutStripe.disconnect(account)
 
     if (account_id):
         rStripe.Status = RevenutAuthorizationType.REVOKED
@@ -103,6 +367,29 @@ def read_logout(
 
     return rStripe
 
+@app.post("/v1/webhooks/stripe", status_code=status.HTTP_200_OK, summary="Stripe webhook")
+async def read_webhook(
+    request: Request
+    , stripe_signature: str | None = Header(default=None)
+) -> bool:
+    """
+    Receives events of connected accounts and applies them as deltas to cached dashboards
+    - **Stripe-Signature**: Signature of the payload https://stripe.com/docs/webhooks#verify-events
+    """
+
+    webhook = RevenutWebhook()
+
+    # without the signing secret no event can be verified
+    if (not webhook.secret):
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="STRIPE_WEBHOOK_SECRET is not configured")
+
+    try:
+        event = webhook.construct(await request.body(), stripe_signature)
+    except (ValueError, stripe.error.SignatureVerificationError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST)
+
+    return await webhook.apply(event)
+
 if __name__ == "__main__":
     config = Config()
     config.bind = ["localhost:8000"]
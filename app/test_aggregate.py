@@ -0,0 +1,36 @@
+import numpy
+
+from internal.aggregate_module import RevenutChargeColumns, RevenutSubscriptionColumns, RevenutCustomerColumns
+
+def test_charge_windows():
+	charges = RevenutChargeColumns.from_rows([(300, 500, True), (100, 1000, True), (200, 2000, False), (300, 250, True)])
+
+	assert charges.windows([(100, 300), (101, 299), (300, 300.5), (400, 500)]) == [
+		dict(amount=17.5, count=3)
+		, dict(amount=0, count=0)
+		, dict(amount=7.5, count=2)
+		, dict(amount=0, count=0)
+	]
+	assert RevenutChargeColumns.from_rows([]).windows([(0, 1)]) == [dict(amount=0, count=0)]
+
+def test_subscription_totals():
+	subscriptions = RevenutSubscriptionColumns.from_rows([(10, 100, 1000, 'active'), (20, 200, 500, 'trialing'), (30, 300, None, 'trialing'), (40, 100, 700, 'canceled')])
+	mask = subscriptions.where('trialing') & (subscriptions.current_period_end <= 300)
+
+	assert subscriptions.total(mask) == dict(amount=5, count=2)
+	assert subscriptions.total(subscriptions.where('active', 'canceled')) == dict(amount=17, count=2)
+
+def test_customer_count():
+	customers = RevenutCustomerColumns(numpy.array([5.0, 1.0, 3.0, 3.0]))
+
+	assert customers.count(3, 5) == 3
+	assert customers.count(6, 2) == 0
+
+def test_array_builder():
+	builder = RevenutSubscriptionColumns.builder()
+	builder.extend(RevenutSubscriptionColumns.row(i, i, 100, 'active') for i in range(1500))
+	builder.extend([RevenutSubscriptionColumns.row(0, 0, 200, 'trialing')])
+	subscriptions = RevenutSubscriptionColumns.from_array(builder.array())
+
+	assert len(subscriptions) == 1501
+	assert subscriptions.total(subscriptions.where('trialing')) == dict(amount=2, count=1)
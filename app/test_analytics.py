@@ -0,0 +1,64 @@
+import datetime
+
+import pandas
+
+from fastapi.testclient import TestClient
+from fastapi import status
+
+from main import app
+from internal.aggregate_module import RevenutChargeColumns
+from internal.analytics_module import RevenutAnalyticsChurn, analytics_months, refresh_analytics
+from internal.store_module import RevenutStore, RevenutSubscription
+
+client = TestClient(app)
+
+JANUARY, FEBRUARY, MARCH = 1672531200, 1675209600, 1677628800
+DAY = 24 * 60 * 60
+
+SUBSCRIPTIONS = [
+	RevenutSubscription('sub_1', 'cus_1', 'active', JANUARY + 4 * DAY, 0, 0, None, None, None, None, 1000, 'month', 1)
+	, RevenutSubscription('sub_2', 'cus_2', 'canceled', JANUARY + 9 * DAY, 0, 0, JANUARY + 9 * DAY, JANUARY + 23 * DAY, FEBRUARY + 14 * DAY, FEBRUARY + 14 * DAY, 12000, 'year', 1)
+	, RevenutSubscription('sub_3', 'cus_3', 'canceled', FEBRUARY + DAY, 0, 0, FEBRUARY + DAY, FEBRUARY + 19 * DAY, FEBRUARY + 9 * DAY, FEBRUARY + 9 * DAY, 500, 'month', 1)
+	, RevenutSubscription('sub_4', 'cus_4', 'incomplete_expired', JANUARY + DAY, 0, 0, None, None, None, None, 700, 'month', 1)
+]
+
+def test_analytics_months():
+	subscriptions = pandas.DataFrame.from_records(SUBSCRIPTIONS, columns=list(RevenutSubscription._fields))
+	charges = RevenutChargeColumns.from_rows([(FEBRUARY + DAY, 2500, True)])
+	january, february = analytics_months(subscriptions, charges, [(datetime.date(2023, 1, 1), JANUARY, FEBRUARY), (datetime.date(2023, 2, 1), FEBRUARY, MARCH)], MARCH)
+
+	assert january == ('2023-01-01', 2000, 2000, 0, 2, 2, 0, 0, 1, 1, 0)
+	assert february == ('2023-02-01', 1000, 0, 1000, 1, 0, 1, 2500, 1, 0, 0)
+
+	churn = RevenutAnalyticsChurn.from_months('acct_1', 'UTC', [january, february])
+	assert churn.Periods[0].CountChurnedPercent == 50
+	assert churn.Periods[0].VolumeMRRChurnedPercent == 50
+
+def test_analytics_incremental(tmp_path):
+	store = RevenutStore(str(tmp_path / 'revenut.db'))
+	store.upsert_subscriptions('acct_1', SUBSCRIPTIONS)
+	dateFrom = datetime.date(2023, 1, 1)
+
+	months = refresh_analytics(store, 'acct_1', 'UTC', dateFrom)
+	assert [month.mrr for month in months[:3]] == [2000, 1000, 1000]
+
+	# months before the changed records are kept while later ones are recomputed
+	store.set_analytics('acct_1', 'UTC', [months[0]._replace(gross=1)], store.cursor('acct_1', 'analytics:UTC'))
+	store.upsert_subscriptions('acct_1', [SUBSCRIPTIONS[0]._replace(id='sub_5', created=FEBRUARY + DAY, amount=3000)])
+
+	months = refresh_analytics(store, 'acct_1', 'UTC', dateFrom)
+	assert months[0].gross == 1
+	assert [month.mrr for month in months[:3]] == [2000, 4000, 4000]
+
+def test_read_analytics(fake_stripe):
+	fake_stripe.lists['/v1/subscriptions'] = [dict(id='sub_1', object='subscription', customer='cus_1', status='active', created=JANUARY, current_period_start=JANUARY, current_period_end=FEBRUARY, plan=dict(amount=1000, interval='month', interval_count=1))]
+	params = dict(account='acct_1', tzIdentifier='America/Los_Angeles', months=3)
+
+	response = client.get("/v1/analytics/mrr", params=params)
+	assert response.status_code == status.HTTP_200_OK
+	assert [period['VolumeMRR'] for period in response.json()['Periods']] == [10, 10, 10]
+	assert fake_stripe.paths().count('/v1/subscriptions') == 2
+
+	response = client.get("/v1/analytics/cohorts", params=params)
+	assert len(response.json()['Periods']) == 3
+	assert client.get("/v1/analytics/churn", params=dict(params, months=25)).status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
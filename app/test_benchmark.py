@@ -0,0 +1,28 @@
+import asyncio
+
+import httpx
+
+from internal.benchmark_module import RevenutFakeStripe, import_profile
+from internal.client_module import RevenutStripeClient
+
+def test_fake_stripe_pages():
+	fake = RevenutFakeStripe(page_size=50)
+
+	async def fetch():
+		client = RevenutStripeClient(api_key='sk_test', transport=httpx.ASGITransport(app=fake))
+		charges = [c async for page in client.shards('/v1/charges', lambda c: c, 'acct_2000', fake.now - 400 * 24 * 60 * 60, fake.now) for c in page]
+		account = await client.retrieve('/v1/accounts/acct_2000')
+		return charges, account
+
+	charges, account = asyncio.run(fetch())
+	assert sorted(c['id'] for c in charges) == sorted(f'ch_{i}' for i in range(2000))
+	assert account.business_profile.name == 'Benchmark acct_2000'
+	assert fake.calls['acct_2000'] > 2000 // 50
+
+def test_import_profile():
+	profile = import_profile('main')
+
+	assert profile['import_ms'] > 0
+	assert 'fastapi' in profile['packages']
+	# analytics load pandas on their first request only
+	assert 'pandas' not in profile['packages']
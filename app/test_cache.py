@@ -0,0 +1,108 @@
+import asyncio
+import json
+
+from internal.cache_module import RevenutCache, RevenutCacheEntry
+from internal.shared_module import RevenutSharedCache
+
+def test_cache_lru():
+	cache = RevenutCache(maxsize=2, ttl=60)
+	cache.set('a', RevenutCacheEntry(1, b'1'))
+	cache.set('b', RevenutCacheEntry(2, b'2'))
+	cache.get('a')
+	cache.set('c', RevenutCacheEntry(3, b'3'))
+
+	assert cache.keys() == ['a', 'c']
+
+def test_cache_stale_while_revalidate():
+	cache = RevenutCache(ttl=0, stale=60)
+	calls = []
+
+	async def compute() -> RevenutCacheEntry:
+		calls.append(len(calls))
+		await asyncio.sleep(0.01)
+		return RevenutCacheEntry(len(calls), str(len(calls)).encode())
+
+	async def fetch():
+		first = await cache.fetch('key', compute)
+		stale = await asyncio.gather(*[cache.fetch('key', compute) for _ in range(3)])
+		await asyncio.sleep(0.05)
+		return first, stale, cache.get('key')
+
+	first, stale, refreshed = asyncio.run(fetch())
+	assert first.value == 1
+	assert [entry.value for entry in stale] == [1, 1, 1]
+	assert refreshed.value == 2
+	assert len(calls) == 2
+
+def test_cache_uncacheable_refresh():
+	cache = RevenutCache(ttl=0, stale=60)
+	cache.set('key', RevenutCacheEntry(1, b'1'))
+
+	async def compute() -> RevenutCacheEntry:
+		return RevenutCacheEntry(None, b'{}', cacheable=False)
+
+	assert asyncio.run(cache.refresh('key', compute)).value is None
+	assert cache.get('key') is None
+
+def test_cache_shared_across_workers(tmp_path):
+	path = str(tmp_path / 'cache.db')
+	workers = [RevenutCache(ttl=60, shared=RevenutSharedCache(path)) for _ in range(2)]
+	calls = []
+
+	async def compute() -> RevenutCacheEntry:
+		calls.append(len(calls))
+		await asyncio.sleep(0.2)
+		return RevenutCacheEntry(dict(calls=len(calls)), json.dumps(dict(calls=len(calls))).encode())
+
+	async def fetch():
+		# both workers miss at once but only the one holding the lease computes
+		return await asyncio.gather(*[cache.fetch(('acct_1', 'UTC'), compute, json.loads) for cache in workers])
+
+	first, second = asyncio.run(fetch())
+	assert len(calls) == 1
+	assert first.value == second.value == dict(calls=1)
+	assert first.etag == second.etag
+
+	# a third worker loads the entry instead of computing it
+	third = RevenutCache(ttl=60, shared=RevenutSharedCache(path))
+	assert asyncio.run(third.fetch(('acct_1', 'UTC'), compute, json.loads)).value == dict(calls=1)
+	assert len(calls) == 1
+
+	third.shared.discard(('acct_1',))
+	assert third.shared.get(('acct_1', 'UTC')) is None
+
+def test_cache_revoked_across_workers(tmp_path):
+	path = str(tmp_path / 'cache.db')
+	workers = [RevenutCache(ttl=60, shared=RevenutSharedCache(path), sync=0) for _ in range(2)]
+	calls = []
+
+	async def compute() -> RevenutCacheEntry:
+		calls.append(len(calls))
+		await asyncio.sleep(0.05)
+		return RevenutCacheEntry(len(calls), str(len(calls)).encode())
+
+	async def run():
+		for cache in workers:
+			await cache.fetch(('acct_1', 'UTC'), compute, json.loads)
+
+		flight = asyncio.ensure_future(workers[0].fetch(('acct_2', 'UTC'), compute, json.loads))
+		await asyncio.sleep(0.01)
+		workers[0].revoke('acct_1')
+		workers[0].revoke('acct_2')
+
+		# the computation of a revoked account is cancelled and the other worker drops its local entry
+		assert (await asyncio.gather(flight, return_exceptions=True))[0].__class__ is asyncio.CancelledError
+		# revocations are written in the background by the thread of the shared cache
+		await workers[0]._call(lambda: None)
+		return await workers[1].fetch(('acct_1', 'UTC'), compute, json.loads)
+
+	assert asyncio.run(run()).value == 3
+	assert len(calls) == 3
+
+def test_cache_entry_matches():
+	entry = RevenutCacheEntry(None, b'{}')
+
+	assert entry.matches(f'"other", W/{entry.etag}')
+	assert entry.matches('*')
+	assert not entry.matches('"other"')
+	assert not entry.matches(None)
@@ -0,0 +1,29 @@
+import asyncio
+
+import httpx
+
+from internal.client_module import RevenutStripeClient
+
+def test_shards():
+	charges = [dict(id=f'ch_{i}', created=1000 + i // 3) for i in range(3000)][::-1]
+	requests = []
+
+	def handler(request: httpx.Request) -> httpx.Response:
+		params = request.url.params
+		data = [c for c in charges if int(params['created[gte]']) <= c['created'] < int(params['created[lt]'])]
+
+		if ('starting_after' in params):
+			data = data[[c['id'] for c in data].index(params['starting_after']) + 1:]
+
+		requests.append(request)
+		limit = int(params['limit'])
+
+		return httpx.Response(200, json=dict(object='list', data=data[:limit], has_more=len(data) > limit))
+
+	async def fetch():
+		client = RevenutStripeClient(api_key='sk_test', transport=httpx.MockTransport(handler))
+		return [record async for page in client.shards('/v1/charges', lambda c: c['id'], 'acct_1', 1000, 2000) for record in page]
+
+	ids = asyncio.run(fetch())
+	assert sorted(ids) == sorted(c['id'] for c in charges)
+	assert len({request.url.params['created[gte]'] for request in requests}) > 1
@@ -0,0 +1,60 @@
+import asyncio
+import json
+
+from internal.cache_module import RevenutCache, RevenutCacheEntry
+from internal.live_module import RevenutLive
+
+def entry(**fields) -> RevenutCacheEntry:
+	return RevenutCacheEntry(fields, json.dumps(fields).encode())
+
+def test_live_patches():
+	refreshes = []
+
+	async def run():
+		cache = RevenutCache()
+		live = RevenutLive(cache, interval=0.01)
+		key = ('acct_1', 'America/Los_Angeles', None)
+
+		async def refresh():
+			refreshes.append(True)
+
+		first = live.stream(key[:2], entry(AccountID='acct_1', VolumeGrossToday=10), refresh)
+		second = live.stream(key[:2], entry(AccountID='acct_1', VolumeGrossToday=10), refresh)
+		events = [await first.__anext__(), await second.__anext__()]
+		assert len(live) == 2
+
+		cache.set(key, entry(AccountID='acct_1', VolumeGrossToday=10))
+		cache.set(key, entry(AccountID='acct_1', VolumeGrossToday=22.5))
+		events += [await first.__anext__(), await second.__anext__()]
+		await asyncio.sleep(0.05)
+
+		await first.aclose()
+		await second.aclose()
+		assert len(live) == 0
+		assert live._refreshers == {}
+
+		return events
+
+	events = asyncio.run(run())
+	assert events[0] == b'event: snapshot\ndata: {"AccountID": "acct_1", "VolumeGrossToday": 10}\n\n'
+	assert events[2] == events[3] == b'event: patch\ndata: {"VolumeGrossToday": 22.5}\n\n'
+	assert len(refreshes) > 1
+
+def test_live_revoked():
+	async def run():
+		cache = RevenutCache()
+		live = RevenutLive(cache, interval=60)
+
+		async def refresh():
+			pass
+
+		stream = live.stream(('acct_1', 'UTC'), entry(AccountID='acct_1'), refresh)
+		await stream.__anext__()
+		await asyncio.sleep(0.01)
+		cache.revoke('acct_1')
+
+		# the session ends instead of streaming the dashboards of a logged out account
+		assert [event async for event in stream] == []
+		assert len(live) == 0
+
+	asyncio.run(run())
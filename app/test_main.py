@@ -1,7 +1,19 @@
+import json
+import time
+import asyncio
+import datetime
+
+import httpx
+
 from fastapi.testclient import TestClient
 from fastapi import status
 
 from main import app
+from internal import stripe_module
+from internal.stripe_module import RevenutStripe
+from internal.enums import RevenutAuthorizationType
+
+import client_module
 
 client = TestClient(app)
 
@@ -13,4 +25,189 @@ def test_read_root():
 def test_read_health():
 	response = client.get("/health")
 	assert response.status_code == status.HTTP_200_OK
-	assert response.json() is True
\ No newline at end of file
+	assert response.json() is True
+
+def test_read_ready(fake_stripe):
+	assert client.get("/ready").status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+
+	with TestClient(app) as started:
+		for _ in range(500):
+			if (started.get("/ready").status_code == status.HTTP_200_OK):
+				break
+
+			time.sleep(0.01)
+
+		assert started.get("/ready").json() is True
+
+	# the pool was opened before any dashboard was requested
+	assert [request.method for request in fake_stripe.requests] == ['HEAD'] * 4
+
+def test_warm_unreachable(store, monkeypatch):
+	def unreachable(request):
+		raise httpx.ConnectError('Connection refused', request=request)
+
+	monkeypatch.setattr(stripe_module, 'default_client', lambda: client_module.RevenutStripeClient(api_key='sk_test', transport=httpx.MockTransport(unreachable)))
+	assert asyncio.run(RevenutStripe.warm(attempts=1)) is False
+
+def test_read_account(fake_stripe):
+	now = int(time.time())
+	previous = int(datetime.datetime.combine(datetime.date.today().replace(day=1) - datetime.timedelta(days=1), datetime.time(12), datetime.timezone.utc).timestamp())
+	fake_stripe.lists['/v1/charges'] = [
+		dict(id='ch_1', object='charge', created=now, amount=1250, status='succeeded', refunded=False, disputed=False)
+		, dict(id='ch_0', object='charge', created=previous, amount=1000, status='succeeded', refunded=False, disputed=False)
+	]
+	fake_stripe.objects['/v1/accounts/acct_1'] = dict(id='acct_1', object='account', business_profile=dict(name='Revenut'), settings=dict(branding=dict(icon='file_1')))
+	fake_stripe.objects['/v1/file_links'] = dict(id='link_1', object='file_link', url='https://files.stripe.com/links/1')
+
+	response = client.get("/v1/dashboard", params=dict(account='acct_1', tzIdentifier='America/Los_Angeles'))
+	assert response.status_code == status.HTTP_200_OK
+	assert response.json()['AccountName'] == 'Revenut'
+	assert response.json()['AccountIconURL'] == 'https://files.stripe.com/links/1'
+	assert response.json()['VolumeGrossMonthCurrent'] == 12.5
+	assert response.json()['VolumeGrossMonthPrevious'] == 10
+	assert all(request.headers['Stripe-Account'] == 'acct_1' for request in fake_stripe.requests if request.url.path != '/v1/accounts/acct_1')
+
+	requests = len(fake_stripe.requests)
+	response = client.get("/v1/dashboard", params=dict(account='acct_1', tzIdentifier='America/Los_Angeles'), headers={"If-None-Match": response.headers['ETag']})
+	assert response.status_code == status.HTTP_304_NOT_MODIFIED
+	assert len(fake_stripe.requests) == requests
+
+def test_read_account_coalesced(fake_stripe):
+	fake_stripe.objects['/v1/accounts/acct_1'] = dict(id='acct_1', object='account', business_profile=dict(name='Revenut'), settings=dict(branding=dict(icon=None)))
+
+	async def read_accounts():
+		return await asyncio.gather(*[RevenutStripe.dashboard('acct_1', 'America/Los_Angeles') for _ in range(5)])
+
+	dashboards = asyncio.run(read_accounts())
+	assert all(dashboard.value is dashboards[0].value for dashboard in dashboards)
+	assert fake_stripe.paths().count('/v1/accounts/acct_1') == 1
+
+def test_read_account_profile_stored(fake_stripe):
+	fake_stripe.objects['/v1/accounts/acct_1'] = dict(id='acct_1', object='account', business_profile=dict(name='Revenut'), settings=dict(branding=dict(icon='file_1')))
+	fake_stripe.objects['/v1/file_links'] = dict(id='link_1', object='file_link', url='https://files.stripe.com/links/1', expires_at=int(time.time()) + 24 * 60 * 60)
+	params = dict(account='acct_1', tzIdentifier='America/Los_Angeles')
+
+	assert client.get("/v1/dashboard", params=params).json()['AccountIconURL'] == 'https://files.stripe.com/links/1'
+	assert client.get("/v1/dashboard", params=dict(params, tzIdentifier='Europe/Paris')).json()['AccountIconURL'] == 'https://files.stripe.com/links/1'
+	assert fake_stripe.paths().count('/v1/accounts/acct_1') == 1
+	assert fake_stripe.paths().count('/v1/file_links') == 1
+
+	fake_stripe.errors['/v1/charges'] = 401
+	response = client.get("/v1/dashboard", params=dict(params, tzIdentifier='Asia/Tokyo'))
+	assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+def test_read_account_deadline(fake_stripe, monkeypatch):
+	fake_stripe.objects['/v1/accounts/acct_1'] = dict(id='acct_1', object='account', business_profile=dict(name='Revenut'), settings=dict(branding=dict(icon=None)))
+	fake_stripe.lists['/v1/charges'] = [dict(id='ch_1', object='charge', created=int(time.time()), amount=1250, status='succeeded', refunded=False, disputed=False)]
+	subscriptions = RevenutStripe.subscriptions
+
+	async def slow_subscriptions(self, *a):
+		await asyncio.sleep(0.5)
+		return await subscriptions(self, *a)
+
+	async def read_account():
+		first = await RevenutStripe.dashboard('acct_1', 'America/Los_Angeles', deadline=0.1)
+		await asyncio.sleep(0.5)
+		last = await RevenutStripe.dashboard('acct_1', 'America/Los_Angeles')
+		fake_stripe.lists['/v1/charges'].append(dict(id='ch_2', object='charge', created=int(time.time()), amount=750, status='succeeded', refunded=False, disputed=False))
+
+		partial = await RevenutStripe.dashboard('acct_1', 'America/Los_Angeles', refresh=True, deadline=0.1)
+		await asyncio.sleep(0.5)
+		return first, last, partial, await RevenutStripe.dashboard('acct_1', 'America/Los_Angeles')
+
+	monkeypatch.setattr(RevenutStripe, 'subscriptions', slow_subscriptions)
+	first, last, partial, refreshed = asyncio.run(read_account())
+
+	# nothing is known yet of the sections still computing
+	assert first.value.Sections['subscriptions'].IsStale and first.value.Sections['subscriptions'].DateUpdated is None
+	assert first.value.VolumeGrossToday == 12.5
+
+	assert last.value.VolumeGrossToday == 12.5
+	assert partial.value.VolumeGrossToday == 20
+	assert partial.value.AccountName == 'Revenut'
+	assert {name: section.IsStale for name, section in partial.value.Sections.items()} == dict(account=False, charges=False, subscriptions=True, customers=False)
+	assert partial.value.Sections['subscriptions'].DateUpdated == last.value.Sections['subscriptions'].DateUpdated
+	assert not partial.cacheable
+	assert refreshed.value.VolumeGrossToday == 20
+	assert not any(section.IsStale for section in refreshed.value.Sections.values())
+
+def test_read_account_connect_logout(fake_stripe, store):
+	fake_stripe.objects['/oauth/token'] = dict(stripe_user_id='acct_1', scope='read_only', livemode=False)
+	fake_stripe.objects['/oauth/deauthorize'] = dict(stripe_user_id='acct_1')
+	fake_stripe.objects['/v1/accounts/acct_1'] = dict(id='acct_1', object='account', business_profile=dict(name='Revenut'), settings=dict(branding=dict(icon=None)))
+	fake_stripe.lists['/v1/charges'] = [dict(id='ch_1', object='charge', created=int(time.time()), amount=1250, status='succeeded', refunded=False, disputed=False)]
+	params = dict(code='ac_1', tzIdentifier='America/Los_Angeles')
+
+	assert client.get("/v1/dashboard", params=params).json()['VolumeGrossToday'] == 12.5
+	assert client.get("/v1/dashboard", params=params).json()['VolumeGrossToday'] == 12.5
+	assert fake_stripe.paths().count('/oauth/token') == 1
+	assert store.connection_code(store.connection().execute('SELECT code FROM connections').fetchone()[0]).id == 'acct_1'
+
+	requests = len(fake_stripe.requests)
+	response = client.get("/v1/logout", params=dict(account='acct_1'))
+	assert response.json()['Status'] == RevenutAuthorizationType.REVOKED
+	assert fake_stripe.paths()[requests:] == ['/oauth/deauthorize']
+	assert store.charges('acct_1', 0) == []
+	assert store.account('acct_1') is None
+	assert store.cursor('acct_1', 'charges_to') is None
+
+	# the account is connected again with a new code
+	client.get("/v1/dashboard", params=dict(params, code='ac_2'))
+	assert fake_stripe.paths().count('/oauth/token') == 2
+	assert fake_stripe.paths().count('/v1/charges') == 2
+
+def test_read_history(fake_stripe):
+	fake_stripe.lists['/v1/charges'] = [dict(id='ch_1', object='charge', created=1678690800, amount=500, status='succeeded', refunded=False, disputed=False)]
+	fake_stripe.lists['/v1/customers'] = [dict(id='cus_1', object='customer', created=1678608000)]
+
+	response = client.get("/v1/dashboard/history", params={'account': 'acct_1', 'tzIdentifier': 'America/Los_Angeles', 'from': '2023-03-01', 'to': '2023-04-30', 'granularity': 'month'})
+	assert response.status_code == status.HTTP_200_OK
+	assert [(p['DateStart'], p['VolumeGross'], p['CountCustomers']) for p in response.json()['Periods']] == [('2023-03-01', 5, 1), ('2023-04-01', 0, 0)]
+
+	response = client.get("/v1/dashboard/history", params={'account': 'acct_1', 'tzIdentifier': 'America/Los_Angeles', 'from': '2023-03-12', 'to': '2023-03-18', 'granularity': 'week'})
+	assert [p['DateStart'] for p in response.json()['Periods']] == ['2023-03-06', '2023-03-13']
+
+	# an earlier range only paginates the days never synced besides the time elapsed since the last sync
+	requests = len(fake_stripe.requests)
+	client.get("/v1/dashboard/history", params={'account': 'acct_1', 'tzIdentifier': 'America/Los_Angeles', 'from': '2023-02-01', 'to': '2023-02-28'})
+	bounds = sorted((int(request.url.params['created[gte]']), int(request.url.params['created[lt]'])) for request in fake_stripe.requests[requests:] if request.url.path == '/v1/customers')
+	assert bounds[0][0] == 1675238400 and max(lt for gte, lt in bounds if gte < 1677657600) == 1677657601
+
+	response = client.get("/v1/dashboard/history", params={'account': 'acct_1', 'tzIdentifier': 'America/Los_Angeles', 'from': '1970-01-01', 'to': '9999-12-31'})
+	assert response.status_code == status.HTTP_400_BAD_REQUEST
+	response = client.get("/v1/dashboard/history", params={'account': 'acct_1', 'tzIdentifier': 'America/Los_Angeles', 'from': '1970-01-01', 'to': '1970-12-31'})
+	assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+	response = client.get("/v1/dashboard/history", params={'account': 'acct_1', 'tzIdentifier': 'Mars/Olympus', 'from': '2023-03-01', 'to': '2023-03-31'})
+	assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+def test_read_metrics(fake_stripe):
+	fake_stripe.objects['/v1/accounts/acct_1'] = dict(id='acct_1', object='account', business_profile=dict(name='Revenut'), settings=dict(branding=dict(icon=None)))
+
+	response = client.get("/v1/dashboard", params=dict(account='acct_1', tzIdentifier='America/Los_Angeles'))
+	stages = [timing.split(';')[0] for timing in response.headers['Server-Timing'].split(', ')]
+	assert {'cache', 'charges', 'subscriptions', 'customers', 'account', 'aggregate_charges', 'total'} <= set(stages)
+
+	response = client.get("/v1/dashboard", params=dict(account='acct_1', tzIdentifier='America/Los_Angeles'))
+	assert response.headers['Server-Timing'].startswith('cache;desc="hit"')
+
+	response = client.get("/metrics")
+	assert response.status_code == status.HTTP_200_OK
+	assert 'revenut_stage_seconds_bucket{stage="charges",le="+Inf"}' in response.text
+	assert 'revenut_cache_requests_total{result="hit"}' in response.text
+	assert 'revenut_stripe_pages_total{resource="/v1/charges"}' in response.text
+
+def test_read_accounts(fake_stripe):
+	fake_stripe.objects['/v1/accounts/acct_1'] = dict(id='acct_1', object='account', business_profile=dict(name='Revenut'), settings=dict(branding=dict(icon=None)))
+	fake_stripe.objects['/v1/accounts/acct_2'] = dict(id='acct_2', object='account', business_profile=dict(name='Revenut 2'), settings=dict(branding=dict(icon=None)))
+	fake_stripe.errors['/v1/accounts/acct_3'] = 403
+
+	response = client.get("/v1/dashboards", params=dict(account=['acct_1', 'acct_2', 'acct_3', 'acct_1'], tzIdentifier='America/Los_Angeles'))
+	assert response.status_code == status.HTTP_200_OK
+	assert response.headers['Content-Type'] == 'application/x-ndjson'
+
+	dashboards = {dashboard['AccountID']: dashboard for dashboard in map(json.loads, response.text.splitlines())}
+	assert dashboards['acct_1']['AccountName'] == 'Revenut'
+	assert dashboards['acct_2']['AccountName'] == 'Revenut 2'
+	assert dashboards['acct_3']['IsAuthorized'] is False
+	assert len(response.text.splitlines()) == 3
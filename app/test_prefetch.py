@@ -0,0 +1,90 @@
+import asyncio
+import datetime
+
+from internal.prefetch_module import RevenutPrefetch
+
+def test_prefetch_due_midnight():
+	prefetch = RevenutPrefetch(interval=3600)
+	# 23:30 in Los Angeles
+	now = datetime.datetime(2023, 3, 31, 23, 30, tzinfo=datetime.timezone(datetime.timedelta(hours=-7))).timestamp()
+	assert prefetch.due('America/Los_Angeles', now) == now + 30 * 60 + prefetch.grace
+	assert prefetch.due('Europe/London', now) == now + 3600
+
+def test_prefetch_run():
+	refreshes = []
+
+	async def run():
+		prefetch = RevenutPrefetch(interval=3600)
+		prefetch.touch('acct_1', 'America/Los_Angeles')
+		prefetch._accounts[('acct_1', 'America/Los_Angeles')][1] = 0
+
+		async def refresh(account_id, timezone):
+			refreshes.append((account_id, timezone))
+			return True
+
+		task = prefetch.start(refresh)
+		await asyncio.sleep(0.05)
+		task.cancel()
+
+		return prefetch
+
+	prefetch = asyncio.run(run())
+	assert refreshes == [('acct_1', 'America/Los_Angeles')]
+	assert prefetch._accounts[('acct_1', 'America/Los_Angeles')][1] > 0
+	assert RevenutPrefetch(interval=0).start(None) is None
+
+def test_prefetch_unauthorized_bounded():
+	async def run():
+		prefetch = RevenutPrefetch(interval=3600, maxsize=2)
+
+		for account_id in ['acct_1', 'acct_2', 'acct_3']:
+			prefetch.touch(account_id, 'UTC')
+
+		prefetch.touch('acct_2', 'UTC')
+		prefetch.touch('acct_4', 'UTC')
+		# the least recently requested accounts make room for new ones
+		assert list(prefetch._accounts) == [('acct_2', 'UTC'), ('acct_4', 'UTC')]
+
+		for key in prefetch._accounts:
+			prefetch._accounts[key][1] = 0
+
+		async def refresh(account_id, timezone):
+			return account_id != 'acct_4'
+
+		task = prefetch.start(refresh)
+		await asyncio.sleep(0.05)
+		task.cancel()
+
+		return prefetch
+
+	assert list(asyncio.run(run())._accounts) == [('acct_2', 'UTC')]
+
+def test_prefetch_slow_account():
+	refreshes = []
+
+	async def run():
+		prefetch = RevenutPrefetch(interval=3600)
+		prefetch.touch('acct_1', 'UTC')
+		prefetch._accounts[('acct_1', 'UTC')][1] = 0
+		stuck = asyncio.Event()
+
+		async def refresh(account_id, timezone):
+			refreshes.append(account_id)
+
+			if (account_id == 'acct_1'):
+				await stuck.wait()
+
+			return True
+
+		task = prefetch.start(refresh)
+		await asyncio.sleep(0.05)
+
+		# accounts due while another one is still prefetching are not held back by it
+		prefetch.touch('acct_2', 'UTC')
+		prefetch._accounts[('acct_2', 'UTC')][1] = 0
+		await asyncio.sleep(0.05)
+		task.cancel()
+		await asyncio.sleep(0.01)
+
+	asyncio.run(run())
+	assert refreshes == ['acct_1', 'acct_2']
@@ -0,0 +1,54 @@
+import asyncio
+
+import httpx
+
+from fastapi import status
+from fastapi.testclient import TestClient
+
+from main import app
+from internal.client_module import RevenutStripeClient
+from internal.scheduler_module import RevenutPriorityLimiter, RevenutScheduler
+from internal.enums import RevenutPriorityType
+
+def test_scheduler_retry_after():
+	responses = [httpx.Response(429, headers={'Retry-After': '0.05'}, json=dict(error=dict(message='Too many requests'))), httpx.Response(503, json=dict(error=dict(message='Unavailable'))), httpx.Response(200, json=dict(id='acct_1', object='account'))]
+
+	async def fetch():
+		client = RevenutStripeClient(api_key='sk_test', transport=httpx.MockTransport(lambda request: responses.pop(0)), scheduler=RevenutScheduler(backoff=0.01))
+		return await client.retrieve('/v1/accounts/acct_1'), client.scheduler._buckets[None].tokens
+
+	account, tokens = asyncio.run(fetch())
+	assert account.id == 'acct_1'
+	assert responses == []
+	assert tokens < 0
+
+def test_priority_limiter():
+	order = []
+
+	async def run():
+		limiter = RevenutPriorityLimiter(1)
+		await limiter.acquire(RevenutPriorityType.INTERACTIVE)
+
+		async def request(name, priority):
+			await limiter.acquire(priority)
+			order.append(name)
+			limiter.release()
+
+		tasks = [asyncio.ensure_future(request('background', RevenutPriorityType.BACKGROUND)), asyncio.ensure_future(request('interactive', RevenutPriorityType.INTERACTIVE))]
+		await asyncio.sleep(0)
+		limiter.release()
+		await asyncio.gather(*tasks)
+
+		return len(limiter)
+
+	assert asyncio.run(run()) == 0
+	assert order == ['interactive', 'background']
+
+def test_read_account_unavailable(fake_stripe, monkeypatch):
+	monkeypatch.setenv('STRIPE_MAX_RETRIES', '0')
+	fake_stripe.objects['/v1/accounts/acct_1'] = dict(id='acct_1', object='account', business_profile=dict(name='Revenut'), settings=dict(branding=dict(icon=None)))
+	fake_stripe.errors['/v1/charges'] = 500
+
+	response = TestClient(app).get("/v1/dashboard", params=dict(account='acct_1', tzIdentifier='America/Los_Angeles'))
+	assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+	assert response.headers['Retry-After']
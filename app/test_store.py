@@ -0,0 +1,71 @@
+import asyncio
+
+from internal.stripe_module import RevenutStripe
+from internal.store_module import RevenutCharge, RevenutStore, RevenutSubscription
+from internal.history_module import refresh_rollups
+
+def charge(id: str, created: int, amount: int = 1000, status: str = 'succeeded', refunded: bool = False, disputed: bool = False) -> dict:
+	return dict(id=id, object='charge', created=created, amount=amount, status=status, refunded=refunded, disputed=disputed)
+
+def test_store_sticky_flags(tmp_path):
+	store = RevenutStore(str(tmp_path / 'revenut.db'))
+	store.upsert_charges('acct_1', [RevenutCharge('ch_1', 100, 1000, 'succeeded', True, False)])
+	store.upsert_charges('acct_1', [RevenutCharge('ch_1', 100, 1000, 'succeeded', False, False)])
+	store.dispute_charges('acct_1', ['ch_1'])
+
+	assert store.charges('acct_1', 0) == [RevenutCharge('ch_1', 100, 1000, 'succeeded', True, True)]
+	assert store.charges('acct_2', 0) == []
+
+def test_transactions_incremental(store, fake_stripe):
+	fake_stripe.lists['/v1/charges'] = [charge('ch_1', 2000), charge('ch_2', 3000)]
+	fake_stripe.lists['/v1/events'] = [
+		dict(id='evt_2', object='event', type='charge.dispute.created', data=dict(object=dict(id='dp_1', object='dispute', charge='ch_2')))
+		, dict(id='evt_1', object='event', type='charge.refunded', data=dict(object=charge('ch_1', 2000, refunded=True)))
+	]
+
+	rStripe = RevenutStripe()
+	assert rStripe.transactions_date(asyncio.run(rStripe.transactions('acct_1', 1000)), 1000, 3000) == dict(amount=20, count=2)
+	assert fake_stripe.paths() == ['/v1/charges']
+	assert fake_stripe.requests[-1].url.params['created[gte]'] == '1000'
+	assert fake_stripe.requests[-1].headers['Stripe-Account'] == 'acct_1'
+
+	assert rStripe.transactions_date(asyncio.run(rStripe.transactions('acct_1', 1000)), 1000, 3000) == dict(amount=0, count=0)
+	assert fake_stripe.paths() == ['/v1/charges', '/v1/charges', '/v1/events']
+	assert int(fake_stripe.requests[-1].url.params['created[gte]']) > 1000
+	assert fake_stripe.requests[-1].url.params['types[0]'] == 'charge.succeeded'
+	assert [(c.refunded, c.disputed) for c in store.charges('acct_1', 0)] == [(True, False), (False, True)]
+
+def subscription(id: str, status: str, current_period_end: int, amount: int = 1000) -> dict:
+	return dict(id=id, object='subscription', customer='cus_1', status=status, created=1000, current_period_start=current_period_end - 100, current_period_end=current_period_end, plan=dict(amount=amount, interval='month', interval_count=1))
+
+def test_subscriptions_incremental(store, fake_stripe):
+	store.upsert_subscriptions('acct_1', [RevenutSubscription.from_stripe(subscription('sub_0', 'active', 2000))])
+	fake_stripe.lists['/v1/subscriptions'] = [subscription('sub_1', 'active', 2000), subscription('sub_2', 'trialing', 3000, 500)]
+	fake_stripe.objects['/v1/subscriptions/sub_0'] = subscription('sub_0', 'canceled', 2000)
+	fake_stripe.lists['/v1/events'] = [dict(id='evt_1', object='event', type='customer.subscription.deleted', data=dict(object=subscription('sub_1', 'canceled', 2000)))]
+
+	rStripe = RevenutStripe()
+	subscriptions = asyncio.run(rStripe.subscriptions('acct_1', 3000))
+	assert rStripe.subscriptions_upcoming(subscriptions, 3000) == 10
+	assert rStripe.subscriptions_trialing(subscriptions, 3000) == dict(amount=5, count=1)
+	assert sorted(request.url.params['status'] for request in fake_stripe.requests if request.url.path == '/v1/subscriptions') == ['active', 'trialing']
+	assert store.subscription('acct_1', 'sub_0').status == 'canceled'
+	assert len(asyncio.run(rStripe.subscriptions('acct_1', 2500))) == 0
+
+	assert fake_stripe.paths()[-1] == '/v1/events'
+	assert fake_stripe.requests[-1].url.params['types[0]'] == 'customer.subscription.created'
+	assert fake_stripe.paths().count('/v1/subscriptions') == 2
+
+def test_rollups_incremental(tmp_path):
+	store = RevenutStore(str(tmp_path / 'revenut.db'))
+	# 2023-03-12 is 23 hours long in Los Angeles
+	store.upsert_charges('acct_1', [RevenutCharge('ch_1', 1678608000, 1000, 'succeeded', False, False), RevenutCharge('ch_2', 1678690800, 500, 'succeeded', False, False)])
+
+	assert refresh_rollups(store, 'acct_1', 'America/Los_Angeles') == 2
+	assert refresh_rollups(store, 'acct_1', 'America/Los_Angeles') == 0
+	assert [(r.day, r.gross) for r in store.rollups('acct_1', 'America/Los_Angeles', '2023-03-01', '2023-03-31')] == [('2023-03-12', 1000), ('2023-03-13', 500)]
+
+	store.upsert_charges('acct_1', [RevenutCharge('ch_2', 1678690800, 500, 'succeeded', True, False)])
+	assert refresh_rollups(store, 'acct_1', 'America/Los_Angeles') == 1
+	assert store.rollups('acct_1', 'America/Los_Angeles', '2023-03-13', '2023-03-13')[0].refunds == 500
+	assert refresh_rollups(store, 'acct_1', 'UTC') == 2
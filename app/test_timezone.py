@@ -0,0 +1,18 @@
+import datetime
+
+from internal.stripe_module import RevenutStripe
+from internal.timezone_module import RevenutTimezone
+
+def test_timezone_dst():
+	timezone = RevenutTimezone('America/Los_Angeles', datetime.datetime(2023, 3, 12, 12, tzinfo=datetime.timezone.utc))
+	start, end = timezone.day(timezone.today)
+	assert end - start == 23 * 60 * 60
+	assert timezone.end(timezone.today).timestamp() < end
+
+def test_set_locale_month_boundaries():
+	rStripe = RevenutStripe(TimezonePreference='America/Los_Angeles', DateToday=datetime.datetime(2023, 3, 31, 20, tzinfo=datetime.timezone.utc))
+	assert rStripe.DateMonthStartPrevious.isoformat() == '2023-02-01T00:00:00-08:00'
+	assert rStripe.DateMonthEndPrevious.isoformat() == '2023-02-28T23:59:59.999999-08:00'
+	assert rStripe.DateMonthToDatePrevious.isoformat() == '2023-02-28T23:59:59.999999-08:00'
+	assert rStripe.DateMonthEndCurrent.isoformat() == '2023-03-31T23:59:59.999999-07:00'
+	assert rStripe.DateDayStartCurrent.isoformat() == '2023-03-31T00:00:00-07:00'
@@ -0,0 +1,63 @@
+import hmac
+import json
+import time
+import hashlib
+
+from fastapi.testclient import TestClient
+from fastapi import status
+
+from main import app
+
+client = TestClient(app)
+
+SECRET = 'whsec_test'
+
+def post_event(type: str, record: dict, account: str = 'acct_1', signature: str | None = None):
+	payload = json.dumps(dict(id=f'evt_{time.time_ns()}', object='event', type=type, account=account, data=dict(object=record)))
+	timestamp = int(time.time())
+	signature = signature or hmac.new(SECRET.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+
+	return client.post("/v1/webhooks/stripe", content=payload, headers={"Stripe-Signature": f"t={timestamp},v1={signature}"})
+
+def test_webhook_signature(fake_stripe, monkeypatch):
+	monkeypatch.setenv('STRIPE_WEBHOOK_SECRET', SECRET)
+
+	response = post_event('customer.created', dict(id='cus_1', object='customer', created=int(time.time())), signature='invalid')
+	assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+	monkeypatch.delenv('STRIPE_WEBHOOK_SECRET')
+	response = post_event('customer.created', dict(id='cus_1', object='customer', created=int(time.time())))
+	assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+
+def test_webhook_deltas(fake_stripe, store, monkeypatch):
+	monkeypatch.setenv('STRIPE_WEBHOOK_SECRET', SECRET)
+	now = int(time.time())
+	fake_stripe.objects['/v1/accounts/acct_1'] = dict(id='acct_1', object='account', business_profile=dict(name='Revenut'), settings=dict(branding=dict(icon=None)))
+	params = dict(account='acct_1', tzIdentifier='America/Los_Angeles')
+
+	assert client.get("/v1/dashboard", params=params).json()['CountPaymentsToday'] == 0
+	requests = len(fake_stripe.requests)
+
+	charge = dict(id='ch_1', object='charge', created=now, amount=2500, status='succeeded', refunded=False, disputed=False)
+	assert post_event('charge.succeeded', charge).json() is True
+	assert post_event('charge.succeeded', charge).json() is True
+	assert post_event('customer.created', dict(id='cus_1', object='customer', created=now)).json() is True
+	assert post_event('customer.created', dict(id='cus_1', object='customer', created=now)).json() is False
+	assert post_event('customer.subscription.created', dict(id='sub_1', object='subscription', status='trialing', created=now, current_period_start=now, current_period_end=now, plan=dict(amount=900))).json() is True
+
+	dashboard = client.get("/v1/dashboard", params=params).json()
+	assert (dashboard['VolumeGrossToday'], dashboard['CountPaymentsToday'], dashboard['CountTrialingToday']) == (25, 1, 1)
+	assert (dashboard['VolumeTrialing'], dashboard['CountTrialingMonthCurrent']) == (9, 1)
+
+	post_event('charge.dispute.created', dict(id='dp_1', object='dispute', charge='ch_1'))
+	post_event('customer.subscription.updated', dict(id='sub_1', object='subscription', status='active', created=now, current_period_start=now, current_period_end=now, plan=dict(amount=900)))
+
+	dashboard = client.get("/v1/dashboard", params=params).json()
+	assert (dashboard['VolumeGrossToday'], dashboard['CountPaymentsToday']) == (0, 0)
+	assert (dashboard['VolumeTrialing'], dashboard['VolumePending']) == (0, 9)
+	assert len(fake_stripe.requests) == requests
+
+	# events of a logged out account are not written back
+	client.get("/v1/logout", params=dict(account='acct_1'))
+	assert post_event('charge.succeeded', dict(charge, id='ch_2')).json() is False
+	assert store.charge('acct_1', 'ch_2') is None